@@ -1,26 +1,35 @@
 # system imports
-import base64
-import io
-import time
+import asyncio
+import os
 import uuid
 import json
+from functools import partial
+from pathlib import Path
 import debugpy
 
-debugpy.listen(("0.0.0.0", 5678))
+# Processes started by the server inherit this marker, so that the ingestion
+# workers (which are spawned and re-import the main module) don't try to
+# listen on the same port again, which would break the worker pool.
+if not os.environ.get("DEBUGPY_LISTENING"):
+    debugpy.listen(("0.0.0.0", 5678))
+    os.environ["DEBUGPY_LISTENING"] = "1"
 from tqdm.auto import tqdm
-from typing import Any, cast
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, cast
 
 # third party imports
 from flask import Flask, request, session, make_response, Response
 
 from flask_executor import Executor
 from flasgger import Swagger, swag_from
-from langchain_core.messages.base import messages_to_dict
-from werkzeug.datastructures import FileStorage
+from langchain_core.messages.base import message_to_dict
 
 # local imports
 from server_modules import set_logging_config
-from server_modules.methods import ServerMethods, ExperimentSessionMethods, DocumentMethods
+from server_modules.database import bootstrap_schemas, dispose_engines
+from server_modules.models import ChatHistoryBase, FinalAnswerBase
+from server_modules.methods import ServerMethods, ExperimentSessionMethods, DocumentMethods, delete_tmp_dir
+from server_modules.ingestion import ProgressCallback
+from server_modules.upload_jobs import UploadJobRegistry, UploadJobState
 from server_modules.class_defs import (
     IdentifyResponse,
     Identity,
@@ -28,9 +37,10 @@ from server_modules.class_defs import (
     PromptResponse,
     ChatHistoryResponse,
     WEMUploadResponse,
+    UploadStatusResponse,
     SessionQueryResponse,
 )
-from chatdoc.chatbot import Chatbot
+from chatdoc.chatbot_pool import ChatbotPool
 from chatdoc.chat_history import SQLAlchemyChatMessageHistory
 from chatdoc.prompt_mode import PromptMode
 from chatdoc.utils import Utils
@@ -73,7 +83,21 @@ match current_env:
 
 app.secret_key = str(uuid.uuid4())
 sm_app = ServerMethods()
+chatbot_pool = ChatbotPool(
+    content_fingerprint_fn=partial(DocumentMethods.get_content_fingerprint, logger=app.logger)
+)
+# Create the database schemas at startup rather than on the first requests.
+bootstrap_schemas(
+    {
+        ChatHistoryBase: os.environ.get("CHAT_HISTORY_CONNECTION_STRING"),
+        FinalAnswerBase: os.environ.get("FINAL_ANSWER_CONNECTION_STRING"),
+    }
+)
+# Gunicorn imports this module once (`--preload`) and then forks its workers,
+# which must not share the connections the bootstrap opened.
+dispose_engines()
 executor = Executor(app)
+upload_jobs = UploadJobRegistry()
 
 Basic = str | int | float | bool
 Property = Basic | dict | tuple | list
@@ -121,36 +145,116 @@ def get_property(
     return json.loads(property_value)
 
 
-async def process_files(files: dict, session_id: str) -> WEMUploadResponse:
+async def process_saved_files(
+    original_names_dict: dict[str, str],
+    full_document_dict: dict[str, Path],
+    session_id: str,
+    on_progress: ProgressCallback | None = None,
+) -> WEMUploadResponse:
     """
-    Processes the files and returns a response object.
+    Processes files that have already been saved to the temporary directory
+    of the upload and returns a response object.
 
     Args:
-        files (dict): The files to process.
+        original_names_dict (dict[str, str]): Maps the unique file names to the original ones.
+        full_document_dict (dict[str, Path]): Maps the unique file names to their paths.
         session_id (str): The session ID.
+        on_progress (ProgressCallback | None, optional): Called with the
+            progress of the ingestion after every step.
 
     Returns:
         dict: A response object containing the message and error.
     """
-    original_names_dict, full_document_dict = await sm_app.save_files_to_tmp(
-        files, session_id=session_id
-    )
     internal_file_id_mapping = await sm_app.save_files_to_vector_db(
-        full_document_dict, user_id=session_id
+        full_document_dict, user_id=session_id, on_progress=on_progress
     )
-    time.sleep(1)
     external_file_id_mapping = [
         {"filename": original_names_dict[filename], "documentIds": document_ids}
         for filename, document_ids in internal_file_id_mapping.items()
     ]
+    number_of_files = len(full_document_dict)
     response_message = WEMUploadResponse(
-        message=f"{str(len(files))} bestand{'en' if len(files) != 1 else ''} succesvol geüpload en verwerkt!",
+        message=f"{str(number_of_files)} bestand{'en' if number_of_files != 1 else ''} succesvol geüpload en verwerkt!",
         error="",
         fileIdMapping=external_file_id_mapping,
     )
     return response_message
 
 
+async def process_files(
+    files: dict, session_id: str, job_id: str, on_progress: ProgressCallback | None = None
+) -> WEMUploadResponse:
+    """
+    Processes the files and returns a response object.
+
+    Args:
+        files (dict): The files to process.
+        session_id (str): The session ID.
+        job_id (str): The ID of the upload job, whose temporary directory the files are saved in.
+        on_progress (ProgressCallback | None, optional): Called with the
+            progress of the ingestion after every step.
+
+    Returns:
+        dict: A response object containing the message and error.
+    """
+    original_names_dict, full_document_dict = await sm_app.save_files_to_tmp(
+        files, session_id=session_id, upload_id=job_id
+    )
+    return await process_saved_files(original_names_dict, full_document_dict, session_id, on_progress)
+
+
+UploadProcessor = Callable[[ProgressCallback], Awaitable[WEMUploadResponse]]
+
+
+async def run_upload_job(session_id: str, job_id: str, process_upload: UploadProcessor) -> None:
+    """
+    Processes uploaded files in the background, recording the outcome in the
+    session's upload job so that long-polling and subscribed clients are
+    notified as soon as it finishes. Once a newer upload of the session
+    replaced the job, its outcome is no longer recorded. Afterwards, the
+    temporary directory of the job (and only that of this job) is deleted.
+
+    Args:
+        session_id (str): The session ID.
+        job_id (str): The ID of the upload job.
+        process_upload (UploadProcessor): Processes the files, given a progress callback.
+    """
+    upload_jobs.mark_processing(session_id, job_id)
+    try:
+        response_message = await process_upload(
+            lambda progress: upload_jobs.update_progress(session_id, job_id, progress)
+        )
+    except Exception as error:  # pylint: disable=broad-except
+        app.logger.exception("Processing the files of session %s failed", session_id)
+        upload_jobs.mark_failed(session_id, job_id, str(error))
+    else:
+        upload_jobs.mark_completed(session_id, job_id, response_message)
+    finally:
+        if not delete_tmp_dir(session_id, upload_id=job_id):
+            app.logger.error("Failed to clean up the temporary directory of upload %s", job_id)
+
+
+def submit_upload_job(
+    session_id: str, files_total: int, process_upload: UploadProcessor, job_id: str | None = None
+) -> str:
+    """
+    Registers an upload job for the session and starts processing its files in the background.
+
+    Args:
+        session_id (str): The session ID.
+        files_total (int): The number of uploaded files.
+        process_upload (UploadProcessor): Processes the files, given a progress callback.
+        job_id (str | None, optional): The ID of the job, if its files were
+            already saved under it. Defaults to a new unique ID.
+
+    Returns:
+        str: The ID of the upload job.
+    """
+    upload_job = upload_jobs.create(session_id, files_total=files_total, job_id=job_id)
+    executor.submit(run_upload_job, session_id, upload_job.job_id, process_upload)
+    return upload_job.job_id
+
+
 @app.errorhandler(Exception)
 def handle_value_error(error: Exception) -> Response:
     """
@@ -168,6 +272,7 @@ def handle_value_error(error: Exception) -> Response:
 
 @app.route("/upload_files", methods=["OPTIONS"])
 @app.route("/prompt", methods=["OPTIONS"])
+@app.route("/prompt_stream", methods=["OPTIONS"])
 def set_post_options() -> Response:
     """
     Handles the OPTIONS request for the upload_files route.
@@ -240,32 +345,43 @@ def upload_files_json() -> Response:
         else:
             raise ValueError("No prefix found in file object in request.json")
 
-    def get_files() -> dict:
-        files_in_dict = {}
-        file_name: str | None = None
-        for k, v in file_dict.items():
-            if k.startswith(prefix):
-                file_name = file_dict["filename"] if file_name is None else file_name
-                decoded_data = base64.b64decode(v)
-                file_storage = FileStorage(stream=io.BytesIO(decoded_data))
-                files_in_dict[file_name] = file_storage
-        return files_in_dict
-
+    # Flask has already parsed the whole JSON body, but every file is decoded
+    # in chunks straight to disk, and its base64 data is dropped from the
+    # payload as soon as it's written, so no decoded copy is kept in memory.
+    # The files are written to a directory of their own upload job, which no
+    # other (earlier) upload of the session cleans up.
     json_payload = cast(list, request.json)
-    files = {}
-    prefix: str = ""
+    job_id = uuid.uuid4().hex
+    original_names_dict: dict[str, str] = {}
+    full_document_dict: dict[str, Path] = {}
     session_id: str | None = None
-    for file_dict in tqdm(json_payload, desc="Extract files from payload"):
-        session_id = file_dict["sessionId"] if session_id is None else session_id
-        prefix = get_prefix()
-        files = {**files, **get_files()}
+    try:
+        for file_dict in tqdm(json_payload, desc="Extract files from payload"):
+            session_id = file_dict["sessionId"] if session_id is None else session_id
+            prefix = get_prefix()
+            for key in [key for key in file_dict if key.startswith(prefix)]:
+                unique_file_name, unique_file_path = sm_app.save_base64_file_to_tmp(
+                    file_dict["filename"], file_dict.pop(key), session_id=session_id, upload_id=job_id
+                )
+                original_names_dict[unique_file_name] = file_dict["filename"]
+                full_document_dict[unique_file_name] = unique_file_path
+    except Exception:
+        if session_id is not None:
+            delete_tmp_dir(session_id, upload_id=job_id)
+        raise
 
     if session_id is None:
         raise ValueError("No session ID found in request.json")
 
-    executor.submit_stored("process_files", process_files, files, session_id)
+    submit_upload_job(
+        session_id,
+        len(full_document_dict),
+        partial(process_saved_files, original_names_dict, full_document_dict, session_id),
+        job_id=job_id,
+    )
+    number_of_files = len(full_document_dict)
     response_message = ResponseMessage(
-        message=f"{str(len(files))} bestand{'en' if len(files) != 1 else ''} geüpload!",
+        message=f"{str(number_of_files)} bestand{'en' if number_of_files != 1 else ''} geüpload!",
         error="",
     )
     response = make_response(response_message, 200)
@@ -277,28 +393,43 @@ def upload_files_json() -> Response:
 def get_file_id_mappings(session_id: str) -> Response:
     """
     Gets the file ID mappings.
+
+    While the files are being processed, a 202 response with the progress of
+    the upload (files parsed, chunks produced/embedded/written, bytes
+    processed and an ETA) is returned.
+
+    When the `wait` query parameter is given, the request is held open for up
+    to that many seconds (capped by `UPLOAD_LONG_POLL_MAX_SECONDS`) until the
+    upload finishes, so clients don't have to poll repeatedly.
     """
     response_message: WEMUploadResponse
-    status_name = f"process_files_{session_id}"
-    process_files_state: None | str = executor.futures._state(status_name)
-    if process_files_state is None:
+    wait_seconds = min(
+        request.args.get("wait", default=0.0, type=float),
+        float(os.environ.get("UPLOAD_LONG_POLL_MAX_SECONDS", 30)),
+    )
+    upload_job = (
+        upload_jobs.wait(session_id, timeout=wait_seconds) if wait_seconds > 0 else upload_jobs.get(session_id)
+    )
+    if upload_job is None:
         response_message = WEMUploadResponse(
             message=f"No file ID mappings found for session {session_id}.",
             error="",
             fileIdMapping=[],
         )
         return make_response(response_message)
-    app.logger.info("process_files_state: %s", process_files_state)
-    if not executor.futures.done(status_name):
-        response_message = WEMUploadResponse(
-            message=str(process_files_state),
+    app.logger.info("Upload job state for session %s: %s", session_id, upload_job.state.value)
+    if upload_job.state == UploadJobState.FAILED:
+        response_message = WEMUploadResponse(message="", error=upload_job.error, fileIdMapping=[])
+        return make_response(response_message, 400)
+    if upload_job.result is None:
+        status_response = UploadStatusResponse(
+            message=upload_job.state.value,
             error="",
             fileIdMapping=[],
+            progress=upload_job.get_progress(),
         )
-        return make_response(response_message, 202)
-    future = executor.futures.pop("process_files")
-    response_message = future.result()
-    return make_response(response_message, 200)
+        return make_response(status_response, 202)
+    return make_response(upload_job.result, 200)
 
 
 @app.route("/upload_files", methods=["POST"])
@@ -329,19 +460,15 @@ async def upload_files() -> Response:
     prefix: str = get_prefix()
     files = get_files()
 
-    executor.submit_stored(
-        f"process_files_{session_id}", process_files, files, session_id
+    job_id = uuid.uuid4().hex
+    submit_upload_job(session_id, len(files), partial(process_files, files, session_id, job_id), job_id=job_id)
+    return make_response(
+        ResponseMessage(
+            message=f"{str(len(files))} bestand{'en' if len(files) != 1 else ''} geüpload!\nDeze worden nu verwerkt.",
+            error="",
+        ),
+        202,
     )
-    if not executor.futures.done(f"process_files_{session_id}"):
-        return make_response(
-            ResponseMessage(
-                message=f"{str(len(files))} bestand{'en' if len(files) != 1 else ''} geüpload!\nDeze worden nu verwerkt.",
-                error="",
-            ),
-            202,
-        )
-    future = executor.futures.pop(f"process_files_{session_id}")
-    return make_response(future.result(), 200)
 
 
 @app.route("/delete_file", methods=["DELETE", "POST"])
@@ -374,14 +501,24 @@ async def delete_file() -> Response:
         error = f"Bestand: {file_name} \n\n niet gevonden!"
         response_message = ResponseMessage(message=message, error=error)
         return make_response(response_message, 400)
-    deletion_successful = await sm_app.delete_docs_from_vector_db(
-        document_ids, session_id=session_id
+    # Identical files uploaded under another name share their document IDs;
+    # those must stay in the vector database for the other file.
+    shared_document_ids = DocumentMethods.get_shared_document_ids(
+        session_id=session_id, filename=file_name, document_ids=document_ids, logger=app.logger
+    )
+    unshared_document_ids = [
+        document_id for document_id in document_ids if document_id not in shared_document_ids
+    ]
+    deletion_successful = not unshared_document_ids or await sm_app.delete_docs_from_vector_db(
+        unshared_document_ids, session_id=session_id
     )
     if deletion_successful:
         message = f"Bestand: {file_name} \n\n succesvol verwijderd!"
         DocumentMethods.delete_document_ids(
             session_id=session_id, filename=file_name, logger=app.logger
         )
+        if shared_document_ids:
+            await sm_app.update_shared_document_sources(list(shared_document_ids), session_id=session_id)
     else:
         error = f"Bestand: {file_name} \n\n niet gevonden!"
     response_message = ResponseMessage(message=message, error=error)
@@ -389,6 +526,43 @@ async def delete_file() -> Response:
     return response
 
 
+def parse_prompt_mode(prompt_mode_raw: str | None) -> PromptMode:
+    """
+    Parses the optional `promptMode` sent by a client.
+
+    Args:
+        prompt_mode_raw (str | None): The raw prompt mode value.
+
+    Returns:
+        PromptMode: The matching prompt mode, falling back to
+        `PromptMode.DEFAULT` when it is missing or unrecognized.
+    """
+    try:
+        return PromptMode(prompt_mode_raw) if prompt_mode_raw else PromptMode.DEFAULT
+    except ValueError:
+        return PromptMode.DEFAULT
+
+
+def get_pending_files_response(session_id: str) -> ResponseMessage | None:
+    """
+    Checks whether the files uploaded for the session are still processing.
+
+    Args:
+        session_id (str): The session ID the prompt belongs to.
+
+    Returns:
+        ResponseMessage | None: The response telling the client to try again
+        later, or `None` once the files have been processed.
+    """
+    upload_job = upload_jobs.get(session_id)
+    if upload_job is not None and not upload_job.done:
+        return ResponseMessage(
+            message="Files necessary for prompt are still processing, please try again in one minute.",
+            error=upload_job.state.value,
+        )
+    return None
+
+
 async def resolve_prompt_response(
     session_id: str, message: str, prompt_mode: PromptMode = PromptMode.DEFAULT
 ) -> tuple[ResponseMessage | PromptResponse, int]:
@@ -410,19 +584,9 @@ async def resolve_prompt_response(
         status code (still meaningful for the WebSocket transport as part of
         the emitted payload, even though no actual HTTP status line is sent).
     """
-    if not executor.futures.done(f"process_files_{session_id}"):
-        status = str(executor.futures._state(f"process_files_{session_id}"))
-        return (
-            ResponseMessage(
-                message="Files necessary for prompt are still processing, please try again in one minute.",
-                error=status,
-            ),
-            202,
-        )
-    else:
-        future = executor.futures.pop(f"process_files_{session_id}")
-        future.result()
-    chatbot = Chatbot(user_id=session_id, collection_name=session_id, prompt_mode=prompt_mode)
+    if (pending_response := get_pending_files_response(session_id)) is not None:
+        return pending_response, 202
+    chatbot = chatbot_pool.get(user_id=session_id, collection_name=session_id, prompt_mode=prompt_mode)
     prompt_response = PromptResponse(
         message="Prompt result is found under the result key.",
         error="",
@@ -431,6 +595,67 @@ async def resolve_prompt_response(
     return prompt_response, 200
 
 
+async def stream_prompt_response(
+    session_id: str, message: str, prompt_mode: PromptMode = PromptMode.DEFAULT
+) -> AsyncIterator[tuple[str, dict[str, Any]]]:
+    """
+    Streaming counterpart of `resolve_prompt_response`.
+
+    Yields a `prompt_token` event for every answer token as the LLM produces
+    it, followed by a single `prompt_response` event whose payload is the same
+    one `resolve_prompt_response` returns (carrying the citations and the
+    persisted chat history). While uploaded files are still processing, only
+    that final `prompt_response` event is yielded.
+
+    Args:
+        session_id (str): The session ID the prompt belongs to.
+        message (str): The prompt text submitted by the user.
+        prompt_mode (PromptMode): Which curated system prompt to build the
+            chain with. Defaults to `PromptMode.DEFAULT`.
+
+    Yields:
+        tuple: The event name and its payload.
+    """
+    if (pending_response := get_pending_files_response(session_id)) is not None:
+        yield "prompt_response", dict(pending_response)
+        return
+    chatbot = chatbot_pool.get(user_id=session_id, collection_name=session_id, prompt_mode=prompt_mode)
+    async for event_type, event_value in chatbot.stream_prompt(message):
+        if event_type == "token":
+            yield "prompt_token", {"token": event_value}
+        else:
+            prompt_response = PromptResponse(
+                message="Prompt result is found under the result key.",
+                error="",
+                result=event_value,
+            )
+            yield "prompt_response", dict(prompt_response)
+
+
+def iterate_prompt_events(
+    session_id: str, message: str, prompt_mode: PromptMode = PromptMode.DEFAULT
+) -> Iterator[tuple[str, dict[str, Any]]]:
+    """
+    Drives `stream_prompt_response` on a private event loop so that
+    synchronous transports (Socket.IO handlers, WSGI streaming responses) can
+    forward every event as soon as it is produced.
+
+    Yields:
+        tuple: The event name and its payload.
+    """
+    event_loop = asyncio.new_event_loop()
+    events = stream_prompt_response(session_id, message, prompt_mode)
+    try:
+        while True:
+            try:
+                yield event_loop.run_until_complete(anext(events))
+            except StopAsyncIteration:
+                break
+    finally:
+        event_loop.run_until_complete(events.aclose())
+        event_loop.close()
+
+
 @app.route("/prompt", methods=["POST"])
 @swag_from("swagger/prompt.yml")
 async def prompt() -> Response:
@@ -442,32 +667,75 @@ async def prompt() -> Response:
     """
     session_id = str(get_property("sessionId"))
     message = str(get_property("prompt"))
-    prompt_mode_raw = str(get_property("promptMode", with_error=False))
-    try:
-        prompt_mode = PromptMode(prompt_mode_raw) if prompt_mode_raw else PromptMode.DEFAULT
-    except ValueError:
-        prompt_mode = PromptMode.DEFAULT
+    prompt_mode = parse_prompt_mode(str(get_property("promptMode", with_error=False)))
     response_message, status_code = await resolve_prompt_response(session_id, message, prompt_mode)
     return make_response(response_message, status_code)
 
 
+@app.route("/prompt_stream", methods=["POST"])
+@swag_from("swagger/prompt_stream.yml")
+def prompt_stream() -> Response:
+    """
+    Server-Sent Events variant of the `/prompt` endpoint, for clients that
+    cannot hold a Socket.IO connection.
+
+    Returns:
+        Response: A `text/event-stream` response with a `prompt_token` event
+        per answer token, followed by a final `prompt_response` event carrying
+        the same payload `/prompt` returns as its JSON body.
+    """
+    session_id = str(get_property("sessionId"))
+    message = str(get_property("prompt"))
+    prompt_mode = parse_prompt_mode(str(get_property("promptMode", with_error=False)))
+
+    def generate_events() -> Iterator[str]:
+        try:
+            for event_name, payload in iterate_prompt_events(session_id, message, prompt_mode):
+                yield f"event: {event_name}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        except Exception as error:  # pylint: disable=broad-except
+            app.logger.exception("Streaming prompt for session %s failed", session_id)
+            error_message = ResponseMessage(message="", error=str(error))
+            yield f"event: prompt_response\ndata: {json.dumps(error_message, ensure_ascii=False)}\n\n"
+
+    response = Response(generate_events(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Stop reverse proxies (e.g. nginx) from buffering the stream.
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
 @app.route("/get_chat_history", methods=["GET"])
 @swag_from("swagger/chat_history.yml")
 def get_chat_history() -> Response:
     """
-    Gets the chat history.
+    Gets the chat history, or a page of it.
+
+    The optional `after_id` query parameter only returns the messages stored
+    after the message with that ID, e.g. to poll for new messages, and the
+    optional `limit` query parameter caps the number of returned messages, to
+    page through long histories.
 
     Returns:
         Response: A response object containing the chat history and status code.
     """
     session_id = str(get_property("sessionId"))
+    after_id = request.args.get("after_id", default=None, type=int)
+    limit = request.args.get("limit", default=None, type=int)
+    if limit is not None and limit <= 0:
+        limit = None
     memory_db = SQLAlchemyChatMessageHistory(
         session_id, Utils.get_env_variable("CHAT_HISTORY_CONNECTION_STRING")
     )
+    # Fetch one more message than requested to tell whether another page follows.
+    messages = memory_db.get_messages_after(after_id, limit + 1 if limit is not None else None)
+    has_more = limit is not None and len(messages) > limit
+    messages = messages[:limit]
     response_message = ChatHistoryResponse(
         message="Chatgeschiedenis succesvol opgehaald!",
         error="",
-        result=messages_to_dict(memory_db.messages),
+        result=[{"id": message_id, **message_to_dict(message)} for message_id, message in messages],
+        lastId=messages[-1][0] if messages else after_id,
+        hasMore=has_more,
     )
     return make_response(response_message, 200)
 
@@ -486,6 +754,7 @@ def clear_chat_history() -> Response:
         session_id, Utils.get_env_variable("CHAT_HISTORY_CONNECTION_STRING")
     )
     memory_db.clear()
+    chatbot_pool.invalidate(session_id)
     response_message = ResponseMessage(
         message="Chatgeschiedenis succesvol gewist!", error=""
     )
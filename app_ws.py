@@ -62,9 +62,10 @@ horizontal scaling of the WebSocket endpoint is needed.
 import asyncio
 from typing import Any
 
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 
-from app import app, resolve_prompt_response
+from app import app, iterate_prompt_events, parse_prompt_mode, resolve_prompt_response, upload_jobs
+from server_modules.upload_jobs import UploadJob
 
 # `async_mode="gevent"` makes flask-socketio use gevent's cooperative
 # scheduler so that long-lived WebSocket connections don't block the worker
@@ -84,21 +85,70 @@ def handle_prompt(data: dict[str, Any]) -> None:
     same payload shape (`message`, `error`, and on success `result`) that the
     HTTP endpoint returns as its JSON body.
 
+    When the payload sets `stream` to `true`, the answer is streamed instead:
+    a `prompt_token` event (`{"token": ...}`) is emitted for every token as
+    the LLM produces it, followed by the same final `prompt_response` event
+    carrying the citations and the persisted chat history.
+
     Args:
         data (dict): The payload sent by the client, expected to contain a
-            `sessionId` and a `prompt` key.
+            `sessionId` and a `prompt` key, and optionally a `promptMode` and
+            a `stream` flag.
     """
     try:
         session_id = str(data["sessionId"])
         message = str(data["prompt"])
+        prompt_mode = parse_prompt_mode(data.get("promptMode"))
+        if data.get("stream", False):
+            for event_name, payload in iterate_prompt_events(session_id, message, prompt_mode):
+                emit(event_name, payload)
+            return
         response_message, _status_code = asyncio.run(
-            resolve_prompt_response(session_id, message)
+            resolve_prompt_response(session_id, message, prompt_mode)
         )
         emit("prompt_response", response_message)
     except Exception as error:  # pylint: disable=broad-except
         emit("prompt_response", {"message": "", "error": str(error)})
 
 
+def emit_upload_progress(upload_job: UploadJob) -> None:
+    """
+    Pushes an `upload_progress` event to every client subscribed to the
+    session of an upload job whenever that job changes.
+
+    Args:
+        upload_job (UploadJob): The upload job that changed.
+    """
+    socketio.emit("upload_progress", upload_job.to_dict(), to=upload_job.session_id)
+
+
+upload_jobs.subscribe(emit_upload_progress)
+
+
+@socketio.on("subscribe_upload")
+def handle_subscribe_upload(data: dict[str, Any]) -> None:
+    """
+    Subscribes the client to the upload progress of a session.
+
+    The client joins a room named after the session and receives an
+    `upload_progress` event (`sessionId`, `jobId`, `state`, `filesTotal`, `error` and,
+    once completed, `fileIdMapping`) whenever the session's upload job
+    changes, so it no longer has to poll `/get_file_id_mappings`. The current
+    state of the job, if there is one, is emitted right away.
+
+    Args:
+        data (dict): The payload sent by the client, expected to contain a `sessionId` key.
+    """
+    try:
+        session_id = str(data["sessionId"])
+    except (KeyError, TypeError) as error:
+        emit("upload_progress", {"message": "", "error": f"Invalid payload: {error}"})
+        return
+    join_room(session_id)
+    if (upload_job := upload_jobs.get(session_id)) is not None:
+        emit("upload_progress", upload_job.to_dict())
+
+
 if __name__ == "__main__":
     # Local/dev entrypoint. In production, gunicorn with the eventlet worker
     # class serves `app_ws:app` directly (see Dockerfile), so this branch is
@@ -0,0 +1,243 @@
+"""
+Module defining an in-memory cache of answers to repeated questions.
+
+Users of the same document set often ask the same question, or a trivially
+rephrased one. `AnswerCache` keeps recent answers and their citations keyed on
+a fingerprint of the documents they were answered from and the prompt mode,
+so that the same question, or one whose embedding is close enough to a cached
+one, is answered without calling the LLM, in whichever session (collection)
+it is asked. The question is only embedded when its exact text misses and
+there are cached answers to compare it with. The
+fingerprint is derived from the content of the documents, not from the
+collection they are stored in, so sessions that uploaded the same files share
+their answers. Entries expire after a TTL, and the least recently used ones
+are evicted when the cache is full. The collections that used an entry are
+tracked, so an entry is dropped once documents were added to or deleted from
+all of them.
+"""
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+import numpy as np
+
+from .embed.query_embedding_cache import normalize_query
+from .prompt_mode import PromptMode
+from .ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+AnswerKey = tuple[str, PromptMode, str]
+
+
+@dataclass(frozen=True)
+class CachedAnswer:
+    """
+    A cached answer with the unit-length embedding of the question it
+    answers (if it was embedded at all), and the collections it was answered
+    or served in. An answer without an embedding is only served to the exact
+    same question.
+    """
+
+    embedding: Optional[np.ndarray]
+    answer: str
+    citations: dict[str, Any]
+    collection_names: set[str] = field(default_factory=set)
+
+
+def _normalize_embedding(embedding: list[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class AnswerCache:
+    """
+    A bounded, TTL-evicted cache of answers with hit/miss counters.
+
+    Attributes:
+        answers (TTLCache): The cached answers keyed by
+            `(content fingerprint, prompt mode, normalized question)`.
+        similarity_threshold (float): The minimum cosine similarity between
+            the embeddings of two questions for them to share an answer.
+        hits (int): The number of questions answered from the cache.
+        misses (int): The number of questions that were not.
+    """
+
+    _shared_cache: Optional["AnswerCache"] = None
+
+    def __init__(
+        self,
+        max_size: int | None = None,
+        ttl_seconds: float | None = None,
+        similarity_threshold: float | None = None,
+    ) -> None:
+        """
+        Args:
+            max_size (int | None, optional): The maximum number of cached
+                answers. Defaults to the `ANSWER_CACHE_SIZE` environment
+                variable, or `256`. `0` disables the cache.
+            ttl_seconds (float | None, optional): How long an unused answer is
+                kept. Defaults to the `ANSWER_CACHE_TTL_SECONDS` environment
+                variable, or `3600`.
+            similarity_threshold (float | None, optional): Defaults to the
+                `ANSWER_CACHE_SIMILARITY_THRESHOLD` environment variable, or `0.97`.
+        """
+        self.answers: TTLCache[AnswerKey, CachedAnswer] = TTLCache(
+            max_size=max_size if max_size is not None else int(os.environ.get("ANSWER_CACHE_SIZE", 256)),
+            ttl_seconds=(
+                ttl_seconds if ttl_seconds is not None else float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", 3600))
+            ),
+        )
+        self.similarity_threshold = (
+            similarity_threshold
+            if similarity_threshold is not None
+            else float(os.environ.get("ANSWER_CACHE_SIMILARITY_THRESHOLD", 0.97))
+        )
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_shared_cache(cls) -> "AnswerCache":
+        """
+        Returns the process-wide shared cache, creating it lazily on first use.
+        """
+        if cls._shared_cache is None:
+            cls._shared_cache = cls()
+        return cls._shared_cache
+
+    @classmethod
+    def reset_shared_cache(cls) -> None:
+        """
+        Clears the shared cache. Mainly useful for tests.
+        """
+        cls._shared_cache = None
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Whether answers are cached at all.
+        """
+        return self.answers.max_size > 0
+
+    def _get_similarity_candidates(
+        self, fingerprint: str, prompt_mode: PromptMode
+    ) -> list[tuple[AnswerKey, CachedAnswer]]:
+        if self.similarity_threshold > 1:
+            return []
+        return [
+            (key, candidate)
+            for key, candidate in self.answers.items()
+            if key[:2] == (fingerprint, prompt_mode) and candidate.embedding is not None
+        ]
+
+    def needs_embedding(self, fingerprint: str, prompt_mode: PromptMode, question: str) -> bool:
+        """
+        Whether looking up a question needs its embedding: only when the exact
+        question is not cached, and there are embedded answers over the same
+        documents and prompt mode to compare it with. A similarity threshold
+        above `1` disables the similarity lookup.
+        """
+        if (fingerprint, prompt_mode, normalize_query(question)) in self.answers:
+            return False
+        return bool(self._get_similarity_candidates(fingerprint, prompt_mode))
+
+    def get(
+        self,
+        collection_name: str,
+        fingerprint: str,
+        prompt_mode: PromptMode,
+        question: str,
+        embedding: Optional[list[float]] = None,
+    ) -> Optional[CachedAnswer]:
+        """
+        Look up the answer to the same question, or to the most similar
+        question above the similarity threshold, over the same documents and
+        prompt mode.
+
+        Args:
+            collection_name (str): The collection the question is asked over,
+                which is recorded as a user of the cached answer.
+            fingerprint (str): The fingerprint of the collection's documents.
+            prompt_mode (PromptMode): The prompt mode the answer is built with.
+            question (str): The question.
+            embedding (list[float] | None, optional): The embedding of the
+                question. Without it, only the exact question is looked up.
+
+        Returns:
+            CachedAnswer | None: The cached answer, or `None` on a miss.
+        """
+        cached_answer = self.answers.get((fingerprint, prompt_mode, normalize_query(question)))
+        if cached_answer is None and embedding is not None:
+            candidates = self._get_similarity_candidates(fingerprint, prompt_mode)
+            if candidates:
+                candidate_embeddings = np.stack([candidate.embedding for _, candidate in candidates])
+                similarities = candidate_embeddings @ _normalize_embedding(embedding)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    # Mark the matched entry as recently used.
+                    cached_answer = self.answers.get(candidates[best][0])
+        with self._lock:
+            if cached_answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                cached_answer.collection_names.add(collection_name)
+        if cached_answer is not None:
+            logger.info("Answered a question over collection %s from the answer cache", collection_name)
+        return cached_answer
+
+    def put(
+        self,
+        collection_name: str,
+        fingerprint: str,
+        prompt_mode: PromptMode,
+        question: str,
+        embedding: Optional[list[float]],
+        answer: str,
+        citations: dict[str, Any],
+    ) -> None:
+        """
+        Cache the answer to a question over a collection and the citations it
+        came with. Without the question's `embedding`, the answer is only
+        served to the exact same question.
+        """
+        self.answers.put(
+            (fingerprint, prompt_mode, normalize_query(question)),
+            CachedAnswer(
+                embedding=_normalize_embedding(embedding) if embedding is not None else None,
+                answer=answer,
+                citations=citations,
+                collection_names={collection_name},
+            ),
+        )
+
+    def invalidate_collection(self, collection_name: str) -> int:
+        """
+        Forget that a collection used the cached answers, e.g. after documents
+        were added to or deleted from it, and drop the answers that no other
+        collection used. (The collection's new fingerprint no longer matches
+        those answers anyway.)
+
+        Returns:
+            int: The number of dropped answers.
+        """
+        unused_keys = set()
+        with self._lock:
+            for key, cached_answer in self.answers.items():
+                if collection_name in cached_answer.collection_names:
+                    cached_answer.collection_names.discard(collection_name)
+                    if not cached_answer.collection_names:
+                        unused_keys.add(key)
+        return self.answers.remove_where(lambda key: key in unused_keys) if unused_keys else 0
+
+    def stats(self) -> dict[str, int]:
+        """
+        Return the hit/miss counters and current size of the cache.
+        """
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {**self.answers.stats(), "hits": hits, "misses": misses}
@@ -1,12 +1,13 @@
 import logging
-from typing import List
+from typing import List, Optional, Sequence, Tuple
 
 from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
-from sqlalchemy import create_engine
+from sqlalchemy import select
 from sqlalchemy.orm import sessionmaker
 
-from server_modules.models import ChatHistoryModel
+from server_modules.database import ensure_schema, get_engine
+from server_modules.models import ChatHistoryBase, ChatHistoryModel
 
 logger = logging.getLogger(__name__)
 
@@ -22,22 +23,25 @@ class SQLAlchemyChatMessageHistory(BaseChatMessageHistory):
     columns - most notably a per-message `timestamp` - alongside each chat
     message.
 
-    The public interface (`messages`, `add_message`, `clear`) intentionally
-    mirrors `langchain_community.chat_message_histories.SQLChatMessageHistory`
-    so that `Chatbot` (and any other caller) does not need to change.
+    The public interface (`messages`, `add_message`, `add_messages`, `clear`)
+    intentionally mirrors
+    `langchain_community.chat_message_histories.SQLChatMessageHistory` so that
+    `Chatbot` (and any other caller) does not need to change.
+    `get_last_messages` reads only the most recent messages, and
+    `get_messages_after` pages through the history, for callers that don't
+    need the whole history at once.
     """
 
     def __init__(self, session_id: str, connection_string: str) -> None:
         self.session_id = session_id
         self.connection_string = connection_string
-        self.engine = create_engine(connection_string, echo=False)
+        # Every history of the same database shares one engine and connection pool.
+        self.engine = get_engine(connection_string)
         self.sql_model_class = ChatHistoryModel
-        self._create_table_if_not_exists()
+        # A no-op once the schema was bootstrapped at startup.
+        ensure_schema(ChatHistoryBase, connection_string)
         self.session_factory = sessionmaker(self.engine)
 
-    def _create_table_if_not_exists(self) -> None:
-        self.sql_model_class.metadata.create_all(self.engine)
-
     @property
     def messages(self) -> List[BaseMessage]:  # type: ignore[override]
         """Retrieve all messages for this session, ordered by insertion/timestamp."""
@@ -49,17 +53,80 @@ class SQLAlchemyChatMessageHistory(BaseChatMessageHistory):
             )
             return [messages_from_dict([record.message])[0] for record in records]
 
+    def get_last_messages(self, n: int) -> List[BaseMessage]:
+        """
+        Retrieve the `n` most recent messages for this session, oldest first.
+
+        Only those messages are read and deserialized, using the
+        `(session_id, id)` index, so the cost does not grow with the length
+        of the history.
+        """
+        if n <= 0:
+            return []
+        with self.session_factory() as session:
+            records = session.scalars(
+                select(self.sql_model_class.message)
+                .where(self.sql_model_class.session_id == self.session_id)
+                .order_by(self.sql_model_class.id.desc())
+                .limit(n)
+            ).all()
+        return messages_from_dict(list(reversed(records)))
+
+    def get_messages_after(
+        self, after_id: Optional[int] = None, limit: Optional[int] = None
+    ) -> List[Tuple[int, BaseMessage]]:
+        """
+        Retrieve the messages for this session that were stored after the
+        message with ID `after_id`, oldest first, together with their IDs.
+
+        Args:
+            after_id (int | None, optional): The ID of the last message the
+                caller already has. Defaults to `None` (start at the first message).
+            limit (int | None, optional): The maximum number of messages to
+                return. Defaults to `None` (no limit).
+
+        Returns:
+            List[Tuple[int, BaseMessage]]: The ID and message of every message.
+        """
+        query = (
+            select(self.sql_model_class.id, self.sql_model_class.message)
+            .where(self.sql_model_class.session_id == self.session_id)
+            .order_by(self.sql_model_class.id.asc())
+        )
+        if after_id is not None:
+            query = query.where(self.sql_model_class.id > after_id)
+        if limit is not None:
+            query = query.limit(limit)
+        with self.session_factory() as session:
+            rows = session.execute(query).all()
+        messages = messages_from_dict([row.message for row in rows])
+        return [(row.id, message) for row, message in zip(rows, messages)]
+
     def add_message(self, message: BaseMessage) -> None:
         """Persist a single message (with its timestamp) to the database."""
+        self.add_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> List[Tuple[int, BaseMessage]]:  # type: ignore[override]
+        """
+        Persist several messages (with their timestamps) in a single
+        transaction, e.g. the question and answer of a turn.
+
+        Returns:
+            List[Tuple[int, BaseMessage]]: The ID and message of every
+            inserted message, in the given order, so callers can update an
+            in-memory history without reading it back.
+        """
+        records = [
+            self.sql_model_class(session_id=self.session_id, message=message_to_dict(message))
+            for message in messages
+        ]
         with self.session_factory() as session:
-            session.add(
-                self.sql_model_class(
-                    session_id=self.session_id,
-                    message=message_to_dict(message),
-                )
-            )
+            session.add_all(records)
+            session.flush()
+            message_ids = [record.id for record in records]
             session.commit()
-            logger.debug("Persisted message for session_id=%s", self.session_id)
+        logger.debug("Persisted %d message(s) for session_id=%s", len(message_ids), self.session_id)
+        return list(zip(message_ids, messages))
 
     def clear(self) -> None:
         """Remove all messages for this session from the database."""
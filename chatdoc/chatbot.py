@@ -1,20 +1,26 @@
 from os import environ as os_environ
-from typing import Any
+from typing import Any, AsyncIterator, Callable, Literal
 
 from langchain.chains import create_history_aware_retriever, create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_core.language_models.chat_models import BaseChatModel
-from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
 from langchain_core.messages.base import messages_to_dict
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableBranch, RunnableLambda
 
 
 from .vector_db import VectorDatabase
+from .answer_cache import AnswerCache, CachedAnswer
 from .citation import Citations
 from .chat_history import SQLAlchemyChatMessageHistory
 from .embed.embedding_factory import EmbeddingFactory
+from .embed.query_embedding_cache import QueryEmbeddingCache
 from .chat_model import ChatModel
 from .prompt_mode import PromptMode, get_system_template
+from .standalone_question import is_self_contained
 from .utils import Utils
 
 
@@ -25,6 +31,21 @@ CONTEXTUALIZE_QUESTION_SYSTEM_PROMPT = (
     "reformulate it if needed and otherwise return it as is."
 )
 
+PromptStreamEvent = tuple[Literal["token"], str] | tuple[Literal["result"], dict[str, Any]]
+
+
+def create_rewrite_chat_model(chat_model: BaseChatModel) -> BaseChatModel:
+    """
+    Build the chat model named by `REWRITE_CHAT_MODEL_NAME` (of the same
+    vendor as the answering chat model) to rewrite follow-up questions with,
+    or return `chat_model` if it is not set.
+    """
+    rewrite_chat_model_name = os_environ.get("REWRITE_CHAT_MODEL_NAME")
+    if not rewrite_chat_model_name:
+        return chat_model
+    return ChatModel(chat_model_name=rewrite_chat_model_name).chat_model
+
+
 class Chatbot:
     """
     The chatbot class with a run method
@@ -35,6 +56,11 @@ class Chatbot:
         user_id: str,
         collection_name: str | None = None,
         prompt_mode: PromptMode = PromptMode.DEFAULT,
+        embedding_fn: Embeddings | None = None,
+        chat_model: BaseChatModel | None = None,
+        rewrite_chat_model: BaseChatModel | None = None,
+        answer_cache: AnswerCache | None = None,
+        content_fingerprint_fn: Callable[[str], str | None] | None = None,
     ):
         """
         Args:
@@ -45,17 +71,40 @@ class Chatbot:
                 select the `VectorDatabase` collection. Defaults to `user_id` when
                 not provided, so a single caller-supplied identifier can still be
                 used for both without breaking existing behavior.
+            embedding_fn (Embeddings | None): An already-built embedding function
+                to reuse (e.g. shared by `ChatbotPool`). Built with
+                `EmbeddingFactory` when not provided.
+            chat_model (BaseChatModel | None): An already-built chat model to
+                reuse. Built with `ChatModel` when not provided.
+            rewrite_chat_model (BaseChatModel | None): The chat model that
+                rewrites follow-up questions into standalone questions. When
+                not provided, a (smaller, faster) model named by the
+                `REWRITE_CHAT_MODEL_NAME` environment variable is built with
+                `ChatModel`, falling back to `chat_model`.
+            answer_cache (AnswerCache | None): The cache of answers to
+                repeated questions. Defaults to the process-wide shared cache.
+            content_fingerprint_fn (Callable | None): Returns a fingerprint of
+                the content of the documents in a collection (or `None` if it
+                is unknown), which keys the cached answers. Answers are not
+                cached when not provided.
         """
         self.user_id = user_id
         self.collection_name = collection_name if collection_name is not None else user_id
         self.prompt_mode = prompt_mode
-        self.embedding_fn = EmbeddingFactory().create()
+        self.embedding_fn = embedding_fn if embedding_fn is not None else EmbeddingFactory().create()
         self.vector_db = VectorDatabase(self.collection_name, self.embedding_fn)
         self.memory_db = SQLAlchemyChatMessageHistory(self.user_id, Utils.get_env_variable("CHAT_HISTORY_CONNECTION_STRING"))
-        self.chat_model: BaseChatModel = ChatModel().chat_model
+        self.chat_model: BaseChatModel = chat_model if chat_model is not None else ChatModel().chat_model
+        self.rewrite_chat_model: BaseChatModel = (
+            rewrite_chat_model if rewrite_chat_model is not None else create_rewrite_chat_model(self.chat_model)
+        )
+        self.answer_cache = answer_cache if answer_cache is not None else AnswerCache.get_shared_cache()
+        self.content_fingerprint_fn = content_fingerprint_fn
         self.chatQA = self._build_chatqa_chain()  # pylint: disable=invalid-name
-        self.chat_history = self.memory_db.messages
         self.last_n_messages = int(os_environ.get("LAST_N_MESSAGES", 5))
+        # Only the window of recent messages that is sent to the chain is loaded;
+        # the full history is read on demand through `memory_db.messages`.
+        self.chat_history = self._load_recent_messages()
 
     def _build_chatqa_chain(self):
         """
@@ -63,7 +112,10 @@ class Chatbot:
 
         This replaces the deprecated `ConversationalRetrievalChain` with the
         history-aware-retriever + retrieval-chain pattern described in the
-        LangChain "Add chat history" guide.
+        LangChain "Add chat history" guide. Rewriting the question with the
+        chat history costs an extra LLM round trip, so it is skipped for
+        first-turn questions (by the history-aware retriever itself) and for
+        questions that `is_self_contained` deems understandable on their own.
         """
         contextualize_question_prompt = ChatPromptTemplate.from_messages(
             [
@@ -73,8 +125,15 @@ class Chatbot:
             ]
         )
         history_aware_retriever = create_history_aware_retriever(
-            self.chat_model, self.vector_db.retriever, contextualize_question_prompt
+            self.rewrite_chat_model, self.vector_db.retriever, contextualize_question_prompt
         )
+        retriever = RunnableBranch(
+            (
+                lambda x: is_self_contained(x["input"]),
+                RunnableLambda(lambda x: x["input"]) | self.vector_db.retriever,
+            ),
+            history_aware_retriever,
+        ).with_config(run_name="chat_retriever_chain")
 
         question_answering_prompt = ChatPromptTemplate.from_messages(
             [
@@ -85,29 +144,144 @@ class Chatbot:
         )
         question_answer_chain = create_stuff_documents_chain(self.chat_model, question_answering_prompt)
 
-        return create_retrieval_chain(history_aware_retriever, question_answer_chain)
+        return create_retrieval_chain(retriever, question_answer_chain)
+
+    def _load_recent_messages(self) -> list[BaseMessage]:
+        """
+        Read the last `last_n_messages` messages of the session from the
+        database. This is done at the start of every prompt, since the same
+        session may also be prompted through the pooled chatbots of the other
+        prompt modes (or another worker).
+        """
+        return self.memory_db.get_last_messages(self.last_n_messages)
+
+    def _record_turn(
+        self, prompt: str, answer: str, citations: dict[str, Any], recent_messages: list[BaseMessage]
+    ) -> dict[str, Any]:
+        """
+        Persist a finished question/answer turn and build the prompt result.
+
+        Args:
+            prompt (str): The question asked by the user.
+            answer (str): The answer produced by the chain.
+            citations (dict[str, Any]): The citations of the answer.
+            recent_messages (list[BaseMessage]): The recent messages this
+                prompt loaded at its start, which the new turn follows.
+
+        Returns:
+            dict[str, Any]: The answer, its citations and the last
+            `last_n_messages` messages of the updated chat history.
+        """
+        human_message = HumanMessage(content=prompt)
+        ai_message = AIMessage(content=answer, additional_kwargs={"citations": citations})
+        # Both messages are written in one transaction. The window this prompt
+        # loaded is extended in memory instead of being read back; it is local to
+        # the prompt, so concurrent prompts on the same pooled chatbot don't mix.
+        new_messages = [message for _, message in self.memory_db.add_messages([human_message, ai_message])]
+        updated_messages = [*recent_messages, *new_messages]
+        chat_history = updated_messages[-self.last_n_messages :] if self.last_n_messages > 0 else []
+        self.chat_history = chat_history
+
+        return {
+            "answer": answer,
+            "citations": citations,
+            "chat_history": messages_to_dict(chat_history),
+        }
+
+    def _get_answer_cache_fingerprint(self, prompt: str, recent_messages: list[BaseMessage]) -> str | None:
+        """
+        Get the content fingerprint of the collection's documents to look up
+        and store the answer to the prompt with, or `None` if the answer cache
+        does not apply.
+
+        A follow-up question depends on the chat history, so only first-turn
+        questions and questions that `is_self_contained` deems understandable
+        on their own are cached.
+        """
+        if self.content_fingerprint_fn is None or not self.answer_cache.enabled:
+            return None
+        if recent_messages and not is_self_contained(prompt):
+            return None
+        return self.content_fingerprint_fn(self.collection_name)
+
+    async def _get_cached_answer(self, prompt: str, fingerprint: str | None) -> CachedAnswer | None:
+        """
+        Look up the answer to the prompt. The prompt is only embedded (through
+        the shared `QueryEmbeddingCache`, so retrieval reuses the embedding on
+        a miss) when the exact question is not cached and there are similar
+        answers to compare it with, and never for identifier lookups that the
+        retriever answers from the lexical index alone.
+        """
+        if fingerprint is None:
+            return None
+        embedding = None
+        if self.answer_cache.needs_embedding(
+            fingerprint, self.prompt_mode, prompt
+        ) and not self.vector_db.retriever.is_lexical_only_query(prompt):
+            embedding = await QueryEmbeddingCache.get_shared_cache().aembed_query(self.embedding_fn, prompt)
+        return self.answer_cache.get(self.collection_name, fingerprint, self.prompt_mode, prompt, embedding)
+
+    def _cache_answer(self, prompt: str, fingerprint: str | None, answer: str, citations: dict[str, Any]) -> None:
+        """
+        Cache the answer to the prompt, with the embedding retrieval left in
+        the shared `QueryEmbeddingCache` (if any). The prompt is not embedded
+        just to cache its answer.
+        """
+        if fingerprint is not None:
+            embedding = QueryEmbeddingCache.get_shared_cache().get_cached(self.embedding_fn, prompt)
+            self.answer_cache.put(
+                self.collection_name, fingerprint, self.prompt_mode, prompt, embedding, answer, citations
+            )
 
     async def send_prompt(self, prompt: str) -> dict[str, Any]:
         """
         Method to send a prompt to the chatbot
 
         Uses the chain's async `ainvoke` so that the (slow) LLM completion and
-        retrieval calls don't block the Flask worker's event loop.
+        retrieval calls don't block the Flask worker's event loop. Repeated
+        questions over the same documents are answered from the `AnswerCache`
+        without calling the chain at all.
         """
-        previous_messages = self.chat_history[-self.last_n_messages :]
+        recent_messages = self.chat_history = self._load_recent_messages()
+        fingerprint = self._get_answer_cache_fingerprint(prompt, recent_messages)
+        if (cached_answer := await self._get_cached_answer(prompt, fingerprint)) is not None:
+            return self._record_turn(prompt, cached_answer.answer, cached_answer.citations, recent_messages)
+        previous_messages = recent_messages[-self.last_n_messages :]
         chain_result = await self.chatQA.ainvoke({"input": prompt, "chat_history": previous_messages})
-        source_documents = chain_result["context"]
-        citations = Citations(source_documents)
-        citations_dict = citations.__dict__()
+        citations = Citations(chain_result["context"]).__dict__()
+        self._cache_answer(prompt, fingerprint, chain_result["answer"], citations)
+        return self._record_turn(prompt, chain_result["answer"], citations, recent_messages)
 
-        human_message = HumanMessage(content=prompt)
-        ai_message = AIMessage(content=chain_result["answer"], additional_kwargs={"citations": citations_dict})
-        for message in (human_message, ai_message):
-            self.memory_db.add_message(message)
-        self.chat_history = self.memory_db.messages
+    async def stream_prompt(self, prompt: str) -> AsyncIterator[PromptStreamEvent]:
+        """
+        Method to send a prompt to the chatbot and stream the answer back.
 
-        return {
-            "answer": chain_result["answer"],
-            "citations": citations_dict,
-            "chat_history": messages_to_dict(self.chat_history),
-        }
+        Uses the chain's async `astream`, which yields the retrieved `context`
+        as soon as retrieval finishes and then the `answer` piece by piece as
+        the LLM produces its tokens. An answer served from the `AnswerCache`
+        is yielded as a single token.
+
+        Yields:
+            PromptStreamEvent: A `("token", str)` event for every answer token,
+                followed by a single `("result", dict)` event carrying the same
+                result `send_prompt` returns, once the turn has been persisted.
+        """
+        recent_messages = self.chat_history = self._load_recent_messages()
+        fingerprint = self._get_answer_cache_fingerprint(prompt, recent_messages)
+        if (cached_answer := await self._get_cached_answer(prompt, fingerprint)) is not None:
+            yield "token", cached_answer.answer
+            yield "result", self._record_turn(prompt, cached_answer.answer, cached_answer.citations, recent_messages)
+            return
+        previous_messages = recent_messages[-self.last_n_messages :]
+        answer_tokens: list[str] = []
+        source_documents: list[Document] = []
+        async for chunk in self.chatQA.astream({"input": prompt, "chat_history": previous_messages}):
+            if "context" in chunk:
+                source_documents = chunk["context"]
+            if token := chunk.get("answer"):
+                answer_tokens.append(token)
+                yield "token", token
+        answer = "".join(answer_tokens)
+        citations = Citations(source_documents).__dict__()
+        self._cache_answer(prompt, fingerprint, answer, citations)
+        yield "result", self._record_turn(prompt, answer, citations, recent_messages)
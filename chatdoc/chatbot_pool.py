@@ -0,0 +1,154 @@
+"""
+Module defining a process-wide pool of ready-to-use `Chatbot` instances.
+
+Building a `Chatbot` creates an embedding client, a Chroma wrapper, a chat
+history connection, a chat model and the whole retrieval chain. `ChatbotPool`
+keeps recently used chatbots alive (keyed by session, collection and prompt
+mode) so that a prompt only pays for retrieval and the LLM call, and shares
+the session-independent parts (the embedding function and chat models) across
+every chatbot it builds.
+"""
+import logging
+import os
+import threading
+from typing import Callable
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+
+from .chatbot import Chatbot, create_rewrite_chat_model
+from .chat_model import ChatModel
+from .embed.embedding_factory import EmbeddingFactory
+from .prompt_mode import PromptMode
+from .ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+ChatbotKey = tuple[str, str, PromptMode]
+
+
+class ChatbotPool:
+    """
+    A bounded, LRU/TTL-evicted pool of `Chatbot` instances.
+
+    Attributes:
+        chatbots (TTLCache): The pooled chatbots keyed by
+            `(user_id, collection_name, prompt_mode)`.
+    """
+
+    def __init__(
+        self,
+        max_size: int | None = None,
+        ttl_seconds: float | None = None,
+        content_fingerprint_fn: Callable[[str], str | None] | None = None,
+    ) -> None:
+        """
+        Args:
+            max_size (int | None, optional): The maximum number of pooled
+                chatbots. Defaults to the `CHATBOT_POOL_SIZE` environment
+                variable, or `64`.
+            ttl_seconds (float | None, optional): How long an idle chatbot is
+                kept. Defaults to the `CHATBOT_POOL_TTL_SECONDS` environment
+                variable, or `900`.
+            content_fingerprint_fn (Callable | None, optional): Passed on to
+                every chatbot to key cached answers on the content of its
+                collection. Answers are not cached when not provided.
+        """
+        self.chatbots: TTLCache[ChatbotKey, Chatbot] = TTLCache(
+            max_size=max_size if max_size is not None else int(os.environ.get("CHATBOT_POOL_SIZE", 64)),
+            ttl_seconds=(
+                ttl_seconds if ttl_seconds is not None else float(os.environ.get("CHATBOT_POOL_TTL_SECONDS", 900))
+            ),
+        )
+        self.content_fingerprint_fn = content_fingerprint_fn
+        self._embedding_fn: Embeddings | None = None
+        self._chat_model: BaseChatModel | None = None
+        self._rewrite_chat_model: BaseChatModel | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def embedding_fn(self) -> Embeddings:
+        """
+        The embedding function shared by every pooled chatbot.
+        """
+        with self._lock:
+            if self._embedding_fn is None:
+                self._embedding_fn = EmbeddingFactory().create()
+            return self._embedding_fn
+
+    @property
+    def chat_model(self) -> BaseChatModel:
+        """
+        The chat model shared by every pooled chatbot.
+        """
+        with self._lock:
+            if self._chat_model is None:
+                self._chat_model = ChatModel().chat_model
+            return self._chat_model
+
+    @property
+    def rewrite_chat_model(self) -> BaseChatModel:
+        """
+        The chat model that rewrites follow-up questions, shared by every pooled chatbot.
+        """
+        chat_model = self.chat_model
+        with self._lock:
+            if self._rewrite_chat_model is None:
+                self._rewrite_chat_model = create_rewrite_chat_model(chat_model)
+            return self._rewrite_chat_model
+
+    def get(
+        self,
+        user_id: str,
+        collection_name: str | None = None,
+        prompt_mode: PromptMode = PromptMode.DEFAULT,
+    ) -> Chatbot:
+        """
+        Get a ready-to-use chatbot, building (and pooling) one on a miss.
+
+        Args:
+            user_id (str): Identifies the chat history for this user/session.
+            collection_name (str | None): Identifies the vector store
+                collection. Defaults to `user_id`.
+            prompt_mode (PromptMode): The prompt mode the chain is built with.
+
+        Returns:
+            Chatbot: The pooled chatbot.
+        """
+        collection_name = collection_name if collection_name is not None else user_id
+        key: ChatbotKey = (user_id, collection_name, prompt_mode)
+
+        def build_chatbot() -> Chatbot:
+            logger.info("Building chatbot for session %s (%s)", user_id, prompt_mode.value)
+            return Chatbot(
+                user_id=user_id,
+                collection_name=collection_name,
+                prompt_mode=prompt_mode,
+                embedding_fn=self.embedding_fn,
+                chat_model=self.chat_model,
+                rewrite_chat_model=self.rewrite_chat_model,
+                content_fingerprint_fn=self.content_fingerprint_fn,
+            )
+
+        return self.chatbots.get_or_create(key, build_chatbot)
+
+    def invalidate(self, session_id: str) -> int:
+        """
+        Drop every pooled chatbot that belongs to the given session, either as
+        its chat history or as its collection, e.g. after its chat history was
+        cleared.
+
+        Returns:
+            int: The number of chatbots that were dropped.
+        """
+        return self.chatbots.remove_where(lambda key: session_id in key[:2])
+
+    def clear(self) -> None:
+        """
+        Drop every pooled chatbot and the shared embedding function/chat models.
+        """
+        self.chatbots.clear()
+        with self._lock:
+            self._embedding_fn = None
+            self._chat_model = None
+            self._rewrite_chat_model = None
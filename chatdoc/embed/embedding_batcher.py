@@ -0,0 +1,246 @@
+"""
+Module defining an explicit, rate-limit aware batcher for document embeddings.
+
+Instead of handing every chunk of a file to the embedding class in one go and
+relying on its internal batching, `EmbeddingBatcher`:
+
+- sizes batches by token count (counted with `tiktoken`), so batches stay
+  within the vendor's request limits while being as large as possible;
+- embeds several batches concurrently (all of them over the shared
+  ``HttpClientFactory`` async client the embedding class was built with);
+- backs off when the vendor answers with HTTP 429, waiting for as long as the
+  rate-limit response headers ask for and temporarily lowering its
+  concurrency, so large uploads neither under-use nor exceed the quota.
+"""
+import asyncio
+import logging
+import os
+import random
+import re
+from typing import Optional
+
+import httpx
+import openai
+import tiktoken
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_TOKENS_PER_BATCH = 50_000
+DEFAULT_MAX_TEXTS_PER_BATCH = 64
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 6
+MAX_BACKOFF_SECONDS = 60.0
+
+_DURATION_PART_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNIT_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(duration: str) -> Optional[float]:
+    """
+    Parse a duration as used in OpenAI's `x-ratelimit-reset-*` headers (e.g.
+    `"1s"`, `"6m0s"`, `"20ms"`) or a plain number of seconds.
+
+    Returns:
+        Optional[float]: The duration in seconds, or `None` if it can't be parsed.
+    """
+    duration = duration.strip()
+    try:
+        return float(duration)
+    except ValueError:
+        pass
+    parts = _DURATION_PART_PATTERN.findall(duration)
+    if not parts or "".join(number + unit for number, unit in parts) != duration:
+        return None
+    return sum(float(number) * _DURATION_UNIT_SECONDS[unit] for number, unit in parts)
+
+
+def get_retry_delay(headers: httpx.Headers, attempt: int) -> float:
+    """
+    Determine how long to wait before retrying a rate-limited request.
+
+    Prefers the delay the vendor asks for (`retry-after-ms`, `retry-after`,
+    then the longest of the `x-ratelimit-reset-*` headers) and falls back to
+    exponential backoff with jitter.
+    """
+    if (retry_after_ms := headers.get("retry-after-ms")) is not None:
+        if (delay := parse_duration(retry_after_ms)) is not None:
+            return delay / 1000
+    if (retry_after := headers.get("retry-after")) is not None:
+        if (delay := parse_duration(retry_after)) is not None:
+            return delay
+    reset_delays = [
+        delay
+        for header in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+        if (value := headers.get(header)) is not None and (delay := parse_duration(value)) is not None
+    ]
+    if reset_delays:
+        return max(reset_delays)
+    return min(MAX_BACKOFF_SECONDS, 2**attempt) * (0.5 + random.random() / 2)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    An async concurrency limiter whose limit halves whenever the vendor rate
+    limits us and grows back by one with every successful request.
+    """
+
+    def __init__(self, max_concurrency: int) -> None:
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = self.max_concurrency
+        self.active = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def __aexit__(self, *_exc_info) -> None:
+        async with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def decrease(self) -> None:
+        self.limit = max(1, self.limit // 2)
+
+    def increase(self) -> None:
+        self.limit = min(self.max_concurrency, self.limit + 1)
+
+
+class EmbeddingBatcher:
+    """
+    Embeds documents in token-sized batches, several at a time, backing off on rate limits.
+
+    Attributes:
+        embedding_fn (Embeddings): The embedding function used for every batch.
+        max_tokens_per_batch (int): The maximum number of tokens in a batch.
+        max_texts_per_batch (int): The maximum number of texts in a batch.
+        max_retries (int): How often a rate-limited batch is retried.
+        limiter (AdaptiveConcurrencyLimiter): Bounds the batches in flight.
+    """
+
+    def __init__(
+        self,
+        embedding_fn: Embeddings,
+        max_tokens_per_batch: int | None = None,
+        max_texts_per_batch: int | None = None,
+        max_concurrency: int | None = None,
+        max_retries: int | None = None,
+    ) -> None:
+        """
+        Args:
+            embedding_fn (Embeddings): The embedding function used for every batch.
+            max_tokens_per_batch (int | None, optional): Defaults to the
+                `EMBEDDING_BATCH_MAX_TOKENS` environment variable, or `50000`.
+            max_texts_per_batch (int | None, optional): Defaults to `64`.
+            max_concurrency (int | None, optional): The maximum number of
+                batches in flight. Defaults to `4`.
+            max_retries (int | None, optional): Defaults to the
+                `EMBEDDING_MAX_RETRIES` environment variable, or `6`.
+        """
+        self.embedding_fn = embedding_fn
+        self.max_tokens_per_batch = (
+            max_tokens_per_batch
+            if max_tokens_per_batch is not None
+            else int(os.environ.get("EMBEDDING_BATCH_MAX_TOKENS", DEFAULT_MAX_TOKENS_PER_BATCH))
+        )
+        self.max_texts_per_batch = max(
+            1, max_texts_per_batch if max_texts_per_batch is not None else DEFAULT_MAX_TEXTS_PER_BATCH
+        )
+        self.max_retries = (
+            max_retries
+            if max_retries is not None
+            else int(os.environ.get("EMBEDDING_MAX_RETRIES", DEFAULT_MAX_RETRIES))
+        )
+        self.limiter = AdaptiveConcurrencyLimiter(
+            max_concurrency if max_concurrency is not None else DEFAULT_MAX_CONCURRENCY
+        )
+        self._encoding = self._load_encoding()
+
+    def _load_encoding(self) -> Optional[tiktoken.Encoding]:
+        model_name = getattr(self.embedding_fn, "model_name", None) or getattr(self.embedding_fn, "model", None)
+        try:
+            try:
+                return tiktoken.encoding_for_model(str(model_name))
+            except KeyError:
+                return tiktoken.get_encoding("cl100k_base")
+        except Exception:  # pylint: disable=broad-except
+            # tiktoken downloads its encodings on first use; without network
+            # access fall back to a rough characters-per-token estimate.
+            logger.warning("Could not load a tiktoken encoding, estimating token counts instead")
+            return None
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Count the tokens of a text.
+        """
+        if self._encoding is None:
+            return len(text) // 4 + 1
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def make_batches(self, texts: list[str]) -> list[list[int]]:
+        """
+        Group texts into batches of at most `max_tokens_per_batch` tokens and
+        `max_texts_per_batch` texts, preserving their order.
+
+        Returns:
+            list[list[int]]: The indices of the texts in every batch.
+        """
+        batches: list[list[int]] = []
+        current_batch: list[int] = []
+        current_tokens = 0
+        for index, text in enumerate(texts):
+            tokens = self.count_tokens(text)
+            if current_batch and (
+                current_tokens + tokens > self.max_tokens_per_batch or len(current_batch) >= self.max_texts_per_batch
+            ):
+                batches.append(current_batch)
+                current_batch, current_tokens = [], 0
+            current_batch.append(index)
+            current_tokens += tokens
+        if current_batch:
+            batches.append(current_batch)
+        return batches
+
+    async def aembed_batch(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed a single batch, retrying with backoff when rate limited.
+        """
+        for attempt in range(self.max_retries + 1):
+            async with self.limiter:
+                try:
+                    embeddings = await self.embedding_fn.aembed_documents(texts)
+                except openai.RateLimitError as error:
+                    if attempt == self.max_retries:
+                        raise
+                    self.limiter.decrease()
+                    delay = get_retry_delay(error.response.headers, attempt)
+                else:
+                    self.limiter.increase()
+                    return embeddings
+            logger.warning(
+                "Embedding batch of %d texts was rate limited, retrying in %.2fs (concurrency %d)",
+                len(texts),
+                delay,
+                self.limiter.limit,
+            )
+            await asyncio.sleep(delay)
+        raise RuntimeError("Unreachable: the last retry either returns or raises")
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed all texts in concurrent, token-sized batches.
+
+        Returns:
+            list[list[float]]: The embedding of every text, in the same order.
+        """
+        batches = self.make_batches(texts)
+        batch_embeddings = await asyncio.gather(
+            *(self.aembed_batch([texts[index] for index in batch]) for batch in batches)
+        )
+        embeddings: list[list[float]] = [[] for _ in texts]
+        for batch, batch_embedding in zip(batches, batch_embeddings):
+            for index, embedding in zip(batch, batch_embedding):
+                embeddings[index] = embedding
+        return embeddings
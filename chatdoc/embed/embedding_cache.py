@@ -0,0 +1,240 @@
+"""
+Module defining a persistent, content-addressed cache in front of an embedding model.
+
+Users share the same documents constantly, so the same chunks get embedded over
+and over again. `CachedEmbeddings` wraps any LangChain `Embeddings` and stores
+every document embedding under a hash of (vendor, model name, chunk text) in a
+local database, so a chunk that has been embedded before never hits the
+embedding API (or the local model) again. The cache is bounded in size: once
+it grows beyond `max_bytes`, the least recently used embeddings are evicted.
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+from array import array
+from datetime import datetime
+from typing import Any, Optional
+
+import sqlalchemy
+from langchain_core.embeddings import Embeddings
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from server_modules.database import ensure_schema, session_scope
+from server_modules.models import EmbeddingCacheModel
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_CONNECTION_STRING = "sqlite:///embedding_cache.db"
+DEFAULT_CACHE_MAX_BYTES = 1024**3
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    An `Embeddings` wrapper that serves document embeddings from a persistent
+    cache and only forwards cache misses to the wrapped embedding model.
+
+    Query embeddings are passed through unchanged.
+
+    Attributes:
+        underlying_embeddings (Embeddings): The wrapped embedding model.
+        vendor_name (str): The embedding vendor, part of the cache key.
+        model_name (str): The embedding model name, part of the cache key.
+        connection_string (str): The SQLAlchemy connection string of the cache.
+        max_bytes (int): The maximum total size of the cached vectors.
+    """
+
+    def __init__(
+        self,
+        underlying_embeddings: Embeddings,
+        vendor_name: str,
+        model_name: str,
+        connection_string: str = DEFAULT_CACHE_CONNECTION_STRING,
+        max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+    ) -> None:
+        self.underlying_embeddings = underlying_embeddings
+        self.vendor_name = vendor_name
+        self.model_name = model_name
+        self.connection_string = connection_string
+        self.max_bytes = max_bytes
+        # An estimate of the total size of the cached vectors, so that the
+        # table is only summed up once the cache may have grown too large.
+        self._cached_bytes: Optional[int] = None
+        self._size_lock = threading.Lock()
+        ensure_schema(EmbeddingCacheModel, connection_string)
+
+    def _get_key(self, text: str) -> str:
+        """
+        Build the content-addressed cache key for a text.
+        """
+        return hashlib.sha256(f"{self.vendor_name}\0{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _serialize(embedding: list[float]) -> bytes:
+        return array("d", embedding).tobytes()
+
+    @staticmethod
+    def _deserialize(data: bytes) -> list[float]:
+        embedding = array("d")
+        embedding.frombytes(data)
+        return embedding.tolist()
+
+    def _lookup(self, keys: list[str]) -> dict[str, list[float]]:
+        """
+        Fetch the cached embeddings for the given keys, marking them as recently used.
+        """
+        if not keys:
+            return {}
+        query = sqlalchemy.select(EmbeddingCacheModel.key, EmbeddingCacheModel.embedding).where(
+            EmbeddingCacheModel.key.in_(keys)
+        )
+        with session_scope(self.connection_string) as session:
+            cached = {key: self._deserialize(data) for key, data in session.execute(query)}
+            if cached:
+                session.execute(
+                    sqlalchemy.update(EmbeddingCacheModel)
+                    .where(EmbeddingCacheModel.key.in_(list(cached)))
+                    .values(last_accessed=datetime.now())
+                )
+        return cached
+
+    @staticmethod
+    def _insert_missing(session: Session, rows: list[dict[str, Any]]) -> None:
+        """
+        Insert the rows whose keys are not cached yet, skipping the others
+        (e.g. because another worker cached the same chunks concurrently)
+        instead of failing the whole batch on a duplicate key.
+        """
+        dialect_name = session.get_bind().dialect.name
+        if dialect_name in ("sqlite", "postgresql"):
+            dialect_insert = sqlite.insert if dialect_name == "sqlite" else postgresql.insert
+            session.execute(dialect_insert(EmbeddingCacheModel).on_conflict_do_nothing(index_elements=["key"]), rows)
+        elif dialect_name in ("mysql", "mariadb"):
+            session.execute(sqlalchemy.insert(EmbeddingCacheModel).prefix_with("IGNORE"), rows)
+        else:
+            existing_keys = set(
+                session.scalars(
+                    sqlalchemy.select(EmbeddingCacheModel.key).where(
+                        EmbeddingCacheModel.key.in_([row["key"] for row in rows])
+                    )
+                )
+            )
+            if missing_rows := [row for row in rows if row["key"] not in existing_keys]:
+                session.execute(sqlalchemy.insert(EmbeddingCacheModel), missing_rows)
+
+    def _store(self, embeddings_by_key: dict[str, list[float]]) -> None:
+        """
+        Persist freshly computed embeddings and evict old ones if the cache grew too large.
+        """
+        if not embeddings_by_key:
+            return
+        now = datetime.now()
+        rows = []
+        for key, embedding in embeddings_by_key.items():
+            data = self._serialize(embedding)
+            rows.append(
+                {
+                    "key": key,
+                    "vendor_name": self.vendor_name,
+                    "model_name": self.model_name,
+                    "embedding": data,
+                    "size_bytes": len(data),
+                    "last_accessed": now,
+                }
+            )
+        with session_scope(self.connection_string) as session:
+            self._insert_missing(session, rows)
+        self._evict(added_bytes=sum(row["size_bytes"] for row in rows))
+
+    def _get_total_size(self, session: Session) -> int:
+        return int(
+            session.execute(
+                sqlalchemy.select(sqlalchemy.func.coalesce(sqlalchemy.func.sum(EmbeddingCacheModel.size_bytes), 0))
+            ).scalar_one()
+        )
+
+    def _evict(self, added_bytes: int) -> None:
+        """
+        Evict the least recently used embeddings until the cache fits in `max_bytes`.
+
+        The total size of the cache is only summed up in the database when
+        the running estimate (the last known total plus the bytes stored
+        since, counting skipped duplicates too) exceeds `max_bytes`.
+        """
+        with self._size_lock:
+            if self._cached_bytes is not None:
+                self._cached_bytes += added_bytes
+                if self._cached_bytes <= self.max_bytes:
+                    return
+        with session_scope(self.connection_string) as session:
+            total_bytes = self._get_total_size(session)
+            excess_bytes = total_bytes - self.max_bytes
+            if excess_bytes <= 0:
+                with self._size_lock:
+                    self._cached_bytes = total_bytes
+                return
+            oldest_entries = session.execute(
+                sqlalchemy.select(EmbeddingCacheModel.key, EmbeddingCacheModel.size_bytes).order_by(
+                    EmbeddingCacheModel.last_accessed.asc()
+                )
+            )
+            evicted_keys = []
+            for key, size_bytes in oldest_entries:
+                if excess_bytes <= 0:
+                    break
+                evicted_keys.append(key)
+                excess_bytes -= size_bytes
+            session.execute(sqlalchemy.delete(EmbeddingCacheModel).where(EmbeddingCacheModel.key.in_(evicted_keys)))
+        with self._size_lock:
+            self._cached_bytes = self.max_bytes + excess_bytes
+        logger.info("Evicted %d embeddings from the embedding cache", len(evicted_keys))
+
+    def _split_cached(self, texts: list[str]) -> tuple[list[str], dict[str, list[float]], list[str]]:
+        """
+        Look up all texts in the cache.
+
+        Returns:
+            tuple: The cache key of every text, the cached embeddings by key and
+            the (deduplicated) texts that still need to be embedded.
+        """
+        keys = [self._get_key(text) for text in texts]
+        cached = self._lookup(list(set(keys)))
+        missing_texts = list({key: text for key, text in zip(keys, texts) if key not in cached}.values())
+        logger.info("Embedding cache: %d hit(s), %d miss(es)", len(texts) - len(missing_texts), len(missing_texts))
+        return keys, cached, missing_texts
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed documents, serving previously embedded texts from the cache.
+        """
+        keys, cached, missing_texts = self._split_cached(texts)
+        if missing_texts:
+            fresh = dict(
+                zip(map(self._get_key, missing_texts), self.underlying_embeddings.embed_documents(missing_texts))
+            )
+            self._store(fresh)
+            cached.update(fresh)
+        return [cached[key] for key in keys]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Asynchronously embed documents, serving previously embedded texts from the cache.
+        """
+        keys, cached, missing_texts = await asyncio.to_thread(self._split_cached, texts)
+        if missing_texts:
+            fresh = dict(
+                zip(
+                    map(self._get_key, missing_texts),
+                    await self.underlying_embeddings.aembed_documents(missing_texts),
+                )
+            )
+            await asyncio.to_thread(self._store, fresh)
+            cached.update(fresh)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.underlying_embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.underlying_embeddings.aembed_query(text)
@@ -1,3 +1,4 @@
+import os
 from typing import Any, Optional
 import httpx
 import openai
@@ -7,6 +8,7 @@ from langchain.embeddings.huggingface import HuggingFaceEmbeddings
 from langchain.embeddings.huggingface import HuggingFaceInferenceAPIEmbeddings
 from ..utils import Utils
 from ..http_client import HttpClientFactory
+from .embedding_cache import DEFAULT_CACHE_CONNECTION_STRING, DEFAULT_CACHE_MAX_BYTES, CachedEmbeddings
 
 
 class EmbeddingFactory:
@@ -132,12 +134,34 @@ class EmbeddingFactory:
             "async_client": openai.AsyncOpenAI(api_key=api_key, http_client=self.http_async_client).embeddings,
         }
 
-    def create(self, api_key: str | None = None) -> Embeddings:
+    def _wrap_with_cache(self, embeddings: Embeddings) -> Embeddings:
+        """
+        Wraps the embeddings in a persistent, content-addressed cache.
+
+        The cache location and size are read from the
+        `EMBEDDING_CACHE_CONNECTION_STRING` and `EMBEDDING_CACHE_MAX_BYTES`
+        environment variables.
+
+        Returns:
+            Embeddings: The cache-backed embeddings.
+        """
+        return CachedEmbeddings(
+            underlying_embeddings=embeddings,
+            vendor_name=self.vendor_name,
+            model_name=self.embedding_model_name,
+            connection_string=os.environ.get("EMBEDDING_CACHE_CONNECTION_STRING", DEFAULT_CACHE_CONNECTION_STRING),
+            max_bytes=int(os.environ.get("EMBEDDING_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES)),
+        )
+
+    def create(self, api_key: str | None = None, use_cache: bool | None = None) -> Embeddings:
         """
         Creates an instance of the specified embedding class.
 
         Args:
             api_key (str | None, optional): The API key to be used. Defaults to None.
+            use_cache (bool | None, optional): Whether to put the persistent
+                embedding cache in front of the embedding class. Defaults to
+                enabling it when `EMBEDDING_CACHE_CONNECTION_STRING` is set.
 
         Returns:
             Embeddings: An instance of the specified embedding class.
@@ -153,4 +177,7 @@ class EmbeddingFactory:
         settings_dict = self._create_settings_dict()
         model_name_dict = self._create_model_name_dict()
         client_dict = self._create_client_dict(api_key_dict.get("api_key"))
-        return embedding_class(**model_name_dict, **settings_dict, **api_key_dict, **client_dict)
+        embeddings = embedding_class(**model_name_dict, **settings_dict, **api_key_dict, **client_dict)
+        if use_cache is None:
+            use_cache = "EMBEDDING_CACHE_CONNECTION_STRING" in os.environ
+        return self._wrap_with_cache(embeddings) if use_cache else embeddings
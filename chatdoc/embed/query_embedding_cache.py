@@ -0,0 +1,132 @@
+"""
+Module defining an in-memory LRU cache for query embeddings.
+
+Users repeatedly ask the same (or trivially different) questions across
+sessions. `QueryEmbeddingCache` keeps the embeddings of recent questions,
+keyed on the embedding model and the normalized question text, so that a
+repeated question skips the embedding round trip during retrieval.
+"""
+import os
+import re
+from typing import Optional
+
+from langchain_core.embeddings import Embeddings
+
+from ..ttl_cache import TTLCache
+
+QueryEmbeddingKey = tuple[str, str]
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a query so that differences in case and whitespace do not cause cache misses.
+    """
+    return re.sub(r"\s+", " ", query).strip().casefold()
+
+
+def get_embedding_model_key(embedding_fn: Embeddings) -> str:
+    """
+    Build a key identifying the model behind an embedding function.
+    """
+    model_name = getattr(embedding_fn, "model_name", None) or getattr(embedding_fn, "model", None)
+    vendor_name = getattr(embedding_fn, "vendor_name", type(embedding_fn).__name__)
+    return f"{vendor_name}:{model_name}"
+
+
+class QueryEmbeddingCache:
+    """
+    A bounded, TTL-evicted cache of query embeddings with hit/miss counters.
+
+    Attributes:
+        embeddings (TTLCache): The cached embeddings keyed by
+            `(embedding model key, normalized query)`.
+    """
+
+    _shared_cache: Optional["QueryEmbeddingCache"] = None
+
+    def __init__(self, max_size: int | None = None, ttl_seconds: float | None = None) -> None:
+        """
+        Args:
+            max_size (int | None, optional): The maximum number of cached
+                query embeddings. Defaults to the `QUERY_EMBEDDING_CACHE_SIZE`
+                environment variable, or `1024`. `0` disables the cache.
+            ttl_seconds (float | None, optional): How long an unused embedding
+                is kept. Defaults to the `QUERY_EMBEDDING_CACHE_TTL_SECONDS`
+                environment variable, or `3600`.
+        """
+        self.embeddings: TTLCache[QueryEmbeddingKey, list[float]] = TTLCache(
+            max_size=max_size if max_size is not None else int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", 1024)),
+            ttl_seconds=(
+                ttl_seconds
+                if ttl_seconds is not None
+                else float(os.environ.get("QUERY_EMBEDDING_CACHE_TTL_SECONDS", 3600))
+            ),
+        )
+
+    @classmethod
+    def get_shared_cache(cls) -> "QueryEmbeddingCache":
+        """
+        Returns the process-wide shared cache, creating it lazily on first use.
+        """
+        if cls._shared_cache is None:
+            cls._shared_cache = cls()
+        return cls._shared_cache
+
+    @classmethod
+    def reset_shared_cache(cls) -> None:
+        """
+        Clears the shared cache. Mainly useful for tests.
+        """
+        cls._shared_cache = None
+
+    @staticmethod
+    def _get_key(embedding_fn: Embeddings, query: str) -> QueryEmbeddingKey:
+        return get_embedding_model_key(embedding_fn), normalize_query(query)
+
+    def embed_query(self, embedding_fn: Embeddings, query: str) -> list[float]:
+        """
+        Embed a query with `embedding_fn`, serving repeated queries from the cache.
+        """
+        key = self._get_key(embedding_fn, query)
+        embedding = self.embeddings.get(key)
+        if embedding is None:
+            embedding = embedding_fn.embed_query(query)
+            self.embeddings.put(key, embedding)
+        return embedding
+
+    def get_cached(self, embedding_fn: Embeddings, query: str) -> Optional[list[float]]:
+        """
+        Return the cached embedding of a query, without embedding it on a miss.
+        """
+        return self.embeddings.peek(self._get_key(embedding_fn, query))
+
+    async def aembed_query(self, embedding_fn: Embeddings, query: str) -> list[float]:
+        """
+        Asynchronously embed a query with `embedding_fn`, serving repeated queries from the cache.
+        """
+        key = self._get_key(embedding_fn, query)
+        embedding = self.embeddings.get(key)
+        if embedding is None:
+            embedding = await embedding_fn.aembed_query(query)
+            self.embeddings.put(key, embedding)
+        return embedding
+
+    @property
+    def hits(self) -> int:
+        """
+        The number of queries whose embedding was served from the cache.
+        """
+        return self.embeddings.hits
+
+    @property
+    def misses(self) -> int:
+        """
+        The number of queries that had to be embedded.
+        """
+        return self.embeddings.misses
+
+    def stats(self) -> dict[str, int]:
+        """
+        Return the hit/miss counters and current size of the cache.
+        """
+        return self.embeddings.stats()
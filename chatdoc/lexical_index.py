@@ -0,0 +1,282 @@
+"""
+Module defining a per-collection BM25 inverted index of the stored chunks.
+
+Embedding search is good at paraphrases, but regularly misses exact
+identifiers (article numbers, case IDs, ...) that users look up. The
+`LexicalIndex` scores chunks with BM25 on their terms, so its results can be
+fused with the vector search results (see the `hybrid` search type of
+`CustomVectorStoreRetriever`), and lets identifier lookups skip the embedding
+call altogether. Only the term frequencies of every chunk are indexed; the
+chunks themselves are fetched from the vector database by ID.
+"""
+import atexit
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+DocumentPages = Callable[[], Iterable[tuple[list[str], list[str]]]]
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./:]\w+)*")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split a text into lowercase terms.
+
+    Identifiers that join words or numbers with `-`, `.`, `/` or `:` (e.g.
+    `7:658` or `ECLI:NL:HR:2019:1234`) are kept as a single term, in addition
+    to the parts they consist of.
+    """
+    terms = []
+    for match in TOKEN_PATTERN.finditer(text.casefold()):
+        term = match.group()
+        terms.append(term)
+        if term != (parts := re.split(r"[-./:]", term))[0]:
+            terms.extend(parts)
+    return terms
+
+
+def is_identifier_query(query: str, max_words: int = 3) -> bool:
+    """
+    Whether a query only consists of identifiers, i.e. of at most `max_words`
+    words that all contain a digit (e.g. `7:658` or `C-123/45`).
+    """
+    words = query.strip(" \t\n?!.,;").split()
+    return 0 < len(words) <= max_words and all(any(char.isdigit() for char in word) for word in words)
+
+
+class LexicalIndex:
+    """
+    A BM25 inverted index of the chunks of one collection, persisted as a JSON
+    file named after the collection.
+
+    Attributes:
+        collection_name (str): The name of the indexed collection.
+        file_path (Path): The file the index is persisted to.
+    """
+
+    _shared_indexes: dict[str, "LexicalIndex"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, collection_name: str, file_path: Path, k1: float = 1.5, b: float = 0.75) -> None:
+        self.collection_name = collection_name
+        self.file_path = file_path
+        self.k1 = k1
+        self.b = b
+        self._term_frequencies: dict[str, dict[str, int]] = {}
+        self._postings: dict[str, dict[str, int]] = {}
+        self._lengths: dict[str, int] = {}
+        self._total_length = 0
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._term_frequencies)
+
+    @staticmethod
+    def get_directory() -> Path:
+        """
+        The directory the indexes are persisted in, from `LEXICAL_INDEX_DIRECTORY`.
+        """
+        return Path(os.environ.get("LEXICAL_INDEX_DIRECTORY", "./lexical_index"))
+
+    @classmethod
+    def load(cls, collection_name: str, get_documents: Optional[DocumentPages] = None) -> "LexicalIndex":
+        """
+        Load the index of a collection from disk, or create an empty one.
+
+        Args:
+            collection_name (str): The name of the collection.
+            get_documents (DocumentPages | None, optional): Returns the IDs and
+                texts of the documents stored in the collection, page by page.
+                If given and the index has no file (e.g. because it was not
+                persisted across a redeploy), or its file can't be read, the
+                index is rebuilt from them.
+        """
+        file_path = cls.get_directory() / f"{collection_name}.json"
+        index = cls(collection_name, file_path)
+        is_corrupt = False
+        if file_path.exists():
+            try:
+                with file_path.open(encoding="utf-8") as file:
+                    for document_id, term_frequencies in json.load(file).items():
+                        index._add(document_id, term_frequencies)
+                return index
+            except (OSError, ValueError, AttributeError, TypeError):
+                logger.exception("Failed to load the lexical index of collection %s", collection_name)
+                # Start over, the file may have been loaded partially.
+                index = cls(collection_name, file_path)
+                is_corrupt = True
+        if get_documents is not None:
+            for document_ids, texts in get_documents():
+                index.add_documents(document_ids, texts)
+            if len(index) or is_corrupt:
+                logger.info("Rebuilt the lexical index of collection %s from %d chunks", collection_name, len(index))
+                index._dirty = True
+                try:
+                    index.save()
+                except OSError:
+                    logger.exception("Failed to save the lexical index of collection %s", collection_name)
+        return index
+
+    @classmethod
+    def get_shared_index(cls, collection_name: str, get_documents: Optional[DocumentPages] = None) -> "LexicalIndex":
+        """
+        Returns the process-wide index of a collection, loading (or
+        rebuilding, see `load`) it lazily on first use.
+        """
+        with cls._shared_lock:
+            index = cls._shared_indexes.get(collection_name)
+            if index is None:
+                index = cls._shared_indexes[collection_name] = cls.load(collection_name, get_documents)
+            return index
+
+    @classmethod
+    def save_all(cls) -> None:
+        """
+        Persists every shared index that changed since it was last saved.
+        """
+        with cls._shared_lock:
+            indexes = list(cls._shared_indexes.values())
+        for index in indexes:
+            try:
+                index.save()
+            except OSError:
+                logger.exception("Failed to save the lexical index of collection %s", index.collection_name)
+
+    @classmethod
+    def reset_shared_indexes(cls) -> None:
+        """
+        Drops every shared index without saving it. Mainly useful for tests.
+        """
+        with cls._shared_lock:
+            cls._shared_indexes.clear()
+
+    def _add(self, document_id: str, term_frequencies: dict[str, int]) -> None:
+        self._remove(document_id)
+        self._term_frequencies[document_id] = term_frequencies
+        self._lengths[document_id] = sum(term_frequencies.values())
+        self._total_length += self._lengths[document_id]
+        for term, frequency in term_frequencies.items():
+            self._postings.setdefault(term, {})[document_id] = frequency
+
+    def _remove(self, document_id: str) -> None:
+        term_frequencies = self._term_frequencies.pop(document_id, None)
+        if term_frequencies is None:
+            return
+        self._total_length -= self._lengths.pop(document_id)
+        for term in term_frequencies:
+            postings = self._postings[term]
+            del postings[document_id]
+            if not postings:
+                del self._postings[term]
+
+    def add_documents(self, document_ids: list[str], texts: list[str]) -> None:
+        """
+        Index (or re-index) the texts of documents.
+
+        Args:
+            document_ids (list[str]): The IDs of the documents.
+            texts (list[str]): The text of every document, in the same order.
+        """
+        with self._lock:
+            for document_id, text in zip(document_ids, texts):
+                self._add(document_id, dict(Counter(tokenize(text))))
+            self._dirty = True
+
+    def remove_documents(self, document_ids: list[str]) -> None:
+        """
+        Remove documents from the index.
+
+        Args:
+            document_ids (list[str]): The IDs of the documents.
+        """
+        with self._lock:
+            for document_id in document_ids:
+                self._remove(document_id)
+            self._dirty = True
+
+    def search(self, query: str, k: int) -> list[tuple[str, float]]:
+        """
+        Find the documents that best match the terms of a query.
+
+        Args:
+            query (str): The query.
+            k (int): The maximum number of documents to return.
+
+        Returns:
+            list[tuple[str, float]]: The IDs of the matching documents and
+            their BM25 scores, best match first.
+        """
+        with self._lock:
+            document_count = len(self._term_frequencies)
+            if not document_count:
+                return []
+            average_length = self._total_length / document_count
+            scores: Counter[str] = Counter()
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (document_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for document_id, frequency in postings.items():
+                    length_norm = 1 - self.b + self.b * self._lengths[document_id] / average_length
+                    scores[document_id] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+            return scores.most_common(k)
+
+    def save(self) -> None:
+        """
+        Persist the index to disk if it changed since it was last saved.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            self.file_path.parent.mkdir(parents=True, exist_ok=True)
+            # Every save writes its own temporary file, which atomically replaces
+            # the index file once it is complete, so that a concurrent save (e.g.
+            # by another worker process) or a crash never leaves a truncated file.
+            file_descriptor, temporary_name = tempfile.mkstemp(
+                dir=self.file_path.parent, prefix=f"{self.file_path.name}.", suffix=".tmp"
+            )
+            try:
+                with os.fdopen(file_descriptor, "w", encoding="utf-8") as file:
+                    json.dump(self._term_frequencies, file)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temporary_name, self.file_path)
+            except BaseException:
+                Path(temporary_name).unlink(missing_ok=True)
+                raise
+            self._dirty = False
+
+
+atexit.register(LexicalIndex.save_all)
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], rrf_k: int = 60) -> list[tuple[str, float]]:
+    """
+    Fuse several rankings of document IDs with reciprocal rank fusion.
+
+    Args:
+        rankings (list[list[str]]): Rankings of document IDs, best first.
+        rrf_k (int, optional): Dampens the weight of the top ranks. Defaults to `60`.
+
+    Returns:
+        list[tuple[str, float]]: The document IDs with their fused scores, best first.
+    """
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, document_id in enumerate(ranking, start=1):
+            scores[document_id] = scores.get(document_id, 0.0) + 1 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
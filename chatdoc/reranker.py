@@ -0,0 +1,124 @@
+"""
+Module defining an optional cross-encoder re-ranking stage for retrieval.
+
+The retriever fetches `fetch_k` candidate chunks, which a local CPU
+cross-encoder scores against the question, after which only the best `k` are
+stuffed into the prompt. Because a cross-encoder reads every question/chunk
+pair, scoring is done in batches within a time budget: when the budget runs
+out, the candidates simply keep the order the retriever gave them.
+"""
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+
+class CrossEncoderReranker:
+    """
+    Re-ranks retrieved documents with a local `sentence_transformers` cross-encoder.
+
+    Attributes:
+        model_path (str): The local folder (or name) of the cross-encoder model.
+        batch_size (int): The number of question/chunk pairs scored at once.
+        time_budget_seconds (float): The time after which scoring gives up.
+    """
+
+    _models: dict[str, Any] = {}
+    _models_lock = threading.Lock()
+
+    def __init__(self, model_path: str, batch_size: int = 16, time_budget_seconds: float = 1.0) -> None:
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.time_budget_seconds = time_budget_seconds
+
+    @classmethod
+    def from_env(cls) -> Optional["CrossEncoderReranker"]:
+        """
+        Create a re-ranker from the `RERANKER_MODEL_NAME`, `RERANKER_BATCH_SIZE`
+        and `RERANKER_TIME_BUDGET_SECONDS` environment variables, or return
+        `None` when no re-ranker model is configured. Like local embedding
+        models, the model is loaded from `EMBEDDING_MODEL_FOLDER_PATH`.
+        """
+        model_name = os.environ.get("RERANKER_MODEL_NAME")
+        if not model_name:
+            return None
+        model_folder = os.environ.get("EMBEDDING_MODEL_FOLDER_PATH")
+        return cls(
+            model_path=str(Path(model_folder) / model_name) if model_folder else model_name,
+            batch_size=int(os.environ.get("RERANKER_BATCH_SIZE", 16)),
+            time_budget_seconds=float(os.environ.get("RERANKER_TIME_BUDGET_SECONDS", 1.0)),
+        )
+
+    def _load_model(self) -> Any:
+        """
+        Load the cross-encoder once per process, on first use.
+
+        Raises:
+            ImportError: If `sentence_transformers` is not installed.
+        """
+        with self._models_lock:
+            model = self._models.get(self.model_path)
+            if model is None:
+                # pylint: disable=import-outside-toplevel
+                from sentence_transformers import CrossEncoder
+
+                model = self._models[self.model_path] = CrossEncoder(self.model_path, device="cpu")
+            return model
+
+    def _score(self, query: str, documents: list[Document]) -> Optional[list[float]]:
+        """
+        Score every document against the query, or return `None` when the
+        time budget ran out first.
+        """
+        model = self._load_model()
+        started_at = time.monotonic()
+        scores: list[float] = []
+        for start in range(0, len(documents), self.batch_size):
+            if time.monotonic() - started_at > self.time_budget_seconds:
+                logger.warning(
+                    "Re-ranking exceeded its %.2fs budget after %d of %d documents; keeping the retrieval order",
+                    self.time_budget_seconds,
+                    start,
+                    len(documents),
+                )
+                return None
+            batch = documents[start : start + self.batch_size]
+            scores.extend(float(score) for score in model.predict([(query, doc.page_content) for doc in batch]))
+        return scores
+
+    def rerank(self, query: str, documents: list[Document], k: int) -> list[Document]:
+        """
+        Re-rank documents by their relevance to the query and keep the best `k`.
+
+        Falls back to the first `k` documents in their original order when the
+        model cannot be loaded or scoring exceeds the time budget. The
+        cross-encoder score of every re-ranked document is recorded in
+        `metadata["score"]`.
+
+        Args:
+            query (str): The question the documents were retrieved for.
+            documents (list[Document]): The retrieved candidates, best first.
+            k (int): The number of documents to keep.
+
+        Returns:
+            list[Document]: At most `k` documents, best first.
+        """
+        if len(documents) <= 1:
+            return documents[:k]
+        try:
+            scores = self._score(query, documents)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Re-ranking with %s failed; keeping the retrieval order", self.model_path)
+            scores = None
+        if scores is None:
+            return documents[:k]
+        ranked = sorted(zip(documents, scores), key=lambda doc_score: doc_score[1], reverse=True)[:k]
+        for doc, score in ranked:
+            doc.metadata["score"] = score
+        return [doc for doc, _ in ranked]
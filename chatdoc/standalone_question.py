@@ -0,0 +1,62 @@
+"""
+Module defining a cheap heuristic that tells whether a question can be
+understood without the chat history.
+
+Before retrieval, follow-up questions are reformulated into a standalone
+question by the chat model, which costs an extra LLM round trip. Questions
+that don't refer back to the conversation (through pronouns, demonstratives
+or words like "previous") don't need that rewrite, so `is_self_contained`
+lets the chatbot skip it. The heuristic errs on the side of rewriting: any
+English or Dutch referring word, or a very short question, counts as a
+follow-up.
+"""
+import re
+
+MIN_SELF_CONTAINED_WORDS = 4
+
+REFERRING_WORDS = frozenset(
+    {
+        # English
+        "it", "its", "itself", "this", "that", "these", "those", "they", "them", "their", "theirs",
+        "he", "him", "his", "she", "her", "hers", "there", "above", "previous", "previously", "earlier",
+        "former", "latter", "same", "such", "also", "else", "again", "more", "other", "another",
+        # Dutch
+        "dit", "dat", "deze", "die", "hij", "zij", "ze", "hem", "haar", "hun", "hen", "daar", "hier",
+        "eerder", "eerdere", "vorige", "vorig", "bovenstaande", "bovengenoemde",
+        "dezelfde", "hetzelfde", "zo'n", "zulke", "ook", "nog", "weer", "meer", "andere", "ander",
+    }
+)
+
+# Questions that open like this continue the previous turn, e.g. "And the notice period?".
+FOLLOW_UP_OPENINGS = (
+    ("and",), ("but",), ("so",), ("or",), ("then",), ("what", "about"), ("how", "about"),
+    ("en",), ("maar",), ("dus",), ("of",), ("hoe", "zit", "het", "met"),
+)
+
+# Dutch pronominal adverbs such as "daarvan", "hierover" or "ermee".
+DUTCH_PRONOMINAL_ADVERB = re.compile(
+    r"^(daar|hier|er)(aan|achter|bij|binnen|boven|buiten|door|in|langs|mee|na|naast|om|onder|op|over|"
+    r"tegen|toe|tussen|uit|van|voor|zonder)$"
+)
+
+WORD_PATTERN = re.compile(r"[\w']+")
+
+
+def is_self_contained(question: str) -> bool:
+    """
+    Whether a question is likely to be understandable without the chat history.
+
+    Args:
+        question (str): The user's question.
+
+    Returns:
+        bool: `True` if the question has at least `MIN_SELF_CONTAINED_WORDS`
+        words, doesn't open like a follow-up and none of its words refers back
+        to the conversation.
+    """
+    words = WORD_PATTERN.findall(question.casefold())
+    if len(words) < MIN_SELF_CONTAINED_WORDS:
+        return False
+    if any(tuple(words[: len(opening)]) == opening for opening in FOLLOW_UP_OPENINGS):
+        return False
+    return not any(word in REFERRING_WORDS or DUTCH_PRONOMINAL_ADVERB.match(word) for word in words)
@@ -0,0 +1,194 @@
+"""
+Module defining a small, thread-safe LRU cache with time-to-live eviction.
+
+Several components keep expensive, reusable objects around between requests
+(e.g. ready-to-use ``Chatbot`` instances). ``TTLCache`` bounds how many of
+those objects are kept alive (least recently used entries are evicted first)
+and how long an unused entry may linger before it is dropped.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, TypeVar
+
+KeyT = TypeVar("KeyT", bound=Hashable)
+ValueT = TypeVar("ValueT")
+
+
+class TTLCache(Generic[KeyT, ValueT]):
+    """
+    A bounded least-recently-used cache whose entries expire after a
+    configurable time since they were last accessed.
+
+    Attributes:
+        max_size (int): The maximum number of entries kept; a value of `0`
+            disables caching altogether.
+        ttl_seconds (float | None): The number of seconds an entry may stay
+            unused before it expires, or `None` to never expire entries.
+        hits (int): The number of lookups that were answered from the cache.
+        misses (int): The number of lookups that were not.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl_seconds: float | None = None,
+        on_evict: Optional[Callable[[KeyT, ValueT], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Args:
+            max_size (int): The maximum number of entries kept.
+            ttl_seconds (float | None, optional): The idle time after which an
+                entry expires. Defaults to `None` (entries never expire).
+            on_evict (Callable | None, optional): Called with the key and
+                value of every entry that is evicted or expires.
+            clock (Callable, optional): The monotonic clock used to timestamp
+                entries; injectable for tests.
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[KeyT, tuple[ValueT, float]] = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, key: KeyT) -> bool:
+        with self._lock:
+            return key in self._entries and not self._is_expired(self._entries[key][1])
+
+    def _is_expired(self, last_used: float) -> bool:
+        return self.ttl_seconds is not None and self.clock() - last_used > self.ttl_seconds
+
+    def _evict(self, key: KeyT) -> None:
+        value, _ = self._entries.pop(key)
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def purge_expired(self) -> None:
+        """
+        Drop every entry that has not been used within `ttl_seconds`.
+        """
+        with self._lock:
+            expired_keys = [key for key, (_, last_used) in self._entries.items() if self._is_expired(last_used)]
+            for key in expired_keys:
+                self._evict(key)
+
+    def get(self, key: KeyT) -> Optional[ValueT]:
+        """
+        Look up an entry, marking it as most recently used.
+
+        Returns:
+            The cached value, or `None` if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._is_expired(entry[1]):
+                if entry is not None:
+                    self._evict(key)
+                self.misses += 1
+                return None
+            value, _ = entry
+            self._entries[key] = (value, self.clock())
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key: KeyT) -> Optional[ValueT]:
+        """
+        Look up an entry without marking it as used or counting the lookup.
+
+        Returns:
+            The cached value, or `None` if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._is_expired(entry[1]):
+                return None
+            return entry[0]
+
+    def put(self, key: KeyT, value: ValueT) -> None:
+        """
+        Store an entry, evicting the least recently used ones when full.
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                del self._entries[key]
+            self._entries[key] = (value, self.clock())
+            self.purge_expired()
+            while len(self._entries) > self.max_size:
+                self._evict(next(iter(self._entries)))
+
+    def get_or_create(self, key: KeyT, factory: Callable[[], ValueT]) -> ValueT:
+        """
+        Return the cached value for `key`, building and caching it with
+        `factory` on a miss.
+
+        The factory runs outside of the lock so that slow constructions do not
+        serialize unrelated lookups; if two callers race on the same key, the
+        first value to be stored wins.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        value = factory()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._is_expired(entry[1]):
+                return entry[0]
+            self.put(key, value)
+        return value
+
+    def pop(self, key: KeyT) -> Optional[ValueT]:
+        """
+        Remove and return an entry without calling `on_evict`.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry[0] if entry is not None else None
+
+    def items(self) -> list[tuple[KeyT, ValueT]]:
+        """
+        Return a snapshot of the unexpired entries, least recently used first,
+        without marking them as used.
+        """
+        with self._lock:
+            return [
+                (key, value) for key, (value, last_used) in self._entries.items() if not self._is_expired(last_used)
+            ]
+
+    def remove_where(self, predicate: Callable[[KeyT], bool]) -> int:
+        """
+        Evict every entry whose key matches `predicate`.
+
+        Returns:
+            int: The number of evicted entries.
+        """
+        with self._lock:
+            matching_keys = [key for key in self._entries if predicate(key)]
+            for key in matching_keys:
+                self._evict(key)
+            return len(matching_keys)
+
+    def clear(self) -> None:
+        """
+        Evict all entries.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                self._evict(key)
+
+    def stats(self) -> dict[str, int]:
+        """
+        Return the hit/miss counters and current size of the cache.
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "max_size": self.max_size}
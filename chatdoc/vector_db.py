@@ -1,15 +1,36 @@
 """
 Module definine the VectorDatabase class
 """
+import asyncio
+import atexit
+import logging
 import os
-from typing import Literal, TypedDict
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, ClassVar, Iterator, Literal, Optional, TypedDict
+import numpy as np
 from langchain.embeddings.base import Embeddings
 from langchain.schema import Document
 from langchain.vectorstores.chroma import Chroma
 from langchain_core.vectorstores import VectorStoreRetriever
-from langchain_core.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain_core.callbacks.manager import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
 from chromadb import HttpClient, PersistentClient
 from chromadb.api import ClientAPI
+from chromadb.api.models.Collection import Collection
+
+from .answer_cache import AnswerCache
+from .embed.query_embedding_cache import QueryEmbeddingCache
+from .lexical_index import LexicalIndex, is_identifier_query, reciprocal_rank_fusion
+from .reranker import CrossEncoderReranker
+
+logger = logging.getLogger(__name__)
+
+ChromaClientKey = tuple[str, Optional[str], Optional[int]]
 
 
 class SearchArgs(TypedDict, total=True):
@@ -42,82 +63,626 @@ class RetrieverSettings(TypedDict, total=True):
     search_type: str
 
 
+def maximal_marginal_relevance(
+    query_embedding: list[float], candidate_embeddings: list[list[float]], k: int, lambda_mult: float
+) -> tuple[list[int], list[float]]:
+    """
+    Select `k` candidates by maximal marginal relevance.
+
+    The cosine similarities between the candidates are computed once, and the
+    similarity of every candidate to its most similar selected candidate is
+    kept up to date with one vectorized `np.maximum` per selection, instead of
+    recomputing it for every remaining candidate in every round.
+
+    Args:
+        query_embedding (list[float]): The embedding of the query.
+        candidate_embeddings (list[list[float]]): The embeddings of the candidates.
+        k (int): The number of candidates to select.
+        lambda_mult (float): The trade-off between relevance (1) and diversity (0).
+
+    Returns:
+        tuple[list[int], list[float]]: The indices of the selected candidates,
+        in order of selection, and their cosine similarity to the query.
+    """
+    candidates = np.asarray(candidate_embeddings, dtype=np.float64)
+    k = min(k, len(candidates))
+    if k <= 0:
+        return [], []
+    query = np.asarray(query_embedding, dtype=np.float64)
+    candidates = candidates / np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    query_similarities = candidates @ query
+    candidate_similarities = candidates @ candidates.T
+
+    selected = [int(np.argmax(query_similarities))]
+    max_similarity_to_selected = candidate_similarities[selected[0]].copy()
+    is_selected = np.zeros(len(candidates), dtype=bool)
+    is_selected[selected[0]] = True
+    while len(selected) < k:
+        mmr_scores = lambda_mult * query_similarities - (1 - lambda_mult) * max_similarity_to_selected
+        mmr_scores[is_selected] = -np.inf
+        best = int(np.argmax(mmr_scores))
+        selected.append(best)
+        is_selected[best] = True
+        np.maximum(max_similarity_to_selected, candidate_similarities[best], out=max_similarity_to_selected)
+    return selected, [float(query_similarities[i]) for i in selected]
+
+
 class CustomVectorStoreRetriever(VectorStoreRetriever):
-    def _get_relevant_documents(
-        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    """
+    Vector store retriever that records the ranking (and, where available, the
+    relevance score) of every retrieved document in its metadata.
+
+    The query is embedded once through the (optional) `query_embedding_cache`,
+    after which the vector store is searched by vector, so that repeated
+    questions skip the embedding round trip entirely.
+
+    The `hybrid` search type fuses the vector search results with the BM25
+    results of the collection's `lexical_index` by reciprocal rank fusion.
+    Queries that only consist of identifiers (e.g. `7:658`) are answered from
+    the lexical index alone, without embedding them, when it has matches.
+
+    With a `reranker`, `fetch_k` candidates are retrieved and re-ranked by the
+    cross-encoder, of which only the best `k` are returned.
+    """
+
+    query_embedding_cache: Optional[QueryEmbeddingCache] = None
+    lexical_index: Optional[LexicalIndex] = None
+    reranker: Optional[CrossEncoderReranker] = None
+    allowed_search_types: ClassVar[tuple[str, ...]] = (
+        "similarity",
+        "similarity_score_threshold",
+        "mmr",
+        "hybrid",
+    )
+
+    def _get_embedding_fn(self) -> Embeddings:
+        embedding_fn = self.vectorstore.embeddings
+        if embedding_fn is None:
+            raise ValueError("The vector store has no embedding function to embed the query with.")
+        return embedding_fn
+
+    def _embed_query(self, query: str) -> list[float]:
+        embedding_fn = self._get_embedding_fn()
+        if self.query_embedding_cache is None:
+            return embedding_fn.embed_query(query)
+        return self.query_embedding_cache.embed_query(embedding_fn, query)
+
+    async def _aembed_query(self, query: str) -> list[float]:
+        embedding_fn = self._get_embedding_fn()
+        if self.query_embedding_cache is None:
+            return await embedding_fn.aembed_query(query)
+        return await self.query_embedding_cache.aembed_query(embedding_fn, query)
+
+    def _get_candidate_count(self) -> int:
+        """
+        The number of documents to retrieve: `fetch_k` candidates when they
+        are re-ranked afterwards, else `k`.
+        """
+        if self.reranker is not None:
+            return max(self.search_kwargs["k"], self.search_kwargs["fetch_k"])
+        return self.search_kwargs["k"]
+
+    def _max_marginal_relevance_search_by_vector(
+        self, embedding: list[float], search_filter: Optional[dict[str, Any]]
+    ) -> list[Document]:
+        # Fetch the candidates together with their embeddings from the Chroma
+        # collection in a single query, and re-rank them with the vectorized MMR.
+        results = self.vectorstore._collection.query(  # type: ignore[attr-defined] # pylint: disable=protected-access
+            query_embeddings=[embedding],
+            n_results=self.search_kwargs["fetch_k"],
+            where=search_filter,
+            include=["documents", "metadatas", "embeddings"],
+        )
+        selected, scores = maximal_marginal_relevance(
+            embedding,
+            results["embeddings"][0],
+            k=self._get_candidate_count(),
+            lambda_mult=self.search_kwargs["lambda_mult"],
+        )
+        docs = []
+        for i, score in zip(selected, scores):
+            doc = Document(page_content=results["documents"][0][i], metadata=dict(results["metadatas"][0][i] or {}))
+            doc.metadata["score"] = score
+            docs.append(doc)
+        return docs
+
+    def _get_documents_by_fused_rank(
+        self, rankings: list[list[str]], docs_by_id: dict[str, Document], search_filter: Optional[dict[str, Any]]
+    ) -> list[Document]:
+        collection = self.vectorstore._collection  # type: ignore[attr-defined] # pylint: disable=protected-access
+        fused = reciprocal_rank_fusion(rankings)[: self.search_kwargs["fetch_k"]]
+        # Documents only found by the lexical index are fetched by ID, which
+        # also drops the ones that don't match the filter.
+        if missing_ids := [document_id for document_id, _ in fused if document_id not in docs_by_id]:
+            results = collection.get(ids=missing_ids, where=search_filter, include=["documents", "metadatas"])
+            for document_id, page_content, metadata in zip(results["ids"], results["documents"], results["metadatas"]):
+                docs_by_id[document_id] = Document(page_content=page_content, metadata=dict(metadata or {}))
+        docs = []
+        for document_id, score in fused:
+            if (doc := docs_by_id.get(document_id)) is None:
+                continue
+            doc.metadata["score"] = score
+            docs.append(doc)
+            if len(docs) == self._get_candidate_count():
+                break
+        return docs
+
+    def _hybrid_search_by_vector(
+        self, embedding: list[float], query: str, search_filter: Optional[dict[str, Any]]
     ) -> list[Document]:
+        fetch_k = self.search_kwargs["fetch_k"]
+        results = self.vectorstore._collection.query(  # type: ignore[attr-defined] # pylint: disable=protected-access
+            query_embeddings=[embedding], n_results=fetch_k, where=search_filter, include=["documents", "metadatas"]
+        )
+        docs_by_id = {
+            document_id: Document(page_content=page_content, metadata=dict(metadata or {}))
+            for document_id, page_content, metadata in zip(
+                results["ids"][0], results["documents"][0], results["metadatas"][0]
+            )
+        }
+        lexical_ranking = (
+            [document_id for document_id, _ in self.lexical_index.search(query, fetch_k)]
+            if self.lexical_index is not None
+            else []
+        )
+        return self._get_documents_by_fused_rank([results["ids"][0], lexical_ranking], docs_by_id, search_filter)
+
+    def is_lexical_only_query(self, query: str) -> bool:
+        """
+        Whether the query is an identifier lookup that is answered from the
+        lexical index alone (when it has matches), without embedding it.
+        """
+        return self.search_type == "hybrid" and self.lexical_index is not None and is_identifier_query(query)
+
+    def _get_lexical_only_documents(self, query: str) -> Optional[list[Document]]:
+        """
+        Answer identifier lookups from the lexical index alone, or return
+        `None` when the query has to be embedded.
+        """
+        if not self.is_lexical_only_query(query):
+            return None
+        lexical_ranking = [
+            document_id for document_id, _ in self.lexical_index.search(query, self.search_kwargs["fetch_k"])
+        ]
+        if not lexical_ranking:
+            return None
+        docs = self._get_documents_by_fused_rank([lexical_ranking], {}, self.search_kwargs.get("filter"))
+        return docs or None
+
+    def _rank(self, query: str, docs: list[Document]) -> list[Document]:
+        if self.reranker is not None:
+            docs = self.reranker.rerank(query, docs, self.search_kwargs["k"])
+        for i, doc in enumerate(docs):
+            doc.metadata["ranking"] = i + 1
+        return docs
+
+    def _search_by_vector(self, embedding: list[float], query: str) -> list[Document]:
+        k = self._get_candidate_count()
+        search_filter = self.search_kwargs.get("filter")
         if self.search_type == "similarity":
-            docs = self.vectorstore.similarity_search(query, **self.search_kwargs)
+            docs = self.vectorstore.similarity_search_by_vector(embedding, k=k, filter=search_filter)
         elif self.search_type == "similarity_score_threshold":
-            docs_and_similarities = (
-                self.vectorstore.similarity_search_with_relevance_scores(
-                    query, **self.search_kwargs
-                )
+            relevance_score_fn = self.vectorstore._select_relevance_score_fn()  # pylint: disable=protected-access
+            docs_and_distances = self.vectorstore.similarity_search_by_vector_with_relevance_scores(
+                embedding, k=k, filter=search_filter
             )
+            docs_and_similarities = [
+                (doc, relevance_score_fn(distance))
+                for doc, distance in docs_and_distances
+                if relevance_score_fn(distance) >= self.search_kwargs["score_threshold"]
+            ]
             docs_and_similarities.sort(key=lambda doc_sim: doc_sim[1], reverse=True)
             for doc, similarity in docs_and_similarities:
                 doc.metadata["score"] = similarity
             docs = [doc for doc, _ in docs_and_similarities]
         elif self.search_type == "mmr":
-            docs = self.vectorstore.max_marginal_relevance_search(
-                query, **self.search_kwargs
-            )
+            if getattr(self.vectorstore, "_collection", None) is not None:
+                docs = self._max_marginal_relevance_search_by_vector(embedding, search_filter)
+            else:
+                docs = self.vectorstore.max_marginal_relevance_search_by_vector(
+                    embedding,
+                    k=k,
+                    fetch_k=self.search_kwargs["fetch_k"],
+                    lambda_mult=self.search_kwargs["lambda_mult"],
+                    filter=search_filter,
+                )
+        elif self.search_type == "hybrid":
+            docs = self._hybrid_search_by_vector(embedding, query, search_filter)
         else:
             raise ValueError(f"search_type of {self.search_type} not allowed.")
-        for i, doc in enumerate(docs):
-            doc.metadata["ranking"] = i + 1
-        return docs
+        return self._rank(query, docs)
 
-class VectorDatabase:
-    """
-    The VectorDatabase class that creates a ChromaDB store locally
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        if (docs := self._get_lexical_only_documents(query)) is not None:
+            return self._rank(query, docs)
+        return self._search_by_vector(self._embed_query(query), query)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        # The query is embedded with the vendor's async client, while the
+        # (blocking) Chroma query runs in a worker thread, so that concurrent
+        # prompts overlap their I/O instead of blocking the event loop.
+        if (docs := await asyncio.to_thread(self._get_lexical_only_documents, query)) is not None:
+            return await asyncio.to_thread(self._rank, query, docs)
+        embedding = await self._aembed_query(query)
+        return await asyncio.to_thread(self._search_by_vector, embedding, query)
+
+
+class ChromaClientRegistry:
     """
+    Process-wide registry of ChromaDB clients and collection handles.
 
-    _instance = None
+    Clients are keyed by the environment and, for `PROD`, the host and port of
+    the Chroma server, so every `VectorDatabase` reuses the same client (and
+    its warm HTTP connections) instead of opening a new one. Collection handles
+    are cached per client, which saves the `get_or_create_collection` round
+    trip on every request. A client is health-checked with a heartbeat at most
+    once every `CHROMA_HEARTBEAT_INTERVAL_SECONDS`, and is replaced (dropping
+    its collection handles) when the heartbeat fails. The registry also holds
+    the `ChromaWriteBuffer` of every collection, which are flushed on exit.
+    """
 
-    _chroma_db_client = None
+    _clients: dict[ChromaClientKey, ClientAPI] = {}
+    _last_heartbeats: dict[ChromaClientKey, float] = {}
+    _collections: dict[tuple[ChromaClientKey, str], Collection] = {}
+    _write_buffers: dict[str, "ChromaWriteBuffer"] = {}
+    _lock = threading.RLock()
 
-    @property
-    def chroma_client(self) -> ClientAPI:
+    @staticmethod
+    def get_client_key() -> ChromaClientKey:
         """
-        ChromaDB client
+        Determine which client to use from the environment.
+
+        Raises:
+            ValueError: If `CURRENT_ENV` is not a valid DORA environment.
         """
-        if self._chroma_db_client is not None:
-            return self._chroma_db_client
         dora_env = os.environ.get("CURRENT_ENV")
         match dora_env:
             case "DEV" | "TST":
-                self._chroma_db_client = PersistentClient()
+                return dora_env, None, None
             case "PROD":
                 # Connect to the ChromaDB server (e.g. the `dora-chromadb`
                 # service in docker-compose.yml) over HTTP.
-                chroma_server_host = os.environ.get(
-                    "CHROMA_SERVER_HOST", "dora-chromadb"
-                )
-                chroma_server_port = int(
-                    os.environ.get("CHROMA_SERVER_PORT", "8000")
-                )
-                self._chroma_db_client = HttpClient(
-                    host=chroma_server_host, port=chroma_server_port
-                )
+                chroma_server_host = os.environ.get("CHROMA_SERVER_HOST", "dora-chromadb")
+                chroma_server_port = int(os.environ.get("CHROMA_SERVER_PORT", "8000"))
+                return dora_env, chroma_server_host, chroma_server_port
             case _:
                 raise ValueError("Invalid DORA environment")
-        return self._chroma_db_client
+
+    @staticmethod
+    def _create_client(client_key: ChromaClientKey) -> ClientAPI:
+        _dora_env, chroma_server_host, chroma_server_port = client_key
+        if chroma_server_host is None:
+            return PersistentClient()
+        return HttpClient(host=chroma_server_host, port=chroma_server_port)
+
+    @staticmethod
+    def get_heartbeat_interval() -> float:
+        """
+        The number of seconds between two health checks of a cached client.
+        """
+        return float(os.environ.get("CHROMA_HEARTBEAT_INTERVAL_SECONDS", "30"))
+
+    @classmethod
+    def _is_healthy(cls, client_key: ChromaClientKey, client: ClientAPI) -> bool:
+        now = time.monotonic()
+        if now - cls._last_heartbeats.get(client_key, now) < cls.get_heartbeat_interval():
+            return True
+        try:
+            client.heartbeat()
+        except Exception:  # pylint: disable=broad-except
+            logger.warning("ChromaDB client %s failed its heartbeat; reconnecting", client_key, exc_info=True)
+            return False
+        cls._last_heartbeats[client_key] = now
+        return True
+
+    @classmethod
+    def _drop_client(cls, client_key: ChromaClientKey) -> None:
+        cls._clients.pop(client_key, None)
+        cls._last_heartbeats.pop(client_key, None)
+        for collection_key in [key for key in cls._collections if key[0] == client_key]:
+            del cls._collections[collection_key]
+
+    @classmethod
+    def get_client(cls) -> ClientAPI:
+        """
+        Returns the shared client for the current environment, creating it
+        lazily on first use or when the cached client failed its heartbeat.
+
+        Raises:
+            ValueError: If `CURRENT_ENV` is not a valid DORA environment.
+        """
+        client_key = cls.get_client_key()
+        with cls._lock:
+            client = cls._clients.get(client_key)
+            if client is not None and not cls._is_healthy(client_key, client):
+                cls._drop_client(client_key)
+                client = None
+            if client is None:
+                client = cls._create_client(client_key)
+                cls._clients[client_key] = client
+                cls._last_heartbeats[client_key] = time.monotonic()
+            return client
+
+    @staticmethod
+    def get_collection_metadata() -> Optional[dict[str, Any]]:
+        """
+        The HNSW index settings to create collections with, from
+        `CHROMA_HNSW_BATCH_SIZE` and `CHROMA_HNSW_SYNC_THRESHOLD`, or `None`
+        to use Chroma's defaults.
+        """
+        metadata = {
+            key: int(value)
+            for key, value in (
+                ("hnsw:batch_size", os.environ.get("CHROMA_HNSW_BATCH_SIZE")),
+                ("hnsw:sync_threshold", os.environ.get("CHROMA_HNSW_SYNC_THRESHOLD")),
+            )
+            if value
+        }
+        return metadata or None
+
+    @classmethod
+    def get_collection(cls, collection_name: str, metadata: Optional[dict[str, Any]] = None) -> Collection:
+        """
+        Returns the cached handle of a collection of the shared client,
+        getting or creating the collection only the first time it is used.
+
+        Args:
+            collection_name (str): The name of the collection.
+            metadata (dict[str, Any], optional): The metadata to create the
+                collection with; defaults to `get_collection_metadata()`.
+        """
+        client = cls.get_client()
+        client_key = cls.get_client_key()
+        with cls._lock:
+            collection = cls._collections.get((client_key, collection_name))
+            if collection is None:
+                collection = client.get_or_create_collection(
+                    name=collection_name,
+                    embedding_function=None,
+                    metadata=metadata if metadata is not None else cls.get_collection_metadata(),
+                )
+                cls._collections[(client_key, collection_name)] = collection
+            return collection
+
+    @classmethod
+    def get_write_buffer(cls, collection_name: str) -> "ChromaWriteBuffer":
+        """
+        Returns the write buffer of a collection, shared by every
+        `VectorDatabase` of that collection.
+
+        Args:
+            collection_name (str): The name of the collection.
+        """
+        with cls._lock:
+            write_buffer = cls._write_buffers.get(collection_name)
+            if write_buffer is None:
+                write_buffer = ChromaWriteBuffer(
+                    collection_name,
+                    max_size=int(os.environ.get("CHROMA_WRITE_BUFFER_SIZE", "1000")),
+                    flush_interval=float(os.environ.get("CHROMA_WRITE_BUFFER_FLUSH_INTERVAL_SECONDS", "2")),
+                )
+                cls._write_buffers[collection_name] = write_buffer
+            return write_buffer
+
+    @classmethod
+    def flush_all(cls) -> None:
+        """
+        Writes the pending documents of every write buffer to Chroma.
+        """
+        with cls._lock:
+            write_buffers = list(cls._write_buffers.values())
+        for write_buffer in write_buffers:
+            try:
+                write_buffer.flush()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to flush the writes to collection %s", write_buffer.collection_name)
+
+    @classmethod
+    def reset(cls) -> None:
+        """
+        Drops every cached client, collection handle and write buffer,
+        discarding writes that were not flushed yet.
+
+        Mainly useful for tests that need a clean slate between runs.
+        """
+        with cls._lock:
+            for write_buffer in cls._write_buffers.values():
+                write_buffer.clear()
+            cls._clients.clear()
+            cls._last_heartbeats.clear()
+            cls._collections.clear()
+            cls._write_buffers.clear()
+
+
+atexit.register(ChromaClientRegistry.flush_all)
+
+
+class ChromaWriteBuffer:
+    """
+    Write-behind buffer for the documents upserted into a Chroma collection.
+
+    Every write to a persistent Chroma collection commits to disk, so instead
+    of writing every small batch of an upload right away, the documents are
+    collected and upserted together once `max_size` of them are pending, or
+    `flush_interval` seconds after the first one was buffered, whichever
+    comes first. `flush()` writes the pending documents immediately; it is
+    called at the end of every upload, before documents are updated or
+    deleted, and on exit. Documents that fail to be written are put back
+    into the buffer, so that a failed timed flush is retried (and its error
+    raised) by the next flush. A `max_size` of `0` writes every batch
+    through, and a `flush_interval` of `0` disables the timed flush.
+    """
+
+    def __init__(self, collection_name: str, max_size: int, flush_interval: float) -> None:
+        self.collection_name = collection_name
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._pending: list[tuple[str, list[float], Document]] = []
+        self._lock = threading.Lock()
+        # Held while writing, so a flush only returns once every write that
+        # started before it has finished.
+        self._write_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def add(self, document_ids: list[str], documents: list[Document], embeddings: list[list[float]]) -> None:
+        """
+        Buffers documents to be upserted, writing the buffer if it is full.
+
+        Args:
+            document_ids (list[str]): The IDs of the documents.
+            documents (list[Document]): The documents.
+            embeddings (list[list[float]]): The embedding of every document, in the same order.
+        """
+        with self._lock:
+            self._pending.extend(zip(document_ids, embeddings, documents))
+            is_full = len(self._pending) >= self.max_size
+            if not is_full and self._timer is None and self.flush_interval > 0:
+                self._timer = threading.Timer(self.flush_interval, self._flush_in_background)
+                self._timer.daemon = True
+                self._timer.start()
+        if is_full:
+            self.flush()
+
+    def _flush_in_background(self) -> None:
+        try:
+            self.flush()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Failed to flush the writes to collection %s", self.collection_name)
+
+    def _take_pending(self) -> list[tuple[str, list[float], Document]]:
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            return pending
+
+    def _restore_pending(self, rows: list[tuple[str, list[float], Document]]) -> None:
+        with self._lock:
+            self._pending[:0] = rows
+
+    def flush(self) -> None:
+        """
+        Upserts every pending document into the collection.
+
+        Raises:
+            Exception: Any error of the upsert, after putting the documents
+                that were not written back into the buffer.
+        """
+        with self._write_lock:
+            pending = self._take_pending()
+            if not pending:
+                return
+            # Chroma rejects empty metadata dicts, so documents without metadata
+            # are written in a separate call without any metadatas.
+            unwritten_batches = [
+                rows
+                for has_metadata in (True, False)
+                if (rows := [row for row in pending if bool(row[2].metadata) == has_metadata])
+            ]
+            try:
+                collection = ChromaClientRegistry.get_collection(self.collection_name)
+                while unwritten_batches:
+                    rows = unwritten_batches[0]
+                    collection.upsert(
+                        ids=[document_id for document_id, _, _ in rows],
+                        embeddings=[embedding for _, embedding, _ in rows],
+                        documents=[document.page_content for _, _, document in rows],
+                        metadatas=[document.metadata for _, _, document in rows] if rows[0][2].metadata else None,
+                    )
+                    unwritten_batches.pop(0)
+            except BaseException:
+                self._restore_pending([row for rows in unwritten_batches for row in rows])
+                raise
+
+    def clear(self) -> None:
+        """
+        Discards every pending document.
+        """
+        self._take_pending()
+
+
+class _CollectionCachingClient:
+    """
+    Wraps a ChromaDB client so that langchain's `Chroma`, which calls
+    `get_or_create_collection` whenever it is constructed, gets the collection
+    handle cached by the `ChromaClientRegistry` instead. Everything else is
+    passed through to the wrapped client.
+    """
+
+    def __init__(self, client: ClientAPI) -> None:
+        self._client = client
+
+    def get_or_create_collection(
+        self, name: str, embedding_function: Any = None, metadata: Optional[dict[str, Any]] = None
+    ) -> Collection:
+        """
+        Returns the cached handle of the collection.
+        """
+        del embedding_function  # `Chroma` embeds documents itself
+        return ChromaClientRegistry.get_collection(name, metadata=metadata)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+
+class VectorDatabase:
+    """
+    The VectorDatabase class that creates a ChromaDB store locally
+    """
+
+    _instance = None
+
+    @property
+    def chroma_client(self) -> ClientAPI:
+        """
+        ChromaDB client, shared by every VectorDatabase through the `ChromaClientRegistry`
+        """
+        return ChromaClientRegistry.get_client()
 
     def __init__(self, collection_name: str, embedding_fn: Embeddings) -> None:
         self.collection_name = collection_name
         self.chroma_instance = Chroma(
             collection_name=collection_name,
-            client=self.chroma_client,
+            client=_CollectionCachingClient(self.chroma_client),  # type: ignore[arg-type]
             embedding_function=embedding_fn,
-            persist_directory="./chroma_db",
         )
+        self.write_buffer = ChromaClientRegistry.get_write_buffer(collection_name)
+        self.lexical_index = LexicalIndex.get_shared_index(collection_name, self._get_stored_documents)
         self.retriever_settings: RetrieverSettings = self.load_retriever_settings()
         self.retriever = CustomVectorStoreRetriever(
             vectorstore=self.chroma_instance,
+            query_embedding_cache=QueryEmbeddingCache.get_shared_cache(),
+            lexical_index=self.lexical_index,
+            reranker=CrossEncoderReranker.from_env(),
             **self.retriever_settings, # type: ignore
         )
 
+    def _get_stored_documents(self, page_size: int = 1000) -> Iterator[tuple[list[str], list[str]]]:
+        """
+        Reads the IDs and texts of the documents stored in the collection,
+        `page_size` at a time, e.g. to rebuild its lexical index.
+        """
+        collection = ChromaClientRegistry.get_collection(self.collection_name)
+        offset = 0
+        while True:
+            page = collection.get(include=["documents"], limit=page_size, offset=offset)
+            document_ids, texts = page["ids"], page["documents"] or []
+            if document_ids:
+                yield list(document_ids), [text or "" for text in texts]
+            if len(document_ids) < page_size:
+                return
+            offset += page_size
+
     def load_retriever_settings(
         self,
         top_k_documents_default=5,
@@ -171,9 +736,110 @@ class VectorDatabase:
                 A list of document IDs for the documents that were added.
         """
         document_ids: list[str] = await self.chroma_instance.aadd_documents(documents)
-        self.chroma_instance.persist()
+        self.lexical_index.add_documents(document_ids, [document.page_content for document in documents])
+        AnswerCache.get_shared_cache().invalidate_collection(self.collection_name)
+        await asyncio.to_thread(self.lexical_index.save)
+        return document_ids
+
+    async def add_embedded_documents(
+        self, documents: list[Document], embeddings: list[list[float]]
+    ) -> list[str]:
+        """
+        Add documents whose embeddings were already computed to the vector database.
+
+        The documents go through the collection's `ChromaWriteBuffer`, so they
+        may only be written once `flush()` is called.
+
+        Args:
+            documents (list[Document]):
+                The documents to be added.
+            embeddings (list[list[float]]):
+                The embedding of every document, in the same order.
+
+        Returns:
+            document_ids (list[str]):
+                A list of document IDs for the documents that were added.
+        """
+        document_ids = [str(uuid.uuid4()) for _ in documents]
+        await asyncio.to_thread(self.write_buffer.add, document_ids, documents, embeddings)
+        self.lexical_index.add_documents(document_ids, [document.page_content for document in documents])
+        AnswerCache.get_shared_cache().invalidate_collection(self.collection_name)
         return document_ids
 
+    def _flush(self) -> None:
+        self.write_buffer.flush()
+        self.lexical_index.save()
+
+    async def flush(self) -> None:
+        """
+        Write the documents pending in the collection's write buffer to the
+        vector database, and persist the collection's lexical index.
+        """
+        await asyncio.to_thread(self._flush)
+
+    def _update_document_metadata(self, document_ids: list[str], metadatas: list[dict[str, Any]]) -> None:
+        self.write_buffer.flush()
+        # Chroma rejects empty metadata dicts, so those documents are left as they are.
+        updates = [(document_id, metadata) for document_id, metadata in zip(document_ids, metadatas) if metadata]
+        if updates:
+            self.chroma_instance._collection.update(  # pylint: disable=protected-access
+                ids=[document_id for document_id, _ in updates],
+                metadatas=[metadata for _, metadata in updates],
+            )
+            AnswerCache.get_shared_cache().invalidate_collection(self.collection_name)
+
+    async def update_document_metadata(self, document_ids: list[str], metadatas: list[dict[str, Any]]) -> None:
+        """
+        Update the metadata of documents that are already in the vector database,
+        without re-embedding them.
+
+        Args:
+            document_ids (list[str]):
+                The IDs of the documents to update.
+            metadatas (list[dict[str, Any]]):
+                The new metadata of every document, in the same order.
+        """
+        await asyncio.to_thread(self._update_document_metadata, document_ids, metadatas)
+
+    def _update_document_sources(self, document_sources: dict[str, set[str]]) -> None:
+        self.write_buffer.flush()
+        collection = self.chroma_instance._collection  # pylint: disable=protected-access
+        results = collection.get(ids=list(document_sources), include=["metadatas"])
+        updates = []
+        for document_id, metadata in zip(results["ids"], results["metadatas"]):
+            sources = document_sources[document_id]
+            source = (metadata or {}).get("source")
+            if sources and (not isinstance(source, str) or Path(source).name not in sources):
+                updates.append((document_id, {**(metadata or {}), "source": min(sources)}))
+        if updates:
+            collection.update(
+                ids=[document_id for document_id, _ in updates],
+                metadatas=[metadata for _, metadata in updates],
+            )
+            AnswerCache.get_shared_cache().invalidate_collection(self.collection_name)
+        logger.info("Updated the source of %d shared document(s) in collection %s", len(updates), self.collection_name)
+
+    async def update_document_sources(self, document_sources: dict[str, set[str]]) -> None:
+        """
+        Point the source of documents whose file is gone at a file that still
+        contains them, so that citations of the documents name that file.
+        Identical files share their documents, which keep the source of the
+        file they were first ingested from.
+
+        Args:
+            document_sources (dict[str, set[str]]):
+                The names of the files that contain every document, by document ID.
+                Documents whose source is one of those files are left as they are.
+        """
+        await asyncio.to_thread(self._update_document_sources, document_sources)
+
+    def _delete_documents(self, document_ids: list[str]) -> None:
+        self.write_buffer.flush()
+        self.chroma_instance.delete(document_ids)
+        self.lexical_index.remove_documents(document_ids)
+        AnswerCache.get_shared_cache().invalidate_collection(self.collection_name)
+        self.lexical_index.save()
+
     async def delete_documents(self, document_ids: list[str]) -> bool:
         """
         Delete a document from the vector database.
@@ -186,8 +852,7 @@ class VectorDatabase:
             None
         """
         try:
-            self.chroma_instance.delete(document_ids)
-            self.chroma_instance.persist()
+            await asyncio.to_thread(self._delete_documents, document_ids)
         except Exception as ChromaError:
             raise Exception(f"Error deleting document: {ChromaError}")
         return True
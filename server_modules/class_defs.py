@@ -43,6 +43,40 @@ class WEMUploadResponse(ResponseMessage):
     fileIdMapping: list[dict[str, list[str]]]
 
 
+class UploadProgress(TypedDict):
+    """
+    Represents the progress of processing uploaded files.
+
+    Attributes:
+        filesTotal (int): The number of uploaded files.
+        filesParsed (int): The number of files that have been parsed and split.
+        chunksProduced (int): The number of chunks the parsed files were split into.
+        chunksEmbedded (int): The number of chunks that have been embedded.
+        chunksWritten (int): The number of chunks written to the vector database.
+        bytesTotal (int): The total size of the uploaded files.
+        bytesProcessed (int): The size of the part of the files that has been processed.
+        etaSeconds (float | None): The estimated number of seconds until
+            processing finishes, or `None` if it can't be estimated yet.
+    """
+
+    filesTotal: int
+    filesParsed: int
+    chunksProduced: int
+    chunksEmbedded: int
+    chunksWritten: int
+    bytesTotal: int
+    bytesProcessed: int
+    etaSeconds: float | None
+
+
+class UploadStatusResponse(WEMUploadResponse):
+    """
+    Represents a response for files that are still being processed.
+    """
+
+    progress: UploadProgress
+
+
 class UploadResponse(ResponseMessage):
     """
     Represents a response for uploading files.
@@ -61,10 +95,19 @@ class PromptResponse(ResponseMessage):
 
 class ChatHistoryResponse(ResponseMessage):
     """
-    Represents a response for chat history.
+    Represents a (page of the) chat history.
+
+    Attributes:
+        result (list[dict[str, Any]]): The messages, oldest first, each with its `id`.
+        lastId (int | None): The ID of the last returned message, or the
+            requested `after_id` when there are no newer messages; pass it as
+            `after_id` to get the next page or the messages sent since.
+        hasMore (bool): Whether more messages follow the returned page.
     """
 
     result: list[dict[str, Any]]
+    lastId: int | None
+    hasMore: bool
 
 
 class SessionQueryResponse(ResponseMessage):
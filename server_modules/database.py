@@ -6,34 +6,173 @@ rest of the codebase (e.g. ``server_modules.methods``) does not need to
 repeat ``sqlalchemy.create_engine(...)`` boilerplate for every database
 operation. Engines are cached per connection string so repeated calls reuse
 the same connection pool.
+
+There is no migration tool in this project: ``create_all_tables`` creates
+missing tables and then applies *additive* schema changes (new nullable
+columns and new indexes) to tables that already exist, see
+``apply_additive_migrations``. Since that inspects the database, request
+handlers call ``ensure_schema`` instead, which only does so once per schema
+and connection string per process (normally at startup, see
+``bootstrap_schemas``).
 """
 
+import logging
+import os
+import threading
 from contextlib import contextmanager
-from functools import lru_cache
-from typing import Iterator
+from typing import Any, Iterator
 
 import sqlalchemy
 from sqlalchemy import Engine
 from sqlalchemy.orm import DeclarativeBase, Session
 
+logger = logging.getLogger(__name__)
+
+_engines: dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+_initialized_schemas: set[tuple[sqlalchemy.MetaData, str]] = set()
+_initialized_schemas_lock = threading.Lock()
+
+
+def get_pool_options(connection_string: str) -> dict[str, Any]:
+    """
+    Build the connection pool options of an engine from the environment.
+
+    ``DATABASE_POOL_PRE_PING`` (default ``true``) and
+    ``DATABASE_POOL_RECYCLE_SECONDS`` (default ``3600``, MariaDB drops idle
+    connections after ``wait_timeout``) apply to every database.
+    ``DATABASE_POOL_SIZE`` (default ``5``) and ``DATABASE_MAX_OVERFLOW``
+    (default ``10``) are skipped for SQLite, whose in-memory databases don't
+    use a sized pool.
+    """
+    pool_options: dict[str, Any] = {
+        "pool_pre_ping": os.environ.get("DATABASE_POOL_PRE_PING", "true").lower() == "true",
+        "pool_recycle": int(os.environ.get("DATABASE_POOL_RECYCLE_SECONDS", 3600)),
+    }
+    if sqlalchemy.make_url(connection_string).get_backend_name() != "sqlite":
+        pool_options["pool_size"] = int(os.environ.get("DATABASE_POOL_SIZE", 5))
+        pool_options["max_overflow"] = int(os.environ.get("DATABASE_MAX_OVERFLOW", 10))
+    return pool_options
+
 
-@lru_cache(maxsize=None)
 def get_engine(connection_string: str) -> Engine:
     """
     Get a (cached) SQLAlchemy engine for the given connection string.
 
     Engines are expensive to create and are meant to be reused, so this
-    function caches one engine per unique connection string.
+    function caches one engine (and thus one connection pool) per unique
+    connection string, configured with ``get_pool_options``.
     """
-    return sqlalchemy.create_engine(connection_string)
+    with _engines_lock:
+        if connection_string not in _engines:
+            _engines[connection_string] = sqlalchemy.create_engine(
+                connection_string, **get_pool_options(connection_string)
+            )
+        return _engines[connection_string]
+
+
+def dispose_engines() -> None:
+    """
+    Close the pooled connections of every cached engine.
+
+    This must be called when a process that used the databases is about to
+    fork, e.g. after ``bootstrap_schemas`` ran at import time under gunicorn's
+    ``--preload``: forked workers would otherwise inherit (and share) the
+    parent's open connections. The engines stay cached, and open new
+    connections when they are used again.
+    """
+    with _engines_lock:
+        engines = list(_engines.values())
+    for engine in engines:
+        engine.dispose()
+
+
+def apply_additive_migrations(base: type[DeclarativeBase], connection_string: str) -> None:
+    """
+    Add the columns and indexes that were added to the models of ``base``
+    after their tables had been created.
+
+    ``metadata.create_all`` only creates missing tables, so without this,
+    existing databases would never get new columns. Only additive changes are
+    applied; new columns must be nullable (or have a server default), since
+    existing rows have no value for them.
+
+    Raises:
+        ValueError: If a missing column is not nullable and has no server default.
+    """
+    engine = get_engine(connection_string)
+    inspector = sqlalchemy.inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    for table in base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        missing_columns = [column for column in table.columns if column.name not in existing_columns]
+        if missing_columns:
+            with engine.begin() as connection:
+                for column in missing_columns:
+                    if not column.nullable and column.server_default is None:
+                        raise ValueError(
+                            f"Cannot add non-nullable column {table.name}.{column.name} to an existing table"
+                        )
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.execute(
+                        sqlalchemy.text(
+                            f"ALTER TABLE {preparer.format_table(table)} "
+                            f"ADD COLUMN {preparer.format_column(column)} {column_type}"
+                        )
+                    )
+                    logger.info("Added column %s.%s", table.name, column.name)
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(engine, checkfirst=True)
+                logger.info("Created index %s on %s", index.name, table.name)
 
 
 def create_all_tables(base: type[DeclarativeBase], connection_string: str) -> None:
     """
-    Create all tables belonging to ``base``'s metadata if they don't exist yet.
+    Create all tables belonging to ``base``'s metadata if they don't exist yet,
+    and apply additive schema changes to the ones that do.
     """
     engine = get_engine(connection_string)
     base.metadata.create_all(engine)
+    apply_additive_migrations(base, connection_string)
+
+
+def ensure_schema(base: type[DeclarativeBase], connection_string: str) -> None:
+    """
+    Run ``create_all_tables`` for ``base``'s metadata, unless it already ran
+    for this connection string in this process.
+    """
+    key = (base.metadata, connection_string)
+    with _initialized_schemas_lock:
+        if key not in _initialized_schemas:
+            create_all_tables(base, connection_string)
+            _initialized_schemas.add(key)
+
+
+def bootstrap_schemas(schemas: dict[type[DeclarativeBase], str | None]) -> None:
+    """
+    Create (or migrate) the schema of every database at startup, so that no
+    request pays for it. Databases without a connection string are skipped.
+
+    Args:
+        schemas (dict): The connection string of every declarative base.
+    """
+    for base, connection_string in schemas.items():
+        if connection_string:
+            ensure_schema(base, connection_string)
+            logger.info("Initialized the schema of %s", base.__name__)
+
+
+def reset_initialized_schemas() -> None:
+    """
+    Forget which schemas were initialized. Mainly useful for tests.
+    """
+    with _initialized_schemas_lock:
+        _initialized_schemas.clear()
 
 
 @contextmanager
@@ -0,0 +1,327 @@
+"""
+Pipelined ingestion of uploaded files into the vector database.
+
+Files used to be processed strictly one after another (load, split, embed,
+write, then the next file). `IngestionPipeline` overlaps those stages instead:
+
+- parsing/splitting runs in a process pool, since PDF parsing is CPU-bound and
+  would otherwise be serialized by the GIL;
+- the chunks of every file are embedded in token-sized batches by an
+  `EmbeddingBatcher`, with a bounded (and rate-limit aware) number of batches
+  in flight at any time;
+- every embedded batch is written to Chroma in a single call.
+
+In incremental mode, the chunks of a file are hashed and matched against the
+chunks stored for a previous revision of the file: matching chunks keep their
+document IDs (and embeddings), and only new chunks are embedded and written.
+
+The pipeline reports its progress (files parsed, chunks produced, embedded
+and written, bytes processed) through an optional callback after every step.
+"""
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Callable, cast
+
+from langchain.embeddings.base import Embeddings
+from langchain.schema import Document
+
+from chatdoc.doc_loader.document_loader import DocumentLoader
+from chatdoc.doc_loader.document_loader_factory import DocumentLoaderFactory
+from chatdoc.embed.embedding_batcher import EmbeddingBatcher
+from chatdoc.vector_db import VectorDatabase
+
+logger = logging.getLogger(__name__)
+
+_process_pool: ProcessPoolExecutor | None = None
+
+
+def load_and_split_file(file_name: str, file_path: Path) -> list[Document]:
+    """
+    Load a single file and split it into chunks.
+
+    Defined at module level so that it can be pickled and run in a worker process.
+    """
+    document_loader = DocumentLoader({file_name: file_path}, DocumentLoaderFactory())
+    document_iterator = document_loader.document_iterators_dict[file_name]
+    return document_loader.text_splitter.split_documents(document_iterator)
+
+
+def hash_chunk(document: Document) -> str:
+    """
+    Compute the SHA-256 hash of a chunk's text, used to recognize unchanged
+    chunks across revisions of a file.
+    """
+    return hashlib.sha256(document.page_content.encode("utf-8")).hexdigest()
+
+
+def get_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Get the process-wide pool that parses files, creating it lazily on first use.
+
+    The pool is kept alive between uploads so that the cost of spawning the
+    worker processes (and importing the document loaders in them) is only
+    paid once. Workers are spawned rather than forked, since forking a
+    multi-threaded server process is not safe. Spawned workers re-import the
+    `__main__` module of the server, so it must be safe to import again (see
+    the debugger listener in `app.py`).
+    """
+    global _process_pool  # pylint: disable=global-statement
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+
+def shutdown_process_pool() -> None:
+    """
+    Shut down the process-wide parsing pool, if it was started. Mainly useful for tests.
+    """
+    global _process_pool  # pylint: disable=global-statement
+    if _process_pool is not None:
+        _process_pool.shutdown()
+        _process_pool = None
+
+
+@dataclass
+class IngestionSettings:
+    """
+    Represents the tuning knobs of the ingestion pipeline.
+
+    Attributes:
+        parse_workers (int): The number of worker processes that parse and
+            split files. `0` parses in threads of the current process instead.
+        batch_size (int): The maximum number of chunks embedded (and written)
+            per batch; batches are further limited by their token count.
+        max_in_flight_batches (int): The maximum number of batches being
+            embedded concurrently.
+        incremental (bool): Whether unchanged chunks of a re-uploaded file
+            keep their document IDs instead of being embedded again.
+    """
+
+    parse_workers: int = field(
+        default_factory=lambda: int(os.environ.get("INGESTION_WORKERS", min(4, os.cpu_count() or 1)))
+    )
+    batch_size: int = field(default_factory=lambda: int(os.environ.get("INGESTION_BATCH_SIZE", 64)))
+    max_in_flight_batches: int = field(
+        default_factory=lambda: int(os.environ.get("INGESTION_MAX_IN_FLIGHT_BATCHES", 4))
+    )
+    incremental: bool = field(
+        default_factory=lambda: os.environ.get("INCREMENTAL_INGESTION", "true").lower() in ("1", "true", "yes")
+    )
+
+
+@dataclass
+class IngestedFile:
+    """
+    Represents the chunks of an ingested file.
+
+    Attributes:
+        document_ids (list[str]): The document ID of every chunk, in chunk order.
+        chunk_hashes (list[str | None]): The hash of every chunk, in chunk order
+            (`None` for chunks ingested before chunk hashes were recorded).
+    """
+
+    document_ids: list[str]
+    chunk_hashes: list[str | None]
+
+
+@dataclass
+class IngestionProgress:
+    """
+    Represents how far the ingestion of an upload has progressed.
+
+    Attributes:
+        files_total (int): The number of files being ingested.
+        files_parsed (int): The number of files that have been parsed and split.
+        chunks_produced (int): The number of chunks the parsed files were split into.
+        chunks_embedded (int): The number of chunks that have been embedded.
+        chunks_written (int): The number of chunks written to the vector database.
+        bytes_total (int): The total size of the files being ingested.
+        bytes_processed (int): The size of the part of the files whose chunks
+            have been written, prorated by chunk within every file.
+    """
+
+    files_total: int = 0
+    files_parsed: int = 0
+    chunks_produced: int = 0
+    chunks_embedded: int = 0
+    chunks_written: int = 0
+    bytes_total: int = 0
+    bytes_processed: int = 0
+
+
+ProgressCallback = Callable[[IngestionProgress], None]
+
+
+class IngestionPipeline:
+    """
+    Loads, splits, embeds and stores files concurrently.
+    """
+
+    def __init__(
+        self,
+        vector_db: VectorDatabase,
+        embedding_fn: Embeddings,
+        settings: IngestionSettings | None = None,
+        on_progress: ProgressCallback | None = None,
+    ) -> None:
+        """
+        Args:
+            vector_db (VectorDatabase): The vector database the chunks are written to.
+            embedding_fn (Embeddings): The embedding function for the chunks.
+            settings (IngestionSettings | None, optional): The tuning knobs of
+                the pipeline. Defaults to the settings from the environment.
+            on_progress (ProgressCallback | None, optional): Called with a
+                snapshot of the progress after every step.
+        """
+        self.vector_db = vector_db
+        self.embedding_fn = embedding_fn
+        self.settings = settings if settings is not None else IngestionSettings()
+        self.on_progress = on_progress
+        self.progress = IngestionProgress()
+        self.embedding_batcher = EmbeddingBatcher(
+            embedding_fn,
+            max_texts_per_batch=self.settings.batch_size,
+            max_concurrency=self.settings.max_in_flight_batches,
+        )
+
+    def _report_progress(self, **increments: int) -> None:
+        for name, increment in increments.items():
+            setattr(self.progress, name, getattr(self.progress, name) + increment)
+        if self.on_progress is not None:
+            self.on_progress(replace(self.progress))
+
+    def _get_parse_executor(self) -> Executor:
+        if self.settings.parse_workers > 0:
+            return get_process_pool(self.settings.parse_workers)
+        return ThreadPoolExecutor(thread_name_prefix="ingestion-parse")
+
+    async def _ingest_batch(self, documents: list[Document]) -> list[str]:
+        """
+        Embed a batch of chunks and write it to the vector database in one call.
+        """
+        embeddings = await self.embedding_batcher.aembed_batch([document.page_content for document in documents])
+        self._report_progress(chunks_embedded=len(documents))
+        document_ids = await self.vector_db.add_embedded_documents(documents, embeddings)
+        self._report_progress(chunks_written=len(documents))
+        return document_ids
+
+    async def _ingest_file(
+        self,
+        file_name: str,
+        file_path: Path,
+        parse_executor: Executor,
+        existing_chunks: dict[str, list[str]] | None = None,
+    ) -> IngestedFile:
+        """
+        Parse and split a file, then embed and store its new chunks batch by batch.
+
+        Args:
+            file_name (str): The name of the file.
+            file_path (Path): The path of the file.
+            parse_executor (Executor): The executor that parses and splits the file.
+            existing_chunks (dict[str, list[str]] | None, optional): The
+                document IDs of the chunks stored for a previous revision of
+                the file, by chunk hash. Chunks with a matching hash reuse
+                those document IDs instead of being embedded again.
+
+        Returns:
+            IngestedFile: The document IDs and hashes of the file's chunks, in chunk order.
+        """
+        event_loop = asyncio.get_running_loop()
+        file_size = file_path.stat().st_size if file_path.exists() else 0
+        documents = await event_loop.run_in_executor(parse_executor, load_and_split_file, file_name, file_path)
+        self._report_progress(files_parsed=1, chunks_produced=len(documents))
+        if not documents:
+            self._report_progress(bytes_processed=file_size)
+            return IngestedFile(document_ids=[], chunk_hashes=[])
+        chunk_hashes = [hash_chunk(document) for document in documents]
+        reusable_document_ids = {chunk_hash: list(ids) for chunk_hash, ids in (existing_chunks or {}).items()}
+        document_ids: list[str | None] = [
+            reusable_document_ids[chunk_hash].pop(0) if reusable_document_ids.get(chunk_hash) else None
+            for chunk_hash in chunk_hashes
+        ]
+        reused_indices = [index for index, document_id in enumerate(document_ids) if document_id is not None]
+        new_indices = [index for index, document_id in enumerate(document_ids) if document_id is None]
+        if reused_indices:
+            # Unchanged chunks may have moved (e.g. to another page), so keep their metadata current.
+            await self.vector_db.update_document_metadata(
+                [cast(str, document_ids[index]) for index in reused_indices],
+                [documents[index].metadata for index in reused_indices],
+            )
+        chunks_written = len(reused_indices)
+        self._report_progress(
+            chunks_embedded=chunks_written,
+            chunks_written=chunks_written,
+            bytes_processed=file_size * chunks_written // len(documents),
+        )
+        batches = [
+            [new_indices[position] for position in batch]
+            for batch in self.embedding_batcher.make_batches([documents[index].page_content for index in new_indices])
+        ]
+        logger.info(
+            "Split %s into %d chunks, embedding %d new chunks (%d batches)",
+            file_name,
+            len(documents),
+            len(new_indices),
+            len(batches),
+        )
+
+        async def ingest_batch(batch: list[int]) -> None:
+            nonlocal chunks_written
+            batch_document_ids = await self._ingest_batch([documents[index] for index in batch])
+            for index, document_id in zip(batch, batch_document_ids):
+                document_ids[index] = document_id
+            # Prorate the file's bytes by chunk, such that the increments add up to its exact size.
+            bytes_before = file_size * chunks_written // len(documents)
+            chunks_written += len(batch)
+            self._report_progress(bytes_processed=file_size * chunks_written // len(documents) - bytes_before)
+
+        await asyncio.gather(*(ingest_batch(batch) for batch in batches))
+        return IngestedFile(document_ids=cast(list[str], document_ids), chunk_hashes=list(chunk_hashes))
+
+    async def run(
+        self,
+        file_dict: dict[str, Path],
+        existing_chunks: dict[str, dict[str, list[str]]] | None = None,
+    ) -> dict[str, IngestedFile]:
+        """
+        Ingest all files concurrently.
+
+        Args:
+            file_dict (dict[str, Path]): A dictionary mapping file names to their paths.
+            existing_chunks (dict[str, dict[str, list[str]]] | None, optional):
+                Per file name, the document IDs of the chunks stored for a
+                previous revision of the file, by chunk hash. Only used when
+                the pipeline is incremental.
+
+        Returns:
+            dict[str, IngestedFile]: The document IDs and hashes of every file's chunks.
+        """
+        parse_executor = self._get_parse_executor()
+        file_names = list(file_dict)
+        existing_chunks = existing_chunks if existing_chunks is not None and self.settings.incremental else {}
+        self.progress = IngestionProgress(
+            files_total=len(file_names),
+            bytes_total=sum(path.stat().st_size for path in file_dict.values() if path.exists()),
+        )
+        self._report_progress()
+        try:
+            ingested_files = await asyncio.gather(
+                *(
+                    self._ingest_file(file_name, file_dict[file_name], parse_executor, existing_chunks.get(file_name))
+                    for file_name in file_names
+                )
+            )
+            await self.vector_db.flush()
+        finally:
+            if isinstance(parse_executor, ThreadPoolExecutor):
+                parse_executor.shutdown(wait=False)
+        return dict(zip(file_names, ingested_files))
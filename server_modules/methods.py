@@ -1,3 +1,6 @@
+import asyncio
+import base64
+import hashlib
 import os
 from pathlib import Path
 import tempfile
@@ -5,43 +8,55 @@ import shutil
 import logging
 from datetime import datetime
 from typing import Any
-from tqdm.auto import tqdm
 
 import sqlalchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.datastructures import FileStorage
 
-from chatdoc.doc_loader.document_loader import DocumentLoader
-from chatdoc.doc_loader.document_loader_factory import DocumentLoaderFactory
 from chatdoc.vector_db import VectorDatabase
 from chatdoc.embed.embedding_factory import EmbeddingFactory
 from chatdoc.utils import Utils
-from server_modules.database import create_all_tables, session_scope
+from server_modules.database import ensure_schema, session_scope
+from server_modules.ingestion import IngestedFile, IngestionPipeline, IngestionSettings, ProgressCallback
 from server_modules.models import FinalAnswerModel, ChatHistoryModel, DocumentModel
 
 logger = logging.getLogger(__name__)
 
+# A multiple of 4, so that every chunk of (whitespace-free) base64 data decodes on its own.
+BASE64_DECODE_CHUNK_SIZE = 4 * 1024 * 1024
 
-def create_tmp_dir(session_id: str) -> Path:
+
+def get_tmp_dir(session_id: str, upload_id: str | None = None) -> Path:
     """
-    Create a temporary directory to store the files of the session ID in before processing them asynchronously
-    Return: a Path object with the path to the new directory
+    Get the temporary directory of the session ID, or of one of its uploads
+    (a subdirectory named after the upload ID), so that concurrent uploads of
+    a session never share their files.
+    Return: a Path object with the path to the directory
     """
     if session_id == "":
         raise ValueError("Session ID cannot be empty")
     dir_path: Path = Path(tempfile.gettempdir()) / Path(session_id)
+    return dir_path / Path(upload_id) if upload_id else dir_path
+
+
+def create_tmp_dir(session_id: str, upload_id: str | None = None) -> Path:
+    """
+    Create a temporary directory to store the files of the session ID (or of
+    one of its uploads) in before processing them asynchronously
+    Return: a Path object with the path to the new directory
+    """
+    dir_path = get_tmp_dir(session_id, upload_id)
     os.makedirs(dir_path, exist_ok=True)
     return dir_path
 
 
-def delete_tmp_dir(session_id: str) -> bool:
+def delete_tmp_dir(session_id: str, upload_id: str | None = None) -> bool:
     """
-    Delete the temporary directory coupled with the session ID when processing has finished
+    Delete the temporary directory coupled with the session ID (or only that
+    of one of its uploads) when processing has finished
     Return: a bool to indicate if it succeeded
     """
-    if session_id == "":
-        raise ValueError("Session ID cannot be empty")
-    dir_path: Path = Path(tempfile.gettempdir()) / Path(session_id)
+    dir_path = get_tmp_dir(session_id, upload_id)
     try:
         shutil.rmtree(dir_path, ignore_errors=True)
         return True
@@ -49,6 +64,51 @@ def delete_tmp_dir(session_id: str) -> bool:
         return False
 
 
+def decode_base64_to_file(
+    encoded_data: str, file_path: Path, chunk_size: int = BASE64_DECODE_CHUNK_SIZE
+) -> int:
+    """
+    Decode base64 data chunk by chunk straight into a file, so that the
+    decoded file is never held in memory as a whole.
+
+    Args:
+        encoded_data (str): The base64 encoded file data; whitespace is ignored.
+        file_path (Path): The path of the file to write.
+        chunk_size (int, optional): The number of base64 characters decoded at a time.
+
+    Raises:
+        ValueError: If the data is not valid base64.
+
+    Returns:
+        int: The number of bytes written.
+    """
+    bytes_written = 0
+    remainder = ""
+    with open(file_path, "wb") as file:
+        for start in range(0, len(encoded_data), chunk_size):
+            chunk = remainder + "".join(encoded_data[start : start + chunk_size].split())
+            decodable_length = len(chunk) - len(chunk) % 4
+            bytes_written += file.write(base64.b64decode(chunk[:decodable_length]))
+            remainder = chunk[decodable_length:]
+    if remainder:
+        raise ValueError(f"Invalid base64 data for file {file_path.name}")
+    return bytes_written
+
+
+def hash_file(file_path: Path, block_size: int = 1024 * 1024) -> str:
+    """
+    Compute the SHA-256 hash of a file's content, reading it block by block.
+
+    Returns:
+        str: The hex digest of the file's content.
+    """
+    content_hash = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        while block := file.read(block_size):
+            content_hash.update(block)
+    return content_hash.hexdigest()
+
+
 class ServerMethods:
     """
     Class representing server methods for file processing and document handling.
@@ -58,7 +118,7 @@ class ServerMethods:
     OriginalFileMapping = dict[str, str]
 
     async def save_files_to_tmp(
-        self, files: dict[str, FileStorage], session_id: str
+        self, files: dict[str, FileStorage], session_id: str, upload_id: str | None = None
     ) -> tuple[OriginalFileMapping, FileToPathMapping]:
         """
         Save the files to a temporary directory.
@@ -66,11 +126,13 @@ class ServerMethods:
         Args:
             files (dict[str, FileStorage]): A dictionary containing the files to be saved.
             session_id (str): The ID of the session.
+            upload_id (str | None, optional): The ID of the upload, whose own
+                subdirectory the files are saved in.
 
         Returns:
             A tuple containing the original file names and the full file paths.
         """
-        dir_path = create_tmp_dir(session_id=session_id)
+        dir_path = create_tmp_dir(session_id=session_id, upload_id=upload_id)
         logger.info(f"Created temporary directory for session {session_id}")
         original_name_dict: dict[str, str] = {}
         full_document_dict: dict[str, Path] = {}
@@ -85,45 +147,149 @@ class ServerMethods:
             file.save(unique_file_path)
         return original_name_dict, full_document_dict
 
+    def save_base64_file_to_tmp(
+        self, filename: str, encoded_data: str, session_id: str, upload_id: str | None = None
+    ) -> tuple[str, Path]:
+        """
+        Decode a base64 encoded file straight into the temporary directory of the session.
+
+        Args:
+            filename (str): The original name of the file.
+            encoded_data (str): The base64 encoded file data.
+            session_id (str): The ID of the session.
+            upload_id (str | None, optional): The ID of the upload, whose own
+                subdirectory the file is saved in.
+
+        Returns:
+            A tuple containing the unique file name and the full file path.
+        """
+        dir_path = create_tmp_dir(session_id=session_id, upload_id=upload_id)
+        unique_file_name = Utils.get_unique_filename(filename)
+        unique_file_path = dir_path / Path(unique_file_name)
+        bytes_written = decode_base64_to_file(encoded_data, unique_file_path)
+        logger.info(f"Saved {bytes_written} bytes of {filename} for session {session_id}")
+        return unique_file_name, unique_file_path
+
     async def save_files_to_vector_db(
-        self, file_dict: dict[str, Path], user_id: str
+        self,
+        file_dict: dict[str, Path],
+        user_id: str,
+        on_progress: ProgressCallback | None = None,
     ) -> dict[str, list[str]]:
         """
         Process the files in the given document dictionary and add them to the vector database.
 
+        The files are parsed, embedded and stored concurrently by an
+        `IngestionPipeline` (see `server_modules.ingestion`). Files whose exact
+        content was already ingested in the session (or earlier in the same
+        upload) are not parsed or embedded again; their existing document IDs
+        are reused instead.
+
+        A file uploaded under the name of a previously ingested file replaces
+        it. In incremental mode (`INCREMENTAL_INGESTION`), only the chunks
+        that changed are embedded: unchanged chunks keep their document IDs,
+        and only chunks that vanished are deleted from the vector database.
+
         Args:
             document_dict (dict[str, Path]): A dictionary mapping document names to their file paths.
             user_id (str): The ID of the user.
+            on_progress (ProgressCallback | None, optional): Called with the
+                progress of the ingestion after every step.
 
         Returns:
             A dictionary of file names and their corresponding document IDs.
         """
-        embedding_fn = EmbeddingFactory().create()
-        vector_db = VectorDatabase(user_id, embedding_fn)
-        loader_factory = DocumentLoaderFactory()
-        document_loader = DocumentLoader(file_dict, loader_factory)
-        file_id_mapping = {}
-        for filename in tqdm(file_dict.keys(), desc="Processing files"):
-            document_iterator = document_loader.document_iterators_dict[filename]
-            documents = document_loader.text_splitter.split_documents(document_iterator)
-            document_ids = await vector_db.add_documents(documents)
-            file_id_mapping[filename] = document_ids
-            DocumentMethods.add_document_ids(
+        content_hashes = {
+            filename: await asyncio.to_thread(hash_file, file_path)
+            for filename, file_path in file_dict.items()
+        }
+        ingested_files_by_hash = DocumentMethods.get_ingested_files_by_content_hash(
+            session_id=user_id, content_hashes=set(content_hashes.values()), logger=logger
+        )
+        new_file_dict: dict[str, Path] = {}
+        new_hashes: set[str] = set()
+        for filename, file_path in file_dict.items():
+            content_hash = content_hashes[filename]
+            if content_hash not in ingested_files_by_hash and content_hash not in new_hashes:
+                new_file_dict[filename] = file_path
+                new_hashes.add(content_hash)
+        logger.info(
+            f"Ingesting {len(new_file_dict)} of {len(file_dict)} file(s) for session {user_id}, "
+            f"the others were ingested before"
+        )
+        vector_db: VectorDatabase | None = None
+        if new_file_dict:
+            settings = IngestionSettings()
+            existing_chunks = (
+                {
+                    filename: DocumentMethods.get_chunk_document_ids(
+                        session_id=user_id, filename=filename, logger=logger
+                    )
+                    for filename in new_file_dict
+                }
+                if settings.incremental
+                else None
+            )
+            embedding_fn = EmbeddingFactory().create()
+            vector_db = VectorDatabase(user_id, embedding_fn)
+            ingestion_pipeline = IngestionPipeline(vector_db, embedding_fn, settings, on_progress=on_progress)
+            ingested_files = await ingestion_pipeline.run(new_file_dict, existing_chunks)
+            for filename, ingested_file in ingested_files.items():
+                ingested_files_by_hash[content_hashes[filename]] = ingested_file
+        removed_document_ids: list[str] = []
+        file_id_mapping: dict[str, list[str]] = {}
+        for filename in file_dict:
+            ingested_file = ingested_files_by_hash[content_hashes[filename]]
+            removed_document_ids += DocumentMethods.replace_document_ids(
                 session_id=user_id,
                 filename=filename,
-                document_ids=document_ids,
-                logger=self.app.logger,
+                ingested_file=ingested_file,
+                content_hash=content_hashes[filename],
+                logger=logger,
             )
-        if delete_tmp_dir(user_id):
-            logger.info(
-                f"Cleaned up temporary directory for session {user_id}"
-            )
-        else:
-            logger.error(
-                f"Failed to clean up temporary directory for session {user_id}"
+            file_id_mapping[filename] = ingested_file.document_ids
+        if removed_document_ids:
+            # Chunks of a previous revision may still be referenced by another file name.
+            shared_document_ids = DocumentMethods.get_shared_document_ids(
+                session_id=user_id, filename=None, document_ids=removed_document_ids, logger=logger
             )
+            vanished_document_ids = [
+                document_id for document_id in removed_document_ids if document_id not in shared_document_ids
+            ]
+            if vanished_document_ids:
+                if vector_db is None:
+                    vector_db = VectorDatabase(user_id, EmbeddingFactory().create())
+                await vector_db.delete_documents(vanished_document_ids)
+                logger.info(f"Deleted {len(vanished_document_ids)} vanished chunk(s) for session {user_id}")
+            if shared_document_ids:
+                await self.update_shared_document_sources(
+                    list(shared_document_ids), session_id=user_id, vector_db=vector_db
+                )
         return file_id_mapping
 
+    async def update_shared_document_sources(
+        self, document_ids: list[str], session_id: str, vector_db: VectorDatabase | None = None
+    ) -> None:
+        """
+        Point the source of chunks that are shared with other files at one of
+        those files, once the file they were first ingested from was deleted
+        or replaced, so that their citations don't name a file that is gone.
+
+        Args:
+            document_ids (list[str]): The IDs of the shared chunks.
+            session_id (str): The ID of the session.
+            vector_db (VectorDatabase | None, optional): The vector database
+                of the session, if it was opened already.
+        """
+        document_filenames = DocumentMethods.get_document_filenames(
+            session_id=session_id, document_ids=document_ids, logger=logger
+        )
+        if not document_filenames:
+            return
+        if vector_db is None:
+            vector_db = VectorDatabase(session_id, EmbeddingFactory().create())
+        await vector_db.update_document_sources(document_filenames)
+
     async def delete_docs_from_vector_db(
         self, document_ids: list[str], session_id: str
     ) -> bool:
@@ -152,35 +318,220 @@ class DocumentMethods:
     """
 
     @staticmethod
-    def add_document_ids(
+    def replace_document_ids(
         session_id: str,
         filename: str,
-        document_ids: list[str],
+        ingested_file: IngestedFile,
+        content_hash: str,
         logger: logging.Logger,
-    ) -> None:
+    ) -> list[str]:
         """
-        Store the given document IDs for the given session_id/filename combination.
+        Replace the document IDs stored for the given session_id/filename
+        combination by those of a newly ingested (revision of the) file.
+
+        Returns:
+            list[str]: The previously stored document IDs that the new
+            revision no longer contains.
         """
         connection_string = Utils.get_env_variable("FINAL_ANSWER_CONNECTION_STRING")
-        create_all_tables(DocumentModel, connection_string)
-        if not document_ids:
-            return
-        insertion_stmt = sqlalchemy.insert(DocumentModel).values(
-            [
-                {
-                    "session_id": session_id,
-                    "filename": filename,
-                    "document_id": document_id,
-                }
-                for document_id in document_ids
-            ]
+        ensure_schema(DocumentModel, connection_string)
+        existing_query = sqlalchemy.select(DocumentModel.document_id).where(
+            DocumentModel.session_id == session_id,
+            DocumentModel.filename == filename,
         )
+        delete_stmt = sqlalchemy.delete(DocumentModel).where(
+            DocumentModel.session_id == session_id,
+            DocumentModel.filename == filename,
+        )
+        with session_scope(connection_string) as session:
+            existing_document_ids = list(dict.fromkeys(session.scalars(existing_query)))
+            session.execute(delete_stmt)
+            if ingested_file.document_ids:
+                session.execute(
+                    sqlalchemy.insert(DocumentModel).values(
+                        [
+                            {
+                                "session_id": session_id,
+                                "filename": filename,
+                                "document_id": document_id,
+                                "content_hash": content_hash,
+                                "chunk_hash": chunk_hash,
+                            }
+                            for document_id, chunk_hash in zip(
+                                ingested_file.document_ids, ingested_file.chunk_hashes
+                            )
+                        ]
+                    )
+                )
+        new_document_ids = set(ingested_file.document_ids)
+        removed_document_ids = [
+            document_id for document_id in existing_document_ids if document_id not in new_document_ids
+        ]
+        logger.info(
+            f"Stored {len(ingested_file.document_ids)} document id(s) for session {session_id}, "
+            f"file {filename}, replacing {len(removed_document_ids)} old one(s)"
+        )
+        return removed_document_ids
+
+    @staticmethod
+    def get_ingested_files_by_content_hash(
+        session_id: str, content_hashes: set[str], logger: logging.Logger
+    ) -> dict[str, IngestedFile]:
+        """
+        Retrieve the chunks of files with the given content hashes that were
+        already ingested in the session.
+
+        Returns:
+            dict[str, IngestedFile]: The document IDs and chunk hashes per
+            known content hash, in the order they were stored.
+        """
+        connection_string = Utils.get_env_variable("FINAL_ANSWER_CONNECTION_STRING")
+        ensure_schema(DocumentModel, connection_string)
+        if not content_hashes:
+            return {}
+        query = (
+            sqlalchemy.select(
+                DocumentModel.content_hash,
+                DocumentModel.filename,
+                DocumentModel.document_id,
+                DocumentModel.chunk_hash,
+            )
+            .where(
+                DocumentModel.session_id == session_id,
+                DocumentModel.content_hash.in_(content_hashes),
+            )
+            .order_by(DocumentModel.id)
+        )
+        ingested_files_by_hash: dict[str, IngestedFile] = {}
+        filename_by_hash: dict[str, str] = {}
+        with session_scope(connection_string) as session:
+            for content_hash, filename, document_id, chunk_hash in session.execute(query):
+                # The same content may be stored under several file names;
+                # its document IDs are shared, so take those of the first one.
+                if filename_by_hash.setdefault(content_hash, filename) == filename:
+                    ingested_file = ingested_files_by_hash.setdefault(
+                        content_hash, IngestedFile(document_ids=[], chunk_hashes=[])
+                    )
+                    ingested_file.document_ids.append(document_id)
+                    ingested_file.chunk_hashes.append(chunk_hash)
+        logger.info(
+            f"Found {len(ingested_files_by_hash)} of {len(content_hashes)} file(s) already "
+            f"ingested for session {session_id}"
+        )
+        return ingested_files_by_hash
+
+    @staticmethod
+    def get_content_fingerprint(session_id: str, logger: logging.Logger) -> str | None:
+        """
+        Build a fingerprint of the files stored in the session from their
+        names and content hashes, so that sessions that uploaded the same
+        files get the same fingerprint (and may share cached answers, whose
+        citations mention the file names).
+
+        Returns:
+            str | None: The fingerprint, or `None` if the session has no files
+            or a file was stored without a content hash.
+        """
+        connection_string = Utils.get_env_variable("FINAL_ANSWER_CONNECTION_STRING")
+        ensure_schema(DocumentModel, connection_string)
+        query = (
+            sqlalchemy.select(DocumentModel.filename, DocumentModel.content_hash)
+            .where(DocumentModel.session_id == session_id)
+            .distinct()
+        )
+        with session_scope(connection_string) as session:
+            files = session.execute(query).all()
+        if not files or any(content_hash is None for _, content_hash in files):
+            logger.info(f"No content fingerprint for session {session_id}")
+            return None
+        return hashlib.sha256(
+            "\n".join(sorted(f"{filename}\0{content_hash}" for filename, content_hash in files)).encode("utf-8")
+        ).hexdigest()
+
+    @staticmethod
+    def get_chunk_document_ids(
+        session_id: str, filename: str, logger: logging.Logger
+    ) -> dict[str, list[str]]:
+        """
+        Retrieve the document IDs stored for the given session_id/filename
+        combination by chunk hash, skipping chunks stored without a hash.
+        """
+        connection_string = Utils.get_env_variable("FINAL_ANSWER_CONNECTION_STRING")
+        ensure_schema(DocumentModel, connection_string)
+        query = (
+            sqlalchemy.select(DocumentModel.chunk_hash, DocumentModel.document_id)
+            .where(
+                DocumentModel.session_id == session_id,
+                DocumentModel.filename == filename,
+                DocumentModel.chunk_hash.is_not(None),
+            )
+            .order_by(DocumentModel.id)
+        )
+        document_ids_by_chunk_hash: dict[str, list[str]] = {}
         with session_scope(connection_string) as session:
-            session.execute(insertion_stmt)
+            for chunk_hash, document_id in session.execute(query):
+                document_ids_by_chunk_hash.setdefault(chunk_hash, []).append(document_id)
         logger.info(
-            f"Stored {len(document_ids)} document id(s) for session {session_id}, "
+            f"Retrieved {len(document_ids_by_chunk_hash)} chunk hash(es) for session {session_id}, "
             f"file {filename}"
         )
+        return document_ids_by_chunk_hash
+
+    @staticmethod
+    def get_shared_document_ids(
+        session_id: str, filename: str | None, document_ids: list[str], logger: logging.Logger
+    ) -> set[str]:
+        """
+        Retrieve which of the given document IDs are also referenced by
+        another file name in the session (because the same content was
+        uploaded under several names), and must therefore be kept in the
+        vector database when this file is deleted. With `filename` set to
+        `None`, the document IDs referenced by any file are retrieved.
+        """
+        connection_string = Utils.get_env_variable("FINAL_ANSWER_CONNECTION_STRING")
+        ensure_schema(DocumentModel, connection_string)
+        if not document_ids:
+            return set()
+        query = sqlalchemy.select(DocumentModel.document_id).where(
+            DocumentModel.session_id == session_id,
+            DocumentModel.document_id.in_(document_ids),
+        )
+        if filename is not None:
+            query = query.where(DocumentModel.filename != filename)
+        with session_scope(connection_string) as session:
+            shared_document_ids = set(session.scalars(query))
+        logger.info(
+            f"{len(shared_document_ids)} document id(s) of file {filename} are shared with "
+            f"other files of session {session_id}"
+        )
+        return shared_document_ids
+
+    @staticmethod
+    def get_document_filenames(
+        session_id: str, document_ids: list[str], logger: logging.Logger
+    ) -> dict[str, set[str]]:
+        """
+        Retrieve the names of the files that reference the given document IDs
+        in the session, by document ID. Document IDs that no file references
+        are left out.
+        """
+        connection_string = Utils.get_env_variable("FINAL_ANSWER_CONNECTION_STRING")
+        ensure_schema(DocumentModel, connection_string)
+        if not document_ids:
+            return {}
+        query = sqlalchemy.select(DocumentModel.document_id, DocumentModel.filename).where(
+            DocumentModel.session_id == session_id,
+            DocumentModel.document_id.in_(document_ids),
+        )
+        document_filenames: dict[str, set[str]] = {}
+        with session_scope(connection_string) as session:
+            for document_id, filename in session.execute(query):
+                document_filenames.setdefault(document_id, set()).add(filename)
+        logger.info(
+            f"Retrieved the file names of {len(document_filenames)} of {len(document_ids)} "
+            f"document id(s) for session {session_id}"
+        )
+        return document_filenames
 
     @staticmethod
     def get_document_ids(
@@ -190,7 +541,7 @@ class DocumentMethods:
         Retrieve all document IDs stored for the given session_id/filename combination.
         """
         connection_string = Utils.get_env_variable("FINAL_ANSWER_CONNECTION_STRING")
-        create_all_tables(DocumentModel, connection_string)
+        ensure_schema(DocumentModel, connection_string)
         query = sqlalchemy.select(DocumentModel.document_id).where(
             DocumentModel.session_id == session_id,
             DocumentModel.filename == filename,
@@ -212,7 +563,7 @@ class DocumentMethods:
         e.g. after they have been deleted from the vector database.
         """
         connection_string = Utils.get_env_variable("FINAL_ANSWER_CONNECTION_STRING")
-        create_all_tables(DocumentModel, connection_string)
+        ensure_schema(DocumentModel, connection_string)
         delete_stmt = sqlalchemy.delete(DocumentModel).where(
             DocumentModel.session_id == session_id,
             DocumentModel.filename == filename,
@@ -261,9 +612,7 @@ class ExperimentSessionMethods:
         """
         logger.info(f"Adding new record for session id: {session_id}")
         connection_string = Utils.get_env_variable("FINAL_ANSWER_CONNECTION_STRING")
-        create_all_tables(
-            FinalAnswerModel, connection_string
-        )  # CREATE TABLE IF NOT EXISTS final_answer
+        ensure_schema(FinalAnswerModel, connection_string)  # CREATE TABLE IF NOT EXISTS final_answer
         answer_model_record_query = sqlalchemy.select(FinalAnswerModel).where(
             FinalAnswerModel.session_id == session_id
         )  # SELECT * FROM final_answer WHERE session_id = session_id
@@ -2,7 +2,7 @@ import json
 from datetime import datetime
 from typing import Any
 
-from sqlalchemy import JSON, String, func
+from sqlalchemy import JSON, Index, LargeBinary, String, func
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
 
@@ -24,8 +24,24 @@ class FinalAnswerBase(DeclarativeBase):
     """
 
 
+class EmbeddingCacheBase(DeclarativeBase):
+    """
+    Declarative base for models that live in the (local) embedding-cache database.
+
+    Kept separate from the other bases so that ``metadata.create_all`` only
+    creates the cache table in the cache database.
+    """
+
+
 class ChatHistoryModel(ChatHistoryBase):
+    """
+    A chat message of a session. The composite `(session_id, id)` index lets
+    the most recent messages of a session be read without scanning (or
+    sorting) the whole history.
+    """
+
     __tablename__ = "message_store"
+    __table_args__ = (Index("ix_message_store_session_id_id", "session_id", "id"),)
 
     id: Mapped[int] = mapped_column(primary_key=True)
     session_id: Mapped[str] = mapped_column(String(36))
@@ -39,6 +55,12 @@ class DocumentModel(FinalAnswerBase):
     vector database, scoped to the session (user) that uploaded it. This allows the
     delete endpoint to look up which document IDs belong to a given file/session
     instead of requiring the client to supply them in the request payload.
+
+    The SHA-256 hash of the file's content is stored alongside, so that a file
+    whose exact bytes were already ingested in the session can reuse the
+    existing document IDs instead of being parsed and embedded again. The hash
+    of every chunk's text is stored as well, so that a new revision of a file
+    only needs its changed chunks to be embedded again.
     """
 
     __tablename__ = "document"
@@ -47,6 +69,8 @@ class DocumentModel(FinalAnswerBase):
     session_id: Mapped[str] = mapped_column(String(36), index=True)
     filename: Mapped[str] = mapped_column(String(255))
     document_id: Mapped[str] = mapped_column(String(255))
+    content_hash: Mapped[str | None] = mapped_column(String(64), default=None, index=True)
+    chunk_hash: Mapped[str | None] = mapped_column(String(64), default=None)
 
     def __repr__(self) -> str:
         return f"Document(session_id={self.session_id}, filename={self.filename}, document_id={self.document_id})"
@@ -69,3 +93,23 @@ class FinalAnswerModel(FinalAnswerBase):
             f"edited_answer={json.dumps(self.edited_answer)}, "
             f"start_time={self.start_time}, end_time={self.end_time})"
         )
+
+
+class EmbeddingCacheModel(EmbeddingCacheBase):
+    """
+    A cached embedding vector, content-addressed by a hash of the embedding
+    vendor, model name and the embedded text, so identical chunks are only ever
+    embedded once per model.
+    """
+
+    __tablename__ = "embedding_cache"
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    vendor_name: Mapped[str] = mapped_column(String(64))
+    model_name: Mapped[str] = mapped_column(String(255))
+    embedding: Mapped[bytes] = mapped_column(LargeBinary)
+    size_bytes: Mapped[int] = mapped_column()
+    last_accessed: Mapped[datetime] = mapped_column(index=True)
+
+    def __repr__(self) -> str:
+        return f"EmbeddingCache(key={self.key}, vendor_name={self.vendor_name}, model_name={self.model_name})"
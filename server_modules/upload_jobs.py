@@ -0,0 +1,259 @@
+"""
+Tracking of background upload jobs.
+
+Uploaded files are processed in the background by the Flask executor. Instead
+of having clients poll an opaque future state, every upload gets an
+`UploadJob` record in the process-wide `UploadJobRegistry`. The registry lets
+callers block until a job finishes (used for long-polling) and notifies
+subscribers (used to push WebSocket events) whenever a job changes.
+"""
+import logging
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Callable, Optional
+
+from server_modules.class_defs import UploadProgress, WEMUploadResponse
+from server_modules.ingestion import IngestionProgress
+
+logger = logging.getLogger(__name__)
+
+UploadJobSubscriber = Callable[["UploadJob"], None]
+
+
+class UploadJobState(str, Enum):
+    """
+    The lifecycle states of an upload job.
+    """
+
+    PENDING = "pending"
+    PROCESSING = "processing"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+@dataclass
+class UploadJob:
+    """
+    Represents the processing of the files uploaded by a session.
+
+    Attributes:
+        session_id (str): The session the files were uploaded by.
+        progress (IngestionProgress): How far processing the files has progressed.
+        state (UploadJobState): The current state of the job.
+        result (WEMUploadResponse | None): The response once the job completed.
+        error (str): The error message if the job failed, else an empty string.
+        started_at (float | None): When processing started, as a `time.time()` timestamp.
+        updated_at (float): When the job last changed, as a `time.time()` timestamp.
+        job_id (str): The unique ID of the job.
+    """
+
+    session_id: str
+    progress: IngestionProgress
+    state: UploadJobState = UploadJobState.PENDING
+    result: Optional[WEMUploadResponse] = None
+    error: str = ""
+    started_at: Optional[float] = None
+    updated_at: float = field(default_factory=time.time)
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+    @property
+    def done(self) -> bool:
+        """
+        Whether the job has finished, successfully or not.
+        """
+        return self.state in (UploadJobState.COMPLETED, UploadJobState.FAILED)
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        """
+        The estimated number of seconds until the job finishes, extrapolated
+        from the share of bytes processed so far, or `None` if unknown.
+        """
+        if self.done:
+            return 0.0
+        if self.started_at is None or self.progress.bytes_processed <= 0:
+            return None
+        elapsed = time.time() - self.started_at
+        bytes_remaining = self.progress.bytes_total - self.progress.bytes_processed
+        return round(elapsed * bytes_remaining / self.progress.bytes_processed, 1)
+
+    def get_progress(self) -> UploadProgress:
+        """
+        Convert the progress of the job to the payload sent to clients.
+        """
+        return UploadProgress(
+            filesTotal=self.progress.files_total,
+            filesParsed=self.progress.files_parsed,
+            chunksProduced=self.progress.chunks_produced,
+            chunksEmbedded=self.progress.chunks_embedded,
+            chunksWritten=self.progress.chunks_written,
+            bytesTotal=self.progress.bytes_total,
+            bytesProcessed=self.progress.bytes_processed,
+            etaSeconds=self.eta_seconds,
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        Convert the job to the payload sent to clients.
+        """
+        return {
+            "sessionId": self.session_id,
+            "jobId": self.job_id,
+            "state": self.state.value,
+            "error": self.error,
+            "progress": self.get_progress(),
+            "fileIdMapping": self.result["fileIdMapping"] if self.result is not None else [],
+        }
+
+
+class UploadJobRegistry:
+    """
+    A thread-safe registry of the latest upload job per session.
+
+    A new upload replaces the session's previous job, so every update names
+    the job it is for, and updates of a job that was replaced are ignored:
+    a slow earlier upload cannot overwrite the state of the current one.
+    Finished jobs are kept around for `ttl_seconds` so that clients can still
+    fetch their result, and are pruned whenever a new job is created.
+    Progress updates notify subscribers at most once every
+    `progress_interval_seconds`, so large uploads don't flood them.
+    """
+
+    def __init__(self, ttl_seconds: float = 3600, progress_interval_seconds: float = 0.5) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.progress_interval_seconds = progress_interval_seconds
+        self._jobs: dict[str, UploadJob] = {}
+        self._condition = threading.Condition()
+        self._subscribers: list[UploadJobSubscriber] = []
+
+    def _prune(self) -> None:
+        expired_before = time.time() - self.ttl_seconds
+        for session_id in [
+            session_id for session_id, job in self._jobs.items() if job.done and job.updated_at < expired_before
+        ]:
+            del self._jobs[session_id]
+
+    def _notify(self, job: UploadJob) -> None:
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber(job)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Upload job subscriber failed for session %s", job.session_id)
+
+    def create(self, session_id: str, files_total: int, job_id: str | None = None) -> UploadJob:
+        """
+        Register a new pending job for the session, replacing any previous one.
+
+        Args:
+            session_id (str): The session the files were uploaded by.
+            files_total (int): The number of uploaded files.
+            job_id (str | None, optional): The ID of the job, e.g. when the
+                files were already saved under it. Defaults to a new unique ID.
+
+        Returns:
+            UploadJob: The new job, whose `job_id` identifies it in later updates.
+        """
+        job = UploadJob(session_id=session_id, progress=IngestionProgress(files_total=files_total))
+        if job_id is not None:
+            job.job_id = job_id
+        with self._condition:
+            self._prune()
+            self._jobs[session_id] = job
+            self._condition.notify_all()
+        self._notify(job)
+        return job
+
+    def get(self, session_id: str) -> Optional[UploadJob]:
+        """
+        Get the latest job of the session, if any.
+        """
+        with self._condition:
+            return self._jobs.get(session_id)
+
+    def _get_current_job(self, session_id: str, job_id: str) -> Optional[UploadJob]:
+        job = self._jobs.get(session_id)
+        if job is None or job.job_id != job_id:
+            logger.info("Ignoring an update of replaced upload job %s of session %s", job_id, session_id)
+            return None
+        return job
+
+    def update(self, session_id: str, job_id: str, **changes: Any) -> Optional[UploadJob]:
+        """
+        Update the fields of the session's job and notify waiters and subscribers.
+
+        Returns:
+            Optional[UploadJob]: The updated job, or `None` if `job_id` is no
+            longer the session's current job (and nothing was updated).
+        """
+        with self._condition:
+            job = self._get_current_job(session_id, job_id)
+            if job is None:
+                return None
+            for name, value in changes.items():
+                setattr(job, name, value)
+            job.updated_at = time.time()
+            self._condition.notify_all()
+        self._notify(job)
+        return job
+
+    def mark_processing(self, session_id: str, job_id: str) -> Optional[UploadJob]:
+        """
+        Mark the session's job as being processed.
+        """
+        return self.update(session_id, job_id, state=UploadJobState.PROCESSING, started_at=time.time())
+
+    def update_progress(self, session_id: str, job_id: str, progress: IngestionProgress) -> Optional[UploadJob]:
+        """
+        Record the progress of the session's job, notifying subscribers unless
+        they were notified less than `progress_interval_seconds` ago.
+        """
+        with self._condition:
+            job = self._get_current_job(session_id, job_id)
+            if job is None:
+                return None
+            job.progress = progress
+            now = time.time()
+            if now - job.updated_at < self.progress_interval_seconds:
+                return job
+            job.updated_at = now
+        self._notify(job)
+        return job
+
+    def mark_completed(self, session_id: str, job_id: str, result: WEMUploadResponse) -> Optional[UploadJob]:
+        """
+        Mark the session's job as completed with the given response.
+        """
+        return self.update(session_id, job_id, state=UploadJobState.COMPLETED, result=result)
+
+    def mark_failed(self, session_id: str, job_id: str, error: str) -> Optional[UploadJob]:
+        """
+        Mark the session's job as failed with the given error message.
+        """
+        return self.update(session_id, job_id, state=UploadJobState.FAILED, error=error)
+
+    def wait(self, session_id: str, timeout: float) -> Optional[UploadJob]:
+        """
+        Block until the session's job is done, or until `timeout` seconds have passed.
+
+        Returns:
+            Optional[UploadJob]: The session's job (possibly still unfinished
+            when the timeout expired), or `None` if the session has no job.
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: (job := self._jobs.get(session_id)) is None or job.done, timeout=timeout
+            )
+            return self._jobs.get(session_id)
+
+    def subscribe(self, subscriber: UploadJobSubscriber) -> Callable[[], None]:
+        """
+        Call `subscriber` with the job whenever a job is created or changes.
+
+        Returns:
+            Callable[[], None]: A function that removes the subscription again.
+        """
+        self._subscribers.append(subscriber)
+        return lambda: self._subscribers.remove(subscriber)
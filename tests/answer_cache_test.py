@@ -0,0 +1,114 @@
+import threading
+
+from chatdoc.answer_cache import AnswerCache
+from chatdoc.prompt_mode import PromptMode
+
+CITATIONS = {"citations": [{"source": "lease.pdf", "page": 2}]}
+
+
+def test_exact_question_is_found_regardless_of_case_and_whitespace():
+    cache = AnswerCache(max_size=4, ttl_seconds=None, similarity_threshold=0.97)
+    cache.put("collection", "fp", PromptMode.DEFAULT, "What is  DoRA?", [1.0, 0.0], "A chatbot.", CITATIONS)
+
+    cached_answer = cache.get("collection", "fp", PromptMode.DEFAULT, "what is dora?", [0.0, 1.0])
+
+    assert cached_answer is not None
+    assert cached_answer.answer == "A chatbot."
+    assert cached_answer.citations == CITATIONS
+
+
+def test_similar_question_is_found_above_the_threshold():
+    cache = AnswerCache(max_size=4, similarity_threshold=0.97)
+    cache.put("collection", "fp", PromptMode.DEFAULT, "What is DoRA?", [2.0, 0.0], "A chatbot.", CITATIONS)
+
+    assert cache.get("collection", "fp", PromptMode.DEFAULT, "What's DoRA?", [0.99, 0.02]) is not None
+    assert cache.get("collection", "fp", PromptMode.DEFAULT, "Who made DoRA?", [0.5, 0.5]) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_answers_are_scoped_to_fingerprint_and_prompt_mode():
+    cache = AnswerCache(max_size=4, similarity_threshold=0.97)
+    cache.put("collection", "fp", PromptMode.DEFAULT, "What is DoRA?", [1.0, 0.0], "A chatbot.", CITATIONS)
+
+    assert cache.get("collection", "fp-2", PromptMode.DEFAULT, "What is DoRA?", [1.0, 0.0]) is None
+    assert cache.get("collection", "fp", PromptMode.CONCISE, "What is DoRA?", [1.0, 0.0]) is None
+
+
+def test_answers_are_shared_by_collections_with_the_same_fingerprint():
+    cache = AnswerCache(max_size=4, similarity_threshold=0.97)
+    cache.put("collection", "fp", PromptMode.DEFAULT, "What is DoRA?", [1.0, 0.0], "A chatbot.", CITATIONS)
+
+    cached_answer = cache.get("other", "fp", PromptMode.DEFAULT, "What is DoRA?", [1.0, 0.0])
+
+    assert cached_answer is not None
+    assert cached_answer.collection_names == {"collection", "other"}
+
+
+def test_invalidate_collection_drops_only_answers_no_other_collection_used():
+    cache = AnswerCache(max_size=4)
+    cache.put("collection", "fp", PromptMode.DEFAULT, "What is DoRA?", [1.0, 0.0], "A chatbot.", CITATIONS)
+    cache.put("collection", "fp", PromptMode.DEFAULT, "Who made DoRA?", [0.0, 1.0], "A team.", CITATIONS)
+    cache.get("other", "fp", PromptMode.DEFAULT, "What is DoRA?", [1.0, 0.0])
+
+    assert cache.invalidate_collection("collection") == 1
+    assert cache.get("other", "fp", PromptMode.DEFAULT, "Who made DoRA?", [0.0, 1.0]) is None
+    assert cache.get("other", "fp", PromptMode.DEFAULT, "What is DoRA?", [1.0, 0.0]) is not None
+    assert cache.invalidate_collection("other") == 1
+    assert not cache.answers
+
+
+def test_size_limit_evicts_least_recently_used_answers(monkeypatch):
+    monkeypatch.setenv("ANSWER_CACHE_SIZE", "1")
+    cache = AnswerCache()
+    cache.put("collection", "fp", PromptMode.DEFAULT, "first question", [1.0, 0.0], "first", CITATIONS)
+    cache.put("collection", "fp", PromptMode.DEFAULT, "second question", [0.0, 1.0], "second", CITATIONS)
+
+    assert cache.get("collection", "fp", PromptMode.DEFAULT, "first question", [1.0, 0.0]) is None
+    assert cache.get("collection", "fp", PromptMode.DEFAULT, "second question", [0.0, 1.0]) is not None
+
+
+def test_zero_size_disables_the_cache():
+    cache = AnswerCache(max_size=0)
+    cache.put("collection", "fp", PromptMode.DEFAULT, "What is DoRA?", [1.0, 0.0], "A chatbot.", CITATIONS)
+
+    assert not cache.enabled
+    assert cache.get("collection", "fp", PromptMode.DEFAULT, "What is DoRA?", [1.0, 0.0]) is None
+
+
+def test_hit_and_miss_counters_are_exact_under_concurrent_lookups():
+    cache = AnswerCache(max_size=4)
+    cache.put("collection", "fp", PromptMode.DEFAULT, "What is DoRA?", [1.0, 0.0], "A chatbot.", CITATIONS)
+
+    def look_up() -> None:
+        for _ in range(200):
+            cache.get("collection", "fp", PromptMode.DEFAULT, "What is DoRA?", [1.0, 0.0])
+            cache.get("collection", "fp", PromptMode.DEFAULT, "Who made DoRA?", [0.0, 1.0])
+
+    threads = [threading.Thread(target=look_up) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cache.stats()["hits"] == cache.stats()["misses"] == 1600
+
+
+def test_question_needs_embedding_only_when_similar_answers_can_match():
+    cache = AnswerCache(max_size=4, similarity_threshold=0.97)
+
+    assert not cache.needs_embedding("fp", PromptMode.DEFAULT, "What is DoRA?")
+    cache.put("collection", "fp", PromptMode.DEFAULT, "What is DoRA?", [1.0, 0.0], "A chatbot.", CITATIONS)
+    assert not cache.needs_embedding("fp", PromptMode.DEFAULT, "what is  DoRA?")
+    assert cache.needs_embedding("fp", PromptMode.DEFAULT, "What's DoRA?")
+    assert not cache.needs_embedding("fp", PromptMode.CONCISE, "What's DoRA?")
+    assert not AnswerCache(max_size=4, similarity_threshold=1.1).needs_embedding("fp", PromptMode.DEFAULT, "What?")
+
+
+def test_answers_without_embedding_are_only_found_by_the_exact_question():
+    cache = AnswerCache(max_size=4, similarity_threshold=0.97)
+    cache.put("collection", "fp", PromptMode.DEFAULT, "7:658", None, "Article 7:658.", CITATIONS)
+
+    assert not cache.needs_embedding("fp", PromptMode.DEFAULT, "7:659")
+    assert cache.get("collection", "fp", PromptMode.DEFAULT, "7:659", [1.0, 0.0]) is None
+    assert cache.get("collection", "fp", PromptMode.DEFAULT, "7:658") is not None
@@ -0,0 +1,327 @@
+"""
+Tests for the HTTP endpoints defined in `app.py`.
+
+`app.py` reads a couple of environment variables at import time
+(`CURRENT_ENV`, `LOGGING_FILE_PATH`). These are set here, before the `app`
+module is imported, so that importing it does not raise.
+"""
+
+import os
+import tempfile
+
+os.environ.setdefault("CURRENT_ENV", "TST")
+os.environ.setdefault(
+    "LOGGING_FILE_PATH", os.path.join(tempfile.gettempdir(), "dora-app-test-logs", "dora-app-test.log")
+)
+
+# pylint: disable=wrong-import-position
+import asyncio
+import base64
+import json
+import uuid
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+from chromadb import PersistentClient
+from langchain_community.embeddings import FakeEmbeddings
+from langchain_core.documents import Document
+from langchain_core.messages import HumanMessage
+
+import app as app_module
+from chatdoc.citation import Citations
+from chatdoc.lexical_index import LexicalIndex
+from chatdoc.vector_db import ChromaClientRegistry
+from server_modules.ingestion import IngestedFile
+from server_modules.methods import create_tmp_dir, delete_tmp_dir, get_tmp_dir
+from server_modules.class_defs import WEMUploadResponse
+from server_modules.upload_jobs import UploadJobState
+
+
+def parse_sse_events(body: str) -> list[tuple[str, dict]]:
+    """
+    Parses a `text/event-stream` body into `(event name, JSON data)` pairs.
+    """
+    events = []
+    for frame in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in frame.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+@pytest.fixture(name="http_client")
+def fixture_http_client(monkeypatch):
+    """
+    Provides a Flask test client for a fresh session without pending uploads,
+    with the chatbot pool replaced by a mock chatbot.
+    """
+    session_id = f"test-session-{uuid.uuid4()}"
+
+    async def fake_stream_prompt(_prompt):
+        yield "token", "4"
+        yield "token", "2"
+        yield "result", {"answer": "42", "chat_history": []}
+
+    fake_chatbot = MagicMock()
+    fake_chatbot.stream_prompt = MagicMock(side_effect=fake_stream_prompt)
+    fake_chatbot_pool = MagicMock()
+    fake_chatbot_pool.get.return_value = fake_chatbot
+    monkeypatch.setattr(app_module, "chatbot_pool", fake_chatbot_pool)
+
+    yield app_module.app.test_client(), session_id, fake_chatbot
+
+
+def test_prompt_stream_returns_event_stream_of_tokens_and_result(http_client):
+    """
+    `/prompt_stream` should answer with a `text/event-stream` response holding
+    one `prompt_token` event per token and a final `prompt_response` event.
+    """
+    client, session_id, fake_chatbot = http_client
+
+    response = client.post("/prompt_stream", json={"sessionId": session_id, "prompt": "What is the answer?"})
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    events = parse_sse_events(response.get_data(as_text=True))
+    assert events[:2] == [("prompt_token", {"token": "4"}), ("prompt_token", {"token": "2"})]
+    event_name, payload = events[2]
+    assert event_name == "prompt_response"
+    assert payload["error"] == ""
+    assert payload["result"] == {"answer": "42", "chat_history": []}
+    fake_chatbot.stream_prompt.assert_called_once_with("What is the answer?")
+
+
+def test_prompt_stream_reports_errors_as_final_event(http_client):
+    """
+    A failure while streaming should still close the stream with a
+    `prompt_response` event carrying the error.
+    """
+    client, session_id, fake_chatbot = http_client
+
+    async def failing_stream_prompt(_prompt):
+        yield "token", "4"
+        raise RuntimeError("LLM unavailable")
+
+    fake_chatbot.stream_prompt.side_effect = failing_stream_prompt
+
+    response = client.post("/prompt_stream", json={"sessionId": session_id, "prompt": "What is the answer?"})
+
+    events = parse_sse_events(response.get_data(as_text=True))
+    assert events[0] == ("prompt_token", {"token": "4"})
+    assert events[-1] == ("prompt_response", {"message": "", "error": "LLM unavailable"})
+
+
+def test_prompt_is_deferred_while_upload_is_processing(http_client):
+    _, session_id, fake_chatbot = http_client
+    app_module.upload_jobs.create(session_id, files_total=1)
+
+    response_message, status_code = asyncio.run(
+        app_module.resolve_prompt_response(session_id, "What is the answer?")
+    )
+
+    assert status_code == 202
+    assert response_message["error"] == "pending"
+    fake_chatbot.send_prompt.assert_not_called()
+
+
+def test_file_id_mappings_without_upload(http_client):
+    client, session_id, _ = http_client
+
+    response = client.get(f"/get_file_id_mappings/{session_id}")
+
+    assert response.status_code == 200
+    assert response.json["fileIdMapping"] == []
+
+
+def test_file_id_mappings_long_poll_returns_once_upload_completes(http_client):
+    """
+    With `wait`, the request should be held open until the upload job
+    completes rather than answering 202 straight away.
+    """
+    client, session_id, _ = http_client
+    job_id = app_module.upload_jobs.create(session_id, files_total=1).job_id
+    app_module.upload_jobs.mark_processing(session_id, job_id)
+    upload_response = WEMUploadResponse(
+        message="1 bestand succesvol geüpload en verwerkt!",
+        error="",
+        fileIdMapping=[{"filename": "a.pdf", "documentIds": ["id-1"]}],
+    )
+    completer = threading.Timer(0.05, app_module.upload_jobs.mark_completed, (session_id, job_id, upload_response))
+    completer.start()
+
+    response = client.get(f"/get_file_id_mappings/{session_id}?wait=5")
+    completer.join()
+
+    assert response.status_code == 200
+    assert response.json["fileIdMapping"] == [{"filename": "a.pdf", "documentIds": ["id-1"]}]
+
+
+def test_file_id_mappings_reports_pending_and_failed_uploads(http_client):
+    client, session_id, _ = http_client
+    job_id = app_module.upload_jobs.create(session_id, files_total=1).job_id
+
+    pending_response = client.get(f"/get_file_id_mappings/{session_id}?wait=0.01")
+    app_module.upload_jobs.mark_failed(session_id, job_id, "Unsupported file type")
+    failed_response = client.get(f"/get_file_id_mappings/{session_id}")
+
+    assert pending_response.status_code == 202
+    assert pending_response.json["message"] == "pending"
+    assert pending_response.json["progress"]["filesTotal"] == 1
+    assert pending_response.json["progress"]["etaSeconds"] is None
+    assert failed_response.status_code == 400
+    assert failed_response.json["error"] == "Unsupported file type"
+
+
+def test_replaced_upload_job_does_not_overwrite_the_current_one(http_client):
+    """
+    When an earlier upload of the session finishes after a newer upload
+    replaced its job, the newer job's state should be kept.
+    """
+    _, session_id, _ = http_client
+    replaced_job_id = app_module.upload_jobs.create(session_id, files_total=1).job_id
+    current_job_id = app_module.upload_jobs.create(session_id, files_total=2).job_id
+
+    async def failing_upload(_on_progress):
+        raise RuntimeError("Unsupported file type")
+
+    asyncio.run(app_module.run_upload_job(session_id, replaced_job_id, failing_upload))
+
+    upload_job = app_module.upload_jobs.get(session_id)
+    assert upload_job.job_id == current_job_id
+    assert upload_job.state == UploadJobState.PENDING
+
+
+def test_upload_files_json_decodes_files_to_disk(http_client, monkeypatch):
+    """
+    Uploaded base64 files should be written to the temporary directory of
+    their upload job before the job is started with their paths.
+    """
+    client, session_id, _ = http_client
+    submitted_jobs = []
+    monkeypatch.setattr(app_module.executor, "submit", lambda *args: submitted_jobs.append(args))
+    payload = [
+        {"sessionId": session_id, "prefix": "file_", "filename": "a.txt", "file_data": base64.b64encode(b"A").decode()},
+        {"sessionId": session_id, "prefix": "file_", "filename": "b.txt", "file_data": base64.b64encode(b"B").decode()},
+    ]
+
+    response = client.post("/upload_files_json", json=payload)
+
+    assert response.status_code == 200
+    assert len(submitted_jobs) == 1
+    process_upload = submitted_jobs[0][3]
+    original_names_dict, full_document_dict = process_upload.args[:2]
+    assert sorted(original_names_dict.values()) == ["a.txt", "b.txt"]
+    assert sorted(path.read_bytes() for path in full_document_dict.values()) == [b"A", b"B"]
+    upload_job = app_module.upload_jobs.get(session_id)
+    assert upload_job.progress.files_total == 2
+    assert submitted_jobs[0][2] == upload_job.job_id
+    assert {path.parent for path in full_document_dict.values()} == {get_tmp_dir(session_id, upload_job.job_id)}
+    delete_tmp_dir(session_id)
+
+
+def test_upload_job_deletes_only_its_own_files(http_client):
+    """
+    A finished upload job should clean up its own temporary directory, but
+    not the files another upload of the session is still processing.
+    """
+    _, session_id, _ = http_client
+    other_file_path = create_tmp_dir(session_id, "other-upload") / "b.txt"
+    other_file_path.write_bytes(b"B")
+    job_id = app_module.upload_jobs.create(session_id, files_total=1).job_id
+    (create_tmp_dir(session_id, job_id) / "a.txt").write_bytes(b"A")
+
+    async def upload(_on_progress):
+        return WEMUploadResponse(message="", error="", fileIdMapping=[])
+
+    asyncio.run(app_module.run_upload_job(session_id, job_id, upload))
+
+    assert not get_tmp_dir(session_id, job_id).exists()
+    assert other_file_path.read_bytes() == b"B"
+    delete_tmp_dir(session_id)
+
+
+def test_get_chat_history_pages_with_after_id_and_limit(http_client, monkeypatch, tmp_path):
+    """
+    `/get_chat_history` should page through the history with `after_id` and
+    `limit`, returning the message IDs and a cursor to continue from.
+    """
+    client, session_id, _ = http_client
+    monkeypatch.setenv("CHAT_HISTORY_CONNECTION_STRING", f"sqlite:///{tmp_path / 'chat_history.db'}")
+    memory_db = app_module.SQLAlchemyChatMessageHistory(session_id, os.environ["CHAT_HISTORY_CONNECTION_STRING"])
+    for content in ("first", "second", "third"):
+        memory_db.add_message(HumanMessage(content=content))
+
+    full_history = client.get("/get_chat_history", json={"sessionId": session_id}).json
+    first_page = client.get("/get_chat_history?limit=2", json={"sessionId": session_id}).json
+    second_page = client.get(
+        f"/get_chat_history?limit=2&after_id={first_page['lastId']}", json={"sessionId": session_id}
+    ).json
+    no_new_messages = client.get(
+        f"/get_chat_history?after_id={second_page['lastId']}", json={"sessionId": session_id}
+    ).json
+
+    assert [message["data"]["content"] for message in full_history["result"]] == ["first", "second", "third"]
+    assert full_history["hasMore"] is False
+    assert [message["data"]["content"] for message in first_page["result"]] == ["first", "second"]
+    assert first_page["hasMore"] is True
+    assert first_page["lastId"] == first_page["result"][-1]["id"]
+    assert [message["data"]["content"] for message in second_page["result"]] == ["third"]
+    assert second_page["hasMore"] is False
+    assert no_new_messages["result"] == []
+    assert no_new_messages["lastId"] == second_page["lastId"]
+
+
+def test_citations_of_a_duplicate_file_survive_deleting_the_original(http_client, monkeypatch, tmp_path):
+    """
+    An identical file reuses the chunks of the file it duplicates. Once that
+    file is deleted, citations of the chunks should name the duplicate.
+    """
+    _, session_id, _ = http_client
+    monkeypatch.setenv("FINAL_ANSWER_CONNECTION_STRING", f"sqlite:///{tmp_path / 'final_answer.db'}")
+    monkeypatch.setenv("LEXICAL_INDEX_DIRECTORY", str(tmp_path / "lexical_index"))
+    monkeypatch.setattr("chatdoc.vector_db.PersistentClient", lambda: PersistentClient(path=str(tmp_path / "chroma")))
+    embedding_factory = MagicMock()
+    embedding_factory.return_value.create.return_value = FakeEmbeddings(size=8)
+    monkeypatch.setattr("server_modules.methods.EmbeddingFactory", embedding_factory)
+    ChromaClientRegistry.reset()
+    LexicalIndex.reset_shared_indexes()
+
+    def create_pipeline(vector_db, *_args, **_kwargs):
+        async def run(new_file_dict, _existing_chunks):
+            return {
+                filename: IngestedFile(
+                    document_ids=await vector_db.add_documents(
+                        [Document(page_content="Artikel 7:658", metadata={"source": str(file_path), "page": 0})]
+                    ),
+                    chunk_hashes=["chunk"],
+                )
+                for filename, file_path in new_file_dict.items()
+            }
+
+        return MagicMock(run=run)
+
+    monkeypatch.setattr("server_modules.methods.IngestionPipeline", create_pipeline)
+    file_dict = {}
+    for filename in ("original.txt", "copy.txt"):
+        file_dict[filename] = create_tmp_dir(session_id) / filename
+        file_dict[filename].write_text("Artikel 7:658")
+    try:
+        for filename, file_path in file_dict.items():
+            asyncio.run(app_module.sm_app.save_files_to_vector_db({filename: file_path}, user_id=session_id))
+
+        with app_module.app.test_request_context(
+            "/delete_file", method="POST", data={"sessionId": session_id, "filename": "original.txt"}
+        ):
+            response = asyncio.run(app_module.delete_file())
+        results = ChromaClientRegistry.get_collection(session_id).get(include=["documents", "metadatas"])
+        documents = [
+            Document(page_content=text, metadata={**metadata, "ranking": 1})
+            for text, metadata in zip(results["documents"], results["metadatas"])
+        ]
+
+        assert response.status_code == 200
+        assert [citation["source"] for citation in Citations(documents).__dict__()["citations"]] == ["copy.txt"]
+    finally:
+        ChromaClientRegistry.reset()
+        LexicalIndex.reset_shared_indexes()
+        delete_tmp_dir(session_id)
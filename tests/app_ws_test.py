@@ -17,7 +17,6 @@ os.environ.setdefault(
 
 # pylint: disable=wrong-import-position
 import uuid
-from concurrent.futures import Future
 from unittest.mock import AsyncMock, MagicMock
 
 import pytest
@@ -30,31 +29,29 @@ from app_ws import socketio
 @pytest.fixture(name="socketio_client")
 def fixture_socketio_client(monkeypatch):
     """
-    Provides a `flask_socketio` test client connected to a session whose
-    "file processing" future is already resolved, so that emitting a
-    `prompt` event proceeds straight to invoking the (mocked) chatbot -
-    mirroring how the HTTP `/prompt` endpoint behaves once uploads are done.
+    Provides a `flask_socketio` test client for a session without pending
+    uploads, so that emitting a `prompt` event proceeds straight to invoking
+    the (mocked) chatbot - mirroring how the HTTP `/prompt` endpoint behaves
+    once uploads are done.
 
     A fresh, random session ID is used per test so that the shared
-    `executor.futures` collection (a process-wide global) can never leak
-    state between tests.
+    `upload_jobs` registry (a process-wide global) can never leak state
+    between tests.
     """
     session_id = f"test-session-{uuid.uuid4()}"
 
-    # Build the completed future directly rather than via
-    # `app_module.executor.submit(...)`: the latter wraps the callable with
-    # `flask.copy_current_request_context`, which raises unless called from
-    # inside an active Flask request context - which this fixture is not
-    # (it runs before the socketio test client opens its own request
-    # context). A plain, already-resolved `concurrent.futures.Future` is all
-    # `FutureCollection`/`resolve_prompt_response` need.
-    already_done_future: Future = Future()
-    already_done_future.set_result(None)
-    app_module.executor.futures.add(f"process_files_{session_id}", already_done_future)
-
     fake_chatbot = MagicMock()
     fake_chatbot.send_prompt = AsyncMock(return_value={"answer": "42", "chat_history": []})
-    monkeypatch.setattr(app_module, "Chatbot", MagicMock(return_value=fake_chatbot))
+
+    async def fake_stream_prompt(_prompt):
+        yield "token", "4"
+        yield "token", "2"
+        yield "result", {"answer": "42", "chat_history": []}
+
+    fake_chatbot.stream_prompt = MagicMock(side_effect=fake_stream_prompt)
+    fake_chatbot_pool = MagicMock()
+    fake_chatbot_pool.get.return_value = fake_chatbot
+    monkeypatch.setattr(app_module, "chatbot_pool", fake_chatbot_pool)
 
     client = socketio.test_client(flask_app)
     try:
@@ -101,3 +98,45 @@ def test_handle_prompt_emits_error_on_malformed_payload(socketio_client):
     assert payload["message"] == ""
     assert payload["error"]
     fake_chatbot.send_prompt.assert_not_called()
+
+
+def test_handle_prompt_streams_tokens_when_requested(socketio_client):
+    """
+    A `prompt` event with `stream` set should emit one `prompt_token` event
+    per answer token, followed by the final `prompt_response` event carrying
+    the full result.
+    """
+    client, session_id, fake_chatbot = socketio_client
+
+    client.emit("prompt", {"sessionId": session_id, "prompt": "What is the answer?", "stream": True})
+    received = client.get_received()
+
+    assert [event["name"] for event in received] == ["prompt_token", "prompt_token", "prompt_response"]
+    assert [event["args"][0]["token"] for event in received[:2]] == ["4", "2"]
+    assert received[2]["args"][0]["result"] == {"answer": "42", "chat_history": []}
+    fake_chatbot.stream_prompt.assert_called_once_with("What is the answer?")
+    fake_chatbot.send_prompt.assert_not_called()
+
+
+def test_subscribe_upload_receives_upload_progress(socketio_client):
+    """
+    After a `subscribe_upload` event, the client should receive the current
+    state of the session's upload job and an `upload_progress` event for
+    every later change.
+    """
+    client, session_id, _ = socketio_client
+    job_id = app_module.upload_jobs.create(session_id, files_total=2).job_id
+
+    client.emit("subscribe_upload", {"sessionId": session_id})
+    app_module.upload_jobs.mark_processing(session_id, job_id)
+    app_module.upload_jobs.mark_completed(
+        session_id,
+        job_id,
+        {"message": "", "error": "", "fileIdMapping": [{"filename": "a.pdf", "documentIds": ["id-1"]}]},
+    )
+    received = client.get_received()
+
+    assert [event["name"] for event in received] == ["upload_progress"] * 3
+    assert [event["args"][0]["state"] for event in received] == ["pending", "processing", "completed"]
+    assert received[0]["args"][0]["progress"]["filesTotal"] == 2
+    assert received[-1]["args"][0]["fileIdMapping"] == [{"filename": "a.pdf", "documentIds": ["id-1"]}]
@@ -1,18 +1,22 @@
+from unittest.mock import patch
+
 import pytest
 from langchain_core.messages import AIMessage, HumanMessage
-from sqlalchemy import select
+from sqlalchemy import create_engine, inspect, select, text
+from sqlalchemy.orm import Session
 
 from chatdoc.chat_history import SQLAlchemyChatMessageHistory
-from server_modules.models import ChatHistoryModel
+from server_modules.database import create_all_tables, get_engine
+from server_modules.models import ChatHistoryBase, ChatHistoryModel
 
 
 @pytest.fixture(name="connection_string")
 def connection_string_fixture(tmp_path):
     """
     A file-based SQLite connection string, unique per test, so that multiple
-    `SQLAlchemyChatMessageHistory` instances (each opening their own engine)
-    still share the same underlying database - mirroring how, in production,
-    multiple requests connect to the same chat-history database.
+    `SQLAlchemyChatMessageHistory` instances share the same underlying
+    database - mirroring how, in production, multiple requests connect to the
+    same chat-history database.
     """
     yield f"sqlite:///{tmp_path / 'chat_history.db'}"
 
@@ -82,3 +86,88 @@ def test_clear_removes_all_messages(chat_history):
 
     chat_history.clear()
     assert not chat_history.messages
+
+
+def test_get_last_messages_returns_the_most_recent_window(chat_history):
+    """
+    `get_last_messages` should return only the `n` most recent messages of
+    the session, oldest first.
+    """
+    other_history = SQLAlchemyChatMessageHistory("other-session", chat_history.connection_string)
+    for index in range(5):
+        chat_history.add_message(HumanMessage(content=f"message {index}"))
+        other_history.add_message(AIMessage(content="should not appear"))
+
+    assert [message.content for message in chat_history.get_last_messages(2)] == ["message 3", "message 4"]
+    assert len(chat_history.get_last_messages(10)) == 5
+    assert not chat_history.get_last_messages(0)
+
+
+def test_session_index_is_added_to_an_existing_table(connection_string):
+    """
+    The `(session_id, id)` index should also be created for a message store
+    table that predates it.
+    """
+    engine = create_engine(connection_string)
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE message_store (id INTEGER PRIMARY KEY, session_id VARCHAR(36), message JSON, "
+                "timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)"
+            )
+        )
+
+    SQLAlchemyChatMessageHistory("test-session", connection_string)
+
+    index_names = {index["name"] for index in inspect(engine).get_indexes("message_store")}
+    assert "ix_message_store_session_id_id" in index_names
+
+
+def test_get_messages_after_pages_through_the_history(chat_history):
+    """
+    `get_messages_after` should return the messages after the given ID, with
+    their IDs, at most `limit` at a time.
+    """
+    for index in range(5):
+        chat_history.add_message(HumanMessage(content=f"message {index}"))
+
+    first_page = chat_history.get_messages_after(limit=2)
+    second_page = chat_history.get_messages_after(after_id=first_page[-1][0], limit=2)
+    rest = chat_history.get_messages_after(after_id=second_page[-1][0])
+
+    assert [message.content for _, message in first_page + second_page + rest] == [
+        f"message {index}" for index in range(5)
+    ]
+    assert [message_id for message_id, _ in chat_history.get_messages_after()] == sorted(
+        message_id for message_id, _ in first_page + second_page + rest
+    )
+    assert not chat_history.get_messages_after(after_id=rest[-1][0])
+
+
+def test_histories_share_the_engine_and_create_the_schema_once(connection_string):
+    """
+    Every history of the same database should reuse the shared engine, and
+    only the first one should check (and create) the schema.
+    """
+    with patch("server_modules.database.create_all_tables", wraps=create_all_tables) as mock_create_all_tables:
+        first_history = SQLAlchemyChatMessageHistory("test-session", connection_string)
+        second_history = SQLAlchemyChatMessageHistory("other-session", connection_string)
+
+    assert first_history.engine is second_history.engine is get_engine(connection_string)
+    mock_create_all_tables.assert_called_once_with(ChatHistoryBase, connection_string)
+
+
+def test_add_messages_persists_messages_in_one_transaction(chat_history):
+    """
+    `add_messages` should insert all messages with a single commit and return
+    them with their new IDs, in order.
+    """
+    chat_history.add_message(HumanMessage(content="earlier"))
+    question, answer = HumanMessage(content="Hello"), AIMessage(content="Hi!")
+
+    with patch.object(Session, "commit", autospec=True, side_effect=Session.commit) as mock_commit:
+        inserted_messages = chat_history.add_messages([question, answer])
+
+    mock_commit.assert_called_once()
+    assert [message for _, message in inserted_messages] == [question, answer]
+    assert chat_history.get_messages_after(after_id=inserted_messages[0][0] - 1) == inserted_messages
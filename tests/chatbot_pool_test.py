@@ -0,0 +1,104 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from chatdoc.chatbot_pool import ChatbotPool
+from chatdoc.prompt_mode import PromptMode
+
+
+@pytest.fixture(name="mock_dependencies")
+def fixture_mock_dependencies():
+    """
+    Patches the `Chatbot` class and the factories for the shared embedding
+    function and chat model, so the pool can be exercised without any real
+    model, vector store or database.
+    """
+    with patch("chatdoc.chatbot_pool.Chatbot") as mock_chatbot, patch(
+        "chatdoc.chatbot_pool.EmbeddingFactory"
+    ) as mock_embedding_factory, patch("chatdoc.chatbot_pool.ChatModel") as mock_chat_model:
+        mock_chatbot.side_effect = lambda **_: MagicMock()
+        yield {
+            "Chatbot": mock_chatbot,
+            "EmbeddingFactory": mock_embedding_factory,
+            "ChatModel": mock_chat_model,
+        }
+
+
+def test_get_reuses_pooled_chatbot(mock_dependencies):
+    """
+    Asking twice for the same session and prompt mode should build the chatbot
+    only once.
+    """
+    pool = ChatbotPool(max_size=4, ttl_seconds=60)
+
+    first = pool.get("session-1")
+    second = pool.get("session-1")
+
+    assert first is second
+    mock_dependencies["Chatbot"].assert_called_once()
+
+
+def test_prompt_modes_get_separate_chatbots(mock_dependencies):
+    pool = ChatbotPool(max_size=4, ttl_seconds=60)
+
+    default_chatbot = pool.get("session-1")
+    concise_chatbot = pool.get("session-1", prompt_mode=PromptMode.CONCISE)
+
+    assert default_chatbot is not concise_chatbot
+    assert mock_dependencies["Chatbot"].call_count == 2
+
+
+def test_session_independent_parts_are_shared(mock_dependencies):
+    """
+    The embedding function and chat model should be built once and handed to
+    every chatbot the pool builds.
+    """
+    pool = ChatbotPool(max_size=4, ttl_seconds=60)
+
+    pool.get("session-1")
+    pool.get("session-2")
+
+    mock_dependencies["EmbeddingFactory"].return_value.create.assert_called_once()
+    mock_dependencies["ChatModel"].assert_called_once()
+    for call in mock_dependencies["Chatbot"].call_args_list:
+        assert call.kwargs["embedding_fn"] is mock_dependencies["EmbeddingFactory"].return_value.create.return_value
+        assert call.kwargs["chat_model"] is mock_dependencies["ChatModel"].return_value.chat_model
+        assert call.kwargs["rewrite_chat_model"] is mock_dependencies["ChatModel"].return_value.chat_model
+
+
+def test_rewrite_chat_model_is_shared(mock_dependencies, monkeypatch):
+    """
+    A separately configured model for rewriting follow-up questions should be
+    built once and handed to every chatbot the pool builds.
+    """
+    monkeypatch.setenv("REWRITE_CHAT_MODEL_NAME", "gpt-4o-mini")
+    pool = ChatbotPool(max_size=4, ttl_seconds=60)
+
+    with patch("chatdoc.chatbot.ChatModel") as mock_rewrite_chat_model:
+        pool.get("session-1")
+        pool.get("session-2")
+
+    mock_rewrite_chat_model.assert_called_once_with(chat_model_name="gpt-4o-mini")
+    for call in mock_dependencies["Chatbot"].call_args_list:
+        assert call.kwargs["rewrite_chat_model"] is mock_rewrite_chat_model.return_value.chat_model
+
+
+def test_pool_is_bounded(mock_dependencies):
+    pool = ChatbotPool(max_size=1, ttl_seconds=60)
+
+    first = pool.get("session-1")
+    pool.get("session-2")
+
+    assert pool.get("session-1") is not first
+    assert len(pool.chatbots) == 1
+
+
+def test_invalidate_drops_chatbots_of_session(mock_dependencies):
+    pool = ChatbotPool(max_size=4, ttl_seconds=60)
+    first = pool.get("session-1")
+    pool.get("session-1", prompt_mode=PromptMode.DETAILED)
+    other = pool.get("session-2")
+
+    assert pool.invalidate("session-1") == 2
+    assert pool.get("session-1") is not first
+    assert pool.get("session-2") is other
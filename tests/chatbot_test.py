@@ -1,10 +1,13 @@
 import asyncio
-from unittest.mock import AsyncMock, MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, PropertyMock, patch
 
 import pytest
 from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
 
+from chatdoc.answer_cache import AnswerCache
 from chatdoc.chatbot import Chatbot
+from chatdoc.embed.query_embedding_cache import QueryEmbeddingCache
 from chatdoc.prompt_mode import PromptMode, get_system_template
 
 
@@ -25,6 +28,8 @@ def fixture_mock_dependencies(monkeypatch):
     """
     monkeypatch.setenv("CHAT_HISTORY_CONNECTION_STRING", "sqlite:///:memory:")
     monkeypatch.setenv("LAST_N_MESSAGES", "5")
+    monkeypatch.setenv("ANSWER_CACHE_SIZE", "0")
+    AnswerCache.reset_shared_cache()
 
     with patch("chatdoc.chatbot.EmbeddingFactory") as mock_embedding_factory, patch(
         "chatdoc.chatbot.VectorDatabase"
@@ -45,7 +50,8 @@ def fixture_mock_dependencies(monkeypatch):
 
         mock_history_instance = mock_sql_chat_message_history.return_value
         mock_history_instance.messages = []
-        mock_history_instance.add_message = MagicMock()
+        mock_history_instance.get_last_messages.return_value = []
+        mock_history_instance.add_messages.side_effect = lambda messages: list(enumerate(messages, start=1))
 
         mock_chat_model.return_value.chat_model = MagicMock()
 
@@ -113,13 +119,58 @@ def test_chatbot_builds_history_aware_retrieval_chain(mock_dependencies):
 
     mock_dependencies["create_history_aware_retriever"].assert_called_once()
     mock_dependencies["create_stuff_documents_chain"].assert_called_once()
-    mock_dependencies["create_retrieval_chain"].assert_called_once_with(
-        mock_dependencies["create_history_aware_retriever"].return_value,
-        mock_dependencies["create_stuff_documents_chain"].return_value,
-    )
+    mock_dependencies["create_retrieval_chain"].assert_called_once()
+    retriever, question_answer_chain = mock_dependencies["create_retrieval_chain"].call_args.args
+    assert retriever.config["run_name"] == "chat_retriever_chain"
+    assert question_answer_chain is mock_dependencies["create_stuff_documents_chain"].return_value
     assert chatbot.chatQA is mock_dependencies["mock_chain"]
 
 
+@pytest.mark.parametrize(
+    "question, rewritten",
+    [
+        ("What does article 7:658 say about the duty of care of employers?", False),
+        ("Wat zegt artikel 7:658 over de zorgplicht van werkgevers?", False),
+        ("What does it say about employers?", True),
+        ("Wat staat daarover in de wet?", True),
+        ("Why?", True),
+    ],
+)
+def test_self_contained_questions_skip_the_rewrite(question, rewritten, mock_dependencies):
+    """
+    Follow-up questions should be rewritten by the history-aware retriever,
+    while self-contained questions go to the retriever directly.
+    """
+    mock_dependencies["create_history_aware_retriever"].return_value = MagicMock(return_value=["rewritten"])
+    retriever = mock_dependencies["VectorDatabase"].return_value.retriever = MagicMock(return_value=["direct"])
+    Chatbot(user_id="test-user")
+    chat_retriever_chain, _ = mock_dependencies["create_retrieval_chain"].call_args.args
+
+    docs = chat_retriever_chain.invoke({"input": question, "chat_history": ["earlier message"]})
+
+    assert docs == (["rewritten"] if rewritten else ["direct"])
+    if not rewritten:
+        retriever.assert_called_once_with(question)
+
+
+def test_rewrite_chat_model_is_configurable(mock_dependencies, monkeypatch):
+    """
+    A separate (smaller) model can be configured to rewrite follow-up questions with.
+    """
+    monkeypatch.setenv("REWRITE_CHAT_MODEL_NAME", "gpt-4o-mini")
+    rewrite_model, answer_model = MagicMock(), MagicMock()
+    mock_dependencies["ChatModel"].side_effect = lambda chat_model_name=None: MagicMock(
+        chat_model=rewrite_model if chat_model_name == "gpt-4o-mini" else answer_model
+    )
+
+    chatbot = Chatbot(user_id="test-user")
+
+    assert chatbot.chat_model is answer_model
+    assert chatbot.rewrite_chat_model is rewrite_model
+    assert mock_dependencies["create_history_aware_retriever"].call_args.args[0] is rewrite_model
+    assert mock_dependencies["create_stuff_documents_chain"].call_args.args[0] is answer_model
+
+
 def test_send_prompt_returns_answer_and_citations(mock_dependencies):
     """
     `send_prompt` should invoke the underlying retrieval chain with the
@@ -154,7 +205,7 @@ def test_send_prompt_persists_new_messages(mock_dependencies):
     """
     After answering, the human question and the AI answer (carrying the
     citations in its `additional_kwargs`) should both be persisted to the
-    SQL-backed chat history.
+    SQL-backed chat history, in a single `add_messages` call.
     """
     chatbot = Chatbot(user_id="test-user")
 
@@ -167,11 +218,10 @@ def test_send_prompt_persists_new_messages(mock_dependencies):
 
     asyncio.run(chatbot.send_prompt("Hello"))
 
-    add_message_calls = mock_dependencies["mock_history_instance"].add_message.call_args_list
-    assert len(add_message_calls) == 2
-
-    human_message = add_message_calls[0].args[0]
-    ai_message = add_message_calls[1].args[0]
+    mock_history_instance = mock_dependencies["mock_history_instance"]
+    mock_history_instance.add_message.assert_not_called()
+    mock_history_instance.add_messages.assert_called_once()
+    human_message, ai_message = mock_history_instance.add_messages.call_args.args[0]
 
     assert human_message.type == "human"
     assert human_message.content == "Hello"
@@ -187,7 +237,7 @@ def test_send_prompt_limits_chat_history_sent_to_chain(mock_dependencies):
     """
     chatbot = Chatbot(user_id="test-user")
     chatbot.last_n_messages = 2
-    chatbot.chat_history = ["msg1", "msg2", "msg3", "msg4"]
+    mock_dependencies["mock_history_instance"].get_last_messages.return_value = ["msg1", "msg2", "msg3", "msg4"]
 
     mock_dependencies["mock_chain"].ainvoke.return_value = {
         "input": "Hello",
@@ -201,6 +251,82 @@ def test_send_prompt_limits_chat_history_sent_to_chain(mock_dependencies):
     assert call_kwargs["chat_history"] == ["msg3", "msg4"]
 
 
+def test_only_the_recent_chat_history_is_loaded(mock_dependencies, monkeypatch):
+    """
+    The chatbot should only read the last `LAST_N_MESSAGES` messages, when it
+    is built and at the start of every prompt, never the full history, and
+    keep that window up to date in memory after a turn was persisted.
+    """
+    monkeypatch.setenv("LAST_N_MESSAGES", "3")
+    mock_history_instance = mock_dependencies["mock_history_instance"]
+    recent_messages = [HumanMessage(content="Hello"), AIMessage(content="Hi there!")]
+    mock_history_instance.get_last_messages.return_value = recent_messages
+    type(mock_history_instance).messages = PropertyMock(side_effect=AssertionError("full history read"))
+    chatbot = Chatbot(user_id="test-user")
+
+    assert chatbot.chat_history == recent_messages
+
+    mock_dependencies["mock_chain"].ainvoke.return_value = {"context": [], "answer": "Hi there!"}
+    result = asyncio.run(chatbot.send_prompt("Hello"))
+
+    assert [call.args for call in mock_history_instance.get_last_messages.call_args_list] == [(3,), (3,)]
+    assert [message["data"]["content"] for message in result["chat_history"]] == ["Hi there!", "Hello", "Hi there!"]
+
+
+def test_chatbots_of_other_prompt_modes_see_each_others_turns(mock_dependencies):
+    """
+    The pool keeps a chatbot per prompt mode for the same session, so a turn
+    persisted by one of them must be in the history the other sends next.
+    """
+    stored_messages = []
+    mock_history_instance = mock_dependencies["mock_history_instance"]
+    mock_history_instance.get_last_messages.side_effect = lambda n: stored_messages[-n:]
+
+    def add_messages(messages):
+        stored_messages.extend(messages)
+        return list(enumerate(messages, start=len(stored_messages) - len(messages) + 1))
+
+    mock_history_instance.add_messages.side_effect = add_messages
+    mock_dependencies["mock_chain"].ainvoke.return_value = {"context": [], "answer": "Hi there!"}
+    concise_chatbot = Chatbot(user_id="test-user", prompt_mode=PromptMode.CONCISE)
+    default_chatbot = Chatbot(user_id="test-user", prompt_mode=PromptMode.DEFAULT)
+
+    asyncio.run(concise_chatbot.send_prompt("Hello"))
+    result = asyncio.run(default_chatbot.send_prompt("Hello again"))
+
+    sent_history = mock_dependencies["mock_chain"].ainvoke.call_args.args[0]["chat_history"]
+    assert [message.content for message in sent_history] == ["Hello", "Hi there!"]
+    assert len(result["chat_history"]) == 4
+
+
+def test_concurrent_prompts_keep_their_own_history_window(mock_dependencies):
+    """
+    Two prompts answered concurrently by the same (pooled) chatbot should
+    each extend the window they loaded, not the window of the other prompt.
+    """
+    mock_history_instance = mock_dependencies["mock_history_instance"]
+    mock_history_instance.get_last_messages.return_value = [HumanMessage(content="Hello"), AIMessage(content="Hi!")]
+
+    async def answer(inputs):
+        await asyncio.sleep(0)
+        return {"context": [], "answer": f"Answer to {inputs['input']}"}
+
+    mock_dependencies["mock_chain"].ainvoke.side_effect = answer
+    chatbot = Chatbot(user_id="test-user")
+
+    async def send_prompts():
+        return await asyncio.gather(chatbot.send_prompt("first"), chatbot.send_prompt("second"))
+
+    first_result, second_result = asyncio.run(send_prompts())
+
+    assert [message["data"]["content"] for message in first_result["chat_history"]] == [
+        "Hello", "Hi!", "first", "Answer to first"
+    ]
+    assert [message["data"]["content"] for message in second_result["chat_history"]] == [
+        "Hello", "Hi!", "second", "Answer to second"
+    ]
+
+
 def test_default_prompt_mode_used_when_not_specified(mock_dependencies):
     """
     Existing callers that don't pass prompt_mode should keep getting the exact
@@ -234,3 +360,212 @@ def test_concise_and_detailed_modes_produce_different_system_messages(mock_depen
     _, detailed_prompt = mock_create_stuff_documents_chain.call_args.args
 
     assert concise_prompt.messages != detailed_prompt.messages
+
+
+def test_stream_prompt_yields_tokens_then_result(mock_dependencies):
+    """
+    `stream_prompt` should forward every answer token produced by the chain's
+    `astream` as it arrives, then persist the turn and yield the same result
+    shape `send_prompt` returns.
+    """
+    chatbot = Chatbot(user_id="test-user")
+    source_document = Document(
+        page_content="some proof text",
+        metadata={"source": "/tmp/some-file.pdf", "page": 0, "ranking": 1, "score": 0.9},
+    )
+
+    async def fake_astream(_inputs):
+        for chunk in (
+            {"input": "What is DoRA?"},
+            {"context": [source_document]},
+            {"answer": "DoRA "},
+            {"answer": "is a chatbot."},
+        ):
+            yield chunk
+
+    mock_dependencies["mock_chain"].astream = fake_astream
+
+    async def collect_events():
+        return [event async for event in chatbot.stream_prompt("What is DoRA?")]
+
+    events = asyncio.run(collect_events())
+
+    assert events[:2] == [("token", "DoRA "), ("token", "is a chatbot.")]
+    event_type, result = events[2]
+    assert event_type == "result"
+    assert result["answer"] == "DoRA is a chatbot."
+    assert result["citations"]["citations"][0]["source"] == "some-file.pdf"
+    _, ai_message = mock_dependencies["mock_history_instance"].add_messages.call_args.args[0]
+    assert ai_message.content == "DoRA is a chatbot."
+
+
+@pytest.fixture(name="cached_chatbot")
+def fixture_cached_chatbot(mock_dependencies):
+    """
+    A chatbot with an enabled answer cache, whose collection has a fixed
+    content fingerprint and whose questions embed to fixed vectors.
+    """
+    QueryEmbeddingCache.reset_shared_cache()
+    embeddings = {
+        "What is the notice period?": [1.0, 0.0],
+        "what is the notice period": [1.0, 0.0],
+        "What is the notice period for tenants?": [0.99, 0.05],
+        "Who signed the lease agreement?": [0.0, 1.0],
+        "What is it?": [0.6, 0.8],
+    }
+    embedding_fn = MagicMock()
+    embedding_fn.aembed_query = AsyncMock(side_effect=lambda question: embeddings[question])
+    fingerprints = {"test-user": "fingerprint-1", "other-user": "fingerprint-1"}
+    mock_dependencies["fingerprints"] = fingerprints
+    mock_dependencies["embedding_fn"] = embedding_fn
+    mock_dependencies["VectorDatabase"].return_value.retriever.is_lexical_only_query.return_value = False
+
+    async def answer(inputs):
+        # Retrieval embeds the question through the shared query embedding cache.
+        await QueryEmbeddingCache.get_shared_cache().aembed_query(embedding_fn, inputs["input"])
+        return {
+            "context": [
+                Document(
+                    page_content="one month",
+                    metadata={"source": "/tmp/lease.pdf", "page": 2, "ranking": 1, "score": 0.9},
+                )
+            ],
+            "answer": "One month.",
+        }
+
+    mock_dependencies["mock_chain"].ainvoke.side_effect = answer
+    yield Chatbot(
+        user_id="test-user",
+        embedding_fn=embedding_fn,
+        answer_cache=AnswerCache(max_size=8),
+        content_fingerprint_fn=fingerprints.get,
+    )
+    QueryEmbeddingCache.reset_shared_cache()
+
+
+def test_repeated_question_is_answered_from_the_cache(cached_chatbot, mock_dependencies):
+    """
+    Asking the same (or a near-identical) question over the same documents
+    again should return the cached answer and citations without invoking
+    the chain, while still persisting the turn.
+    """
+    first = asyncio.run(cached_chatbot.send_prompt("What is the notice period?"))
+    second = asyncio.run(cached_chatbot.send_prompt("what is the notice period"))
+    third = asyncio.run(cached_chatbot.send_prompt("What is the notice period for tenants?"))
+
+    assert mock_dependencies["mock_chain"].ainvoke.call_count == 1
+    assert second["answer"] == third["answer"] == first["answer"] == "One month."
+    assert second["citations"] == first["citations"]
+    assert mock_dependencies["mock_history_instance"].add_messages.call_count == 3
+    assert cached_chatbot.answer_cache.stats()["hits"] == 2
+
+
+def test_exact_repeated_question_is_not_embedded_again(cached_chatbot, mock_dependencies):
+    """
+    Only retrieval should embed the first question, and the exact same
+    question should be answered from the cache without embedding it.
+    """
+    QueryEmbeddingCache.get_shared_cache().embeddings.clear()
+    asyncio.run(cached_chatbot.send_prompt("What is the notice period?"))
+    # Also forget the embedding retrieval cached, to show the lookup doesn't need it.
+    QueryEmbeddingCache.get_shared_cache().embeddings.clear()
+
+    result = asyncio.run(cached_chatbot.send_prompt("What is the notice period?"))
+
+    assert result["answer"] == "One month."
+    assert mock_dependencies["embedding_fn"].aembed_query.call_count == 1
+
+
+def test_identifier_lookups_are_not_embedded_for_the_answer_cache(cached_chatbot, mock_dependencies):
+    """
+    A question that the retriever answers from the lexical index alone should
+    not be embedded just to look up similar cached answers.
+    """
+    asyncio.run(cached_chatbot.send_prompt("What is the notice period?"))
+    retriever = mock_dependencies["VectorDatabase"].return_value.retriever
+    retriever.is_lexical_only_query.side_effect = lambda question: question == "7:658"
+    mock_dependencies["mock_chain"].ainvoke.side_effect = None
+    mock_dependencies["mock_chain"].ainvoke.return_value = {"context": [], "answer": "Article 7:658."}
+
+    asyncio.run(cached_chatbot.send_prompt("7:658"))
+    result = asyncio.run(cached_chatbot.send_prompt("7:658"))
+
+    assert mock_dependencies["embedding_fn"].aembed_query.call_count == 1
+    assert result["answer"] == "Article 7:658."
+    assert mock_dependencies["mock_chain"].ainvoke.call_count == 2
+
+
+def test_different_question_or_content_misses_the_cache(cached_chatbot, mock_dependencies):
+    """
+    A dissimilar question, or the same question after the collection's
+    content changed, should be answered by the chain.
+    """
+    asyncio.run(cached_chatbot.send_prompt("What is the notice period?"))
+    asyncio.run(cached_chatbot.send_prompt("Who signed the lease agreement?"))
+    mock_dependencies["fingerprints"]["test-user"] = "fingerprint-2"
+    asyncio.run(cached_chatbot.send_prompt("What is the notice period?"))
+
+    assert mock_dependencies["mock_chain"].ainvoke.call_count == 3
+
+
+def test_sessions_with_the_same_documents_share_cached_answers(cached_chatbot, mock_dependencies):
+    """
+    Another session whose documents have the same content fingerprint should
+    be answered from the cache, while one with other documents should not.
+    """
+    asyncio.run(cached_chatbot.send_prompt("What is the notice period?"))
+    other_chatbot = Chatbot(
+        user_id="other-user",
+        embedding_fn=cached_chatbot.embedding_fn,
+        answer_cache=cached_chatbot.answer_cache,
+        content_fingerprint_fn=mock_dependencies["fingerprints"].get,
+    )
+
+    result = asyncio.run(other_chatbot.send_prompt("What is the notice period?"))
+    mock_dependencies["fingerprints"]["other-user"] = "fingerprint-2"
+    asyncio.run(other_chatbot.send_prompt("What is the notice period?"))
+
+    assert result["answer"] == "One month."
+    assert mock_dependencies["mock_chain"].ainvoke.call_count == 2
+    assert cached_chatbot.answer_cache.stats()["hits"] == 1
+
+
+def test_answers_are_not_cached_without_a_content_fingerprint(cached_chatbot, mock_dependencies):
+    mock_dependencies["fingerprints"].clear()
+
+    asyncio.run(cached_chatbot.send_prompt("What is the notice period?"))
+    asyncio.run(cached_chatbot.send_prompt("What is the notice period?"))
+
+    assert mock_dependencies["mock_chain"].ainvoke.call_count == 2
+    assert len(cached_chatbot.answer_cache.answers) == 0
+
+
+def test_follow_up_questions_are_not_cached(cached_chatbot, mock_dependencies):
+    """
+    A follow-up question depends on the chat history, so it should neither be
+    looked up in nor stored in the answer cache.
+    """
+    history = [HumanMessage(content="What is the notice period?"), AIMessage(content="One month.")]
+    cached_chatbot.chat_history = history
+    mock_dependencies["mock_history_instance"].get_last_messages.return_value = history
+
+    asyncio.run(cached_chatbot.send_prompt("What is it?"))
+    asyncio.run(cached_chatbot.send_prompt("What is it?"))
+
+    assert mock_dependencies["mock_chain"].ainvoke.call_count == 2
+    assert len(cached_chatbot.answer_cache.answers) == 0
+
+
+def test_stream_prompt_serves_cached_answer_as_single_token(cached_chatbot, mock_dependencies):
+    asyncio.run(cached_chatbot.send_prompt("What is the notice period?"))
+    mock_dependencies["mock_chain"].astream = MagicMock()
+
+    async def collect_events():
+        return [event async for event in cached_chatbot.stream_prompt("What is the notice period?")]
+
+    events = asyncio.run(collect_events())
+
+    mock_dependencies["mock_chain"].astream.assert_not_called()
+    assert events[0] == ("token", "One month.")
+    assert events[1][0] == "result"
+    assert events[1][1]["citations"]["citations"][0]["source"] == "lease.pdf"
@@ -3,6 +3,7 @@ from pathlib import Path
 
 import pytest
 
+from server_modules.ingestion import IngestedFile
 from server_modules.methods import DocumentMethods
 
 
@@ -23,29 +24,37 @@ def env_fixture(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
     monkeypatch.setenv("FINAL_ANSWER_CONNECTION_STRING", f"sqlite:///{db_path}")
 
 
-def test_add_document_ids_inserts_all_ids(logger: logging.Logger) -> None:
+def store_file(
+    session_id: str, filename: str, document_ids: list[str], logger: logging.Logger, content_hash: str = "hash-1"
+) -> None:
     """
-    Storing document IDs should persist all of them for the session/filename.
+    Store the document IDs of an ingested file, the way uploads do.
     """
-    DocumentMethods.add_document_ids(
-        session_id="session-1",
-        filename="file.pdf",
-        document_ids=["doc-1", "doc-2"],
+    DocumentMethods.replace_document_ids(
+        session_id=session_id,
+        filename=filename,
+        ingested_file=IngestedFile(document_ids=document_ids, chunk_hashes=[None] * len(document_ids)),
+        content_hash=content_hash,
         logger=logger,
     )
+
+
+def test_replace_document_ids_inserts_all_ids(logger: logging.Logger) -> None:
+    """
+    Storing document IDs should persist all of them for the session/filename.
+    """
+    store_file(session_id="session-1", filename="file.pdf", document_ids=["doc-1", "doc-2"], logger=logger)
     document_ids = DocumentMethods.get_document_ids(
         session_id="session-1", filename="file.pdf", logger=logger
     )
     assert sorted(document_ids) == ["doc-1", "doc-2"]
 
 
-def test_add_document_ids_skips_empty_list(logger: logging.Logger) -> None:
+def test_replace_document_ids_skips_empty_list(logger: logging.Logger) -> None:
     """
     Storing an empty list of document IDs should not persist anything.
     """
-    DocumentMethods.add_document_ids(
-        session_id="session-1", filename="file.pdf", document_ids=[], logger=logger
-    )
+    store_file(session_id="session-1", filename="file.pdf", document_ids=[], logger=logger)
     document_ids = DocumentMethods.get_document_ids(
         session_id="session-1", filename="file.pdf", logger=logger
     )
@@ -68,12 +77,7 @@ def test_delete_document_ids_removes_stored_ids(logger: logging.Logger) -> None:
     """
     Deleting document IDs should remove all stored ids for the session/filename.
     """
-    DocumentMethods.add_document_ids(
-        session_id="session-1",
-        filename="file.pdf",
-        document_ids=["doc-1", "doc-2"],
-        logger=logger,
-    )
+    store_file(session_id="session-1", filename="file.pdf", document_ids=["doc-1", "doc-2"], logger=logger)
     DocumentMethods.delete_document_ids(
         session_id="session-1", filename="file.pdf", logger=logger
     )
@@ -81,3 +85,123 @@ def test_delete_document_ids_removes_stored_ids(logger: logging.Logger) -> None:
         session_id="session-1", filename="file.pdf", logger=logger
     )
     assert document_ids == []
+
+
+def test_replace_document_ids_does_not_duplicate_identical_upload(logger: logging.Logger) -> None:
+    """
+    Re-uploading an identical file should not store its document IDs twice.
+    """
+    for _ in range(2):
+        store_file(session_id="session-1", filename="file.pdf", document_ids=["doc-1", "doc-2"], logger=logger)
+    document_ids = DocumentMethods.get_document_ids(
+        session_id="session-1", filename="file.pdf", logger=logger
+    )
+    assert sorted(document_ids) == ["doc-1", "doc-2"]
+
+
+def test_get_ingested_files_by_content_hash(logger: logging.Logger) -> None:
+    """
+    Known content hashes of the session should map to their document IDs,
+    even when the same content is stored under several file names.
+    """
+    for filename in ("file.pdf", "copy.pdf"):
+        store_file(session_id="session-1", filename=filename, document_ids=["doc-1", "doc-2"], logger=logger)
+    store_file(
+        session_id="session-2", filename="other.pdf", document_ids=["doc-3"], logger=logger, content_hash="hash-2"
+    )
+
+    ingested_files_by_hash = DocumentMethods.get_ingested_files_by_content_hash(
+        session_id="session-1", content_hashes={"hash-1", "hash-2"}, logger=logger
+    )
+
+    assert list(ingested_files_by_hash) == ["hash-1"]
+    assert ingested_files_by_hash["hash-1"].document_ids == ["doc-1", "doc-2"]
+
+
+def test_get_shared_document_ids(logger: logging.Logger) -> None:
+    """
+    Document IDs that another file name of the session references should be
+    reported as shared.
+    """
+    store_file(session_id="session-1", filename="file.pdf", document_ids=["doc-1", "doc-2"], logger=logger)
+    store_file(session_id="session-1", filename="copy.pdf", document_ids=["doc-2"], logger=logger)
+
+    shared_document_ids = DocumentMethods.get_shared_document_ids(
+        session_id="session-1", filename="file.pdf", document_ids=["doc-1", "doc-2"], logger=logger
+    )
+
+    assert shared_document_ids == {"doc-2"}
+
+
+def test_get_document_filenames(logger: logging.Logger) -> None:
+    """
+    Every file name of the session that references a document ID should be
+    retrieved, and document IDs that no file references left out.
+    """
+    store_file(session_id="session-1", filename="file.pdf", document_ids=["doc-1", "doc-2"], logger=logger)
+    store_file(session_id="session-1", filename="copy.pdf", document_ids=["doc-2"], logger=logger)
+    store_file(session_id="session-2", filename="other.pdf", document_ids=["doc-1"], logger=logger)
+
+    document_filenames = DocumentMethods.get_document_filenames(
+        session_id="session-1", document_ids=["doc-1", "doc-2", "doc-3"], logger=logger
+    )
+
+    assert document_filenames == {"doc-1": {"file.pdf"}, "doc-2": {"file.pdf", "copy.pdf"}}
+
+
+def test_replace_document_ids_returns_removed_ids(logger: logging.Logger) -> None:
+    """
+    Replacing the chunks of a file should store the new chunks with their
+    hashes and report the old document IDs the new revision no longer has.
+    """
+    DocumentMethods.replace_document_ids(
+        session_id="session-1",
+        filename="file.pdf",
+        ingested_file=IngestedFile(document_ids=["doc-1", "doc-2"], chunk_hashes=["chunk-1", "chunk-2"]),
+        content_hash="hash-1",
+        logger=logger,
+    )
+
+    removed_document_ids = DocumentMethods.replace_document_ids(
+        session_id="session-1",
+        filename="file.pdf",
+        ingested_file=IngestedFile(document_ids=["doc-1", "doc-3"], chunk_hashes=["chunk-1", "chunk-3"]),
+        content_hash="hash-2",
+        logger=logger,
+    )
+
+    assert removed_document_ids == ["doc-2"]
+    assert DocumentMethods.get_chunk_document_ids(session_id="session-1", filename="file.pdf", logger=logger) == {
+        "chunk-1": ["doc-1"],
+        "chunk-3": ["doc-3"],
+    }
+
+
+def test_get_content_fingerprint_is_shared_by_sessions_with_the_same_files(logger: logging.Logger) -> None:
+    """
+    Sessions that stored the same files should get the same content
+    fingerprint, regardless of their document IDs or upload order.
+    """
+    for session_id, filenames in (("session-1", ["a.pdf", "b.pdf"]), ("session-2", ["b.pdf", "a.pdf"])):
+        for filename in filenames:
+            DocumentMethods.replace_document_ids(
+                session_id=session_id,
+                filename=filename,
+                ingested_file=IngestedFile(document_ids=[f"{session_id}-{filename}"], chunk_hashes=["chunk"]),
+                content_hash=f"hash-{filename}",
+                logger=logger,
+            )
+    DocumentMethods.replace_document_ids(
+        session_id="session-3",
+        filename="a.pdf",
+        ingested_file=IngestedFile(document_ids=["doc"], chunk_hashes=["chunk"]),
+        content_hash="hash-a.pdf",
+        logger=logger,
+    )
+
+    fingerprint = DocumentMethods.get_content_fingerprint(session_id="session-1", logger=logger)
+
+    assert fingerprint is not None
+    assert DocumentMethods.get_content_fingerprint(session_id="session-2", logger=logger) == fingerprint
+    assert DocumentMethods.get_content_fingerprint(session_id="session-3", logger=logger) != fingerprint
+    assert DocumentMethods.get_content_fingerprint(session_id="session-4", logger=logger) is None
@@ -0,0 +1,96 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import httpx
+import openai
+import pytest
+
+from chatdoc.embed.embedding_batcher import EmbeddingBatcher, get_retry_delay, parse_duration
+
+
+def rate_limit_error(headers: dict[str, str]) -> openai.RateLimitError:
+    response = httpx.Response(
+        429, headers=headers, request=httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    )
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+@pytest.fixture(name="embedding_fn")
+def embedding_fn_fixture():
+    async def fake_aembed_documents(texts: list[str]) -> list[list[float]]:
+        await asyncio.sleep(0)
+        return [[float(len(text))] for text in texts]
+
+    embedding_fn = MagicMock()
+    embedding_fn.model = "text-embedding-ada-002"
+    embedding_fn.aembed_documents = AsyncMock(side_effect=fake_aembed_documents)
+    return embedding_fn
+
+
+@pytest.mark.parametrize(
+    "duration, expected",
+    [("1", 1.0), ("0.5", 0.5), ("1s", 1.0), ("20ms", 0.02), ("6m0s", 360.0), ("1h2m3.5s", 3723.5), ("soon", None)],
+)
+def test_parse_duration(duration: str, expected: float | None) -> None:
+    assert parse_duration(duration) == expected
+
+
+def test_retry_delay_follows_rate_limit_headers() -> None:
+    assert get_retry_delay(httpx.Headers({"retry-after-ms": "250"}), attempt=0) == 0.25
+    assert get_retry_delay(httpx.Headers({"retry-after": "3"}), attempt=0) == 3.0
+    assert (
+        get_retry_delay(
+            httpx.Headers({"x-ratelimit-reset-requests": "120ms", "x-ratelimit-reset-tokens": "1m1s"}), attempt=0
+        )
+        == 61.0
+    )
+    assert 1.0 <= get_retry_delay(httpx.Headers(), attempt=2) <= 4.0
+
+
+def test_batches_are_limited_by_tokens_and_count(embedding_fn) -> None:
+    batcher = EmbeddingBatcher(embedding_fn, max_tokens_per_batch=10, max_texts_per_batch=3)
+    batcher.count_tokens = len  # one token per character keeps the test independent of the encoding
+
+    batches = batcher.make_batches(["aaaa", "bbbb", "cc", "d", "e", "f", "gggggggggggg"])
+
+    assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_documents_are_embedded_in_order(embedding_fn) -> None:
+    batcher = EmbeddingBatcher(embedding_fn, max_tokens_per_batch=10, max_texts_per_batch=2)
+    texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+
+    embeddings = asyncio.run(batcher.aembed_documents(texts))
+
+    assert embeddings == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert embedding_fn.aembed_documents.await_count == 3
+
+
+def test_rate_limited_batches_are_retried_with_lower_concurrency(embedding_fn) -> None:
+    embedded_batches = []
+
+    async def flaky_aembed_documents(texts: list[str]) -> list[list[float]]:
+        if not embedded_batches:
+            embedded_batches.append(None)
+            raise rate_limit_error({"retry-after-ms": "10"})
+        embedded_batches.append(texts)
+        return [[1.0] for _ in texts]
+
+    embedding_fn.aembed_documents = AsyncMock(side_effect=flaky_aembed_documents)
+    batcher = EmbeddingBatcher(embedding_fn, max_concurrency=4, max_retries=2)
+
+    embeddings = asyncio.run(batcher.aembed_batch(["a", "b"]))
+
+    assert embeddings == [[1.0], [1.0]]
+    assert embedded_batches == [None, ["a", "b"]]
+    assert batcher.limiter.limit == 3
+
+
+def test_rate_limit_error_is_raised_after_max_retries(embedding_fn) -> None:
+    embedding_fn.aembed_documents = AsyncMock(side_effect=rate_limit_error({"retry-after-ms": "1"}))
+    batcher = EmbeddingBatcher(embedding_fn, max_retries=2)
+
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(batcher.aembed_batch(["a"]))
+
+    assert embedding_fn.aembed_documents.await_count == 3
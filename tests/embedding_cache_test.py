@@ -0,0 +1,146 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+from langchain_core.embeddings import Embeddings
+from sqlalchemy import event
+
+from chatdoc.embed.embedding_cache import CachedEmbeddings
+from chatdoc.embed.embedding_factory import EmbeddingFactory
+from server_modules.database import get_engine
+
+
+class CountingEmbeddings(Embeddings):
+    """
+    A deterministic fake embedding model that records which texts it embedded.
+    """
+
+    def __init__(self) -> None:
+        self.embedded_texts: list[str] = []
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.embedded_texts.extend(texts)
+        return [[float(len(text)), 0.5, -1.25] for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return [float(len(text)), 0.0, 0.0]
+
+
+@pytest.fixture(name="connection_string")
+def connection_string_fixture(tmp_path: Path) -> str:
+    return f"sqlite:///{tmp_path / 'embedding_cache.db'}"
+
+
+def build_cache(connection_string: str, model_name: str = "model-a", max_bytes: int = 10_000) -> CachedEmbeddings:
+    return CachedEmbeddings(
+        underlying_embeddings=CountingEmbeddings(),
+        vendor_name="fake",
+        model_name=model_name,
+        connection_string=connection_string,
+        max_bytes=max_bytes,
+    )
+
+
+def test_repeated_chunks_are_embedded_once(connection_string: str) -> None:
+    """
+    Chunks seen before, even by another `CachedEmbeddings` instance (e.g.
+    another upload), should be served from the cache.
+    """
+    first_cache = build_cache(connection_string)
+    first_vectors = first_cache.embed_documents(["alpha", "beta", "alpha"])
+
+    second_cache = build_cache(connection_string)
+    second_vectors = second_cache.embed_documents(["beta", "gamma"])
+
+    assert first_cache.underlying_embeddings.embedded_texts == ["alpha", "beta"]
+    assert second_cache.underlying_embeddings.embedded_texts == ["gamma"]
+    assert first_vectors == [[5.0, 0.5, -1.25], [4.0, 0.5, -1.25], [5.0, 0.5, -1.25]]
+    assert second_vectors[0] == first_vectors[1]
+
+
+def test_cache_is_keyed_by_model(connection_string: str) -> None:
+    build_cache(connection_string, model_name="model-a").embed_documents(["alpha"])
+    other_model_cache = build_cache(connection_string, model_name="model-b")
+    other_model_cache.embed_documents(["alpha"])
+
+    assert other_model_cache.underlying_embeddings.embedded_texts == ["alpha"]
+
+
+def test_async_embedding_uses_cache(connection_string: str) -> None:
+    cache = build_cache(connection_string)
+    cache.embed_documents(["alpha"])
+
+    vectors = asyncio.run(cache.aembed_documents(["alpha", "delta"]))
+
+    assert cache.underlying_embeddings.embedded_texts == ["alpha", "delta"]
+    assert vectors == [[5.0, 0.5, -1.25], [5.0, 0.5, -1.25]]
+
+
+def test_least_recently_used_embeddings_are_evicted(connection_string: str) -> None:
+    """
+    Each fake vector takes 24 bytes; with room for two vectors, caching a
+    third should evict the least recently used one.
+    """
+    cache = build_cache(connection_string, max_bytes=48)
+    cache.embed_documents(["alpha"])
+    cache.embed_documents(["beta"])
+    cache.embed_documents(["alpha"])
+    cache.embed_documents(["gamma"])
+    cache.underlying_embeddings.embedded_texts.clear()
+
+    cache.embed_documents(["alpha", "beta", "gamma"])
+
+    assert cache.underlying_embeddings.embedded_texts == ["beta"]
+
+
+def test_storing_already_cached_keys_keeps_the_rest_of_the_batch(connection_string: str) -> None:
+    """
+    When another worker cached some of the same chunks concurrently, the
+    other embeddings of the batch should still be stored.
+    """
+    cache = build_cache(connection_string)
+    other_worker_cache = build_cache(connection_string)
+    other_worker_cache.embed_documents(["alpha"])
+
+    cache._store({cache._get_key("alpha"): [1.0], cache._get_key("beta"): [2.0]})
+
+    assert cache._lookup([cache._get_key("alpha"), cache._get_key("beta")]) == {
+        cache._get_key("alpha"): [5.0, 0.5, -1.25],
+        cache._get_key("beta"): [2.0],
+    }
+
+
+def test_cache_size_is_only_summed_up_when_it_may_be_too_large(connection_string: str) -> None:
+    cache = build_cache(connection_string, max_bytes=72)
+    size_queries = []
+    engine = get_engine(connection_string)
+
+    def count_size_queries(_conn, _cursor, statement, *_args) -> None:
+        if "sum(" in statement.lower():
+            size_queries.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count_size_queries)
+    try:
+        for text in ("alpha", "beta", "gamma"):
+            cache.embed_documents([text])
+        assert len(size_queries) == 1
+        cache.embed_documents(["delta"])
+    finally:
+        event.remove(engine, "before_cursor_execute", count_size_queries)
+
+    assert len(size_queries) == 2
+    cache.underlying_embeddings.embedded_texts.clear()
+    cache.embed_documents(["alpha", "delta"])
+    assert cache.underlying_embeddings.embedded_texts == ["alpha"]
+
+
+def test_embedding_factory_wraps_embeddings_in_cache(monkeypatch, connection_string: str) -> None:
+    monkeypatch.setenv("OPENAI_API_KEY", "test-api-key")
+    monkeypatch.setenv("EMBEDDING_CACHE_CONNECTION_STRING", connection_string)
+    embedding_factory = EmbeddingFactory(vendor_name="openai", embedding_model_name="gpt-3")
+
+    cached_embeddings = embedding_factory.create()
+
+    assert isinstance(cached_embeddings, CachedEmbeddings)
+    assert cached_embeddings.model_name == "gpt-3"
+    assert not isinstance(embedding_factory.create(use_cache=False), CachedEmbeddings)
@@ -0,0 +1,237 @@
+import asyncio
+import socket
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from langchain_core.documents import Document
+
+from server_modules.ingestion import (
+    IngestionPipeline,
+    IngestionSettings,
+    get_process_pool,
+    hash_chunk,
+    load_and_split_file,
+    shutdown_process_pool,
+)
+
+
+@pytest.fixture(name="split_documents")
+def split_documents_fixture():
+    """
+    Patches file parsing so that every file is "split" into chunks named after
+    the file, without needing real documents on disk.
+    """
+    chunk_counts = {"a.pdf": 5, "b.pdf": 2}
+
+    def fake_load_and_split_file(file_name: str, _file_path: Path) -> list[Document]:
+        return [
+            Document(page_content=f"{file_name}-{i}", metadata={"source": file_name, "page": i})
+            for i in range(chunk_counts[file_name])
+        ]
+
+    with patch("server_modules.ingestion.load_and_split_file", side_effect=fake_load_and_split_file):
+        yield chunk_counts
+
+
+@pytest.fixture(name="pipeline")
+def pipeline_fixture():
+    """
+    An ingestion pipeline over a fake embedding function and vector database
+    that track how many batches are being processed at the same time.
+    """
+    in_flight = {"current": 0, "max": 0}
+
+    async def fake_aembed_documents(texts: list[str]) -> list[list[float]]:
+        in_flight["current"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["current"])
+        await asyncio.sleep(0.01)
+        in_flight["current"] -= 1
+        return [[float(len(text))] for text in texts]
+
+    async def fake_add_embedded_documents(documents, embeddings) -> list[str]:
+        assert len(documents) == len(embeddings)
+        return [f"id-{document.page_content}" for document in documents]
+
+    embedding_fn = MagicMock()
+    embedding_fn.aembed_documents = AsyncMock(side_effect=fake_aembed_documents)
+    vector_db = MagicMock()
+    vector_db.add_embedded_documents = AsyncMock(side_effect=fake_add_embedded_documents)
+    vector_db.update_document_metadata = AsyncMock()
+    vector_db.flush = AsyncMock()
+    settings = IngestionSettings(parse_workers=0, batch_size=2, max_in_flight_batches=2)
+    yield IngestionPipeline(vector_db, embedding_fn, settings), in_flight
+
+
+def test_pipeline_returns_document_ids_per_file_in_chunk_order(split_documents, pipeline):
+    ingestion_pipeline, _ = pipeline
+
+    file_id_mapping = asyncio.run(
+        ingestion_pipeline.run({"a.pdf": Path("/tmp/a.pdf"), "b.pdf": Path("/tmp/b.pdf")})
+    )
+
+    assert list(file_id_mapping) == ["a.pdf", "b.pdf"]
+    assert file_id_mapping["a.pdf"].document_ids == [f"id-a.pdf-{i}" for i in range(5)]
+    assert file_id_mapping["b.pdf"].document_ids == ["id-b.pdf-0", "id-b.pdf-1"]
+    assert file_id_mapping["b.pdf"].chunk_hashes == [
+        hash_chunk(Document(page_content="b.pdf-0")),
+        hash_chunk(Document(page_content="b.pdf-1")),
+    ]
+    ingestion_pipeline.vector_db.flush.assert_awaited_once()
+
+
+def test_pipeline_embeds_and_writes_in_bounded_batches(split_documents, pipeline):
+    """
+    Chunks should be embedded and written in batches of `batch_size`, with at
+    most `max_in_flight_batches` batches in flight at any time.
+    """
+    ingestion_pipeline, in_flight = pipeline
+
+    asyncio.run(ingestion_pipeline.run({"a.pdf": Path("/tmp/a.pdf"), "b.pdf": Path("/tmp/b.pdf")}))
+
+    batch_sizes = sorted(len(call.args[0]) for call in ingestion_pipeline.vector_db.add_embedded_documents.call_args_list)
+    assert batch_sizes == [1, 2, 2, 2]
+    assert in_flight["max"] == 2
+
+
+def test_pipeline_reports_progress(split_documents, pipeline, tmp_path):
+    ingestion_pipeline, _ = pipeline
+    progress_updates = []
+    ingestion_pipeline.on_progress = progress_updates.append
+    file_path = tmp_path / "a.pdf"
+    file_path.write_bytes(b"x" * 1000)
+
+    asyncio.run(ingestion_pipeline.run({"a.pdf": file_path, "b.pdf": tmp_path / "missing.pdf"}))
+
+    final_progress = progress_updates[-1]
+    assert (final_progress.files_total, final_progress.files_parsed) == (2, 2)
+    assert final_progress.chunks_produced == final_progress.chunks_embedded == final_progress.chunks_written == 7
+    assert final_progress.bytes_total == final_progress.bytes_processed == 1000
+    bytes_processed = [progress.bytes_processed for progress in progress_updates]
+    assert bytes_processed == sorted(bytes_processed)
+
+
+def test_incremental_pipeline_only_embeds_new_chunks(split_documents, pipeline):
+    """
+    Chunks whose hash matches a chunk of the previous revision should keep
+    their document ID (with refreshed metadata) instead of being embedded.
+    """
+    ingestion_pipeline, _ = pipeline
+    existing_chunks = {
+        "a.pdf": {
+            hash_chunk(Document(page_content="a.pdf-1")): ["old-1"],
+            hash_chunk(Document(page_content="a.pdf-3")): ["old-3"],
+            hash_chunk(Document(page_content="vanished")): ["old-vanished"],
+        }
+    }
+
+    ingested_files = asyncio.run(ingestion_pipeline.run({"a.pdf": Path("/tmp/a.pdf")}, existing_chunks))
+
+    assert ingested_files["a.pdf"].document_ids == ["id-a.pdf-0", "old-1", "id-a.pdf-2", "old-3", "id-a.pdf-4"]
+    embedded_texts = sorted(
+        text for call in ingestion_pipeline.embedding_fn.aembed_documents.call_args_list for text in call.args[0]
+    )
+    assert embedded_texts == ["a.pdf-0", "a.pdf-2", "a.pdf-4"]
+    ingestion_pipeline.vector_db.update_document_metadata.assert_awaited_once_with(
+        ["old-1", "old-3"], [{"source": "a.pdf", "page": 1}, {"source": "a.pdf", "page": 3}]
+    )
+
+
+def test_non_incremental_pipeline_embeds_all_chunks(split_documents, pipeline):
+    ingestion_pipeline, _ = pipeline
+    ingestion_pipeline.settings.incremental = False
+    existing_chunks = {"a.pdf": {hash_chunk(Document(page_content="a.pdf-1")): ["old-1"]}}
+
+    ingested_files = asyncio.run(ingestion_pipeline.run({"a.pdf": Path("/tmp/a.pdf")}, existing_chunks))
+
+    assert ingested_files["a.pdf"].document_ids == [f"id-a.pdf-{i}" for i in range(5)]
+
+
+MINIMAL_PDF_OBJECTS = [
+    b"<< /Type /Catalog /Pages 2 0 R >>",
+    b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+    b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 200 200] /Contents 4 0 R "
+    b"/Resources << /Font << /F1 5 0 R >> >> >>",
+    b"<< /Length 44 >>\nstream\nBT /F1 12 Tf 20 100 Td (Artikel 7:658) Tj ET\nendstream",
+    b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+]
+
+
+def write_minimal_pdf(file_path: Path) -> None:
+    """
+    Write a one-page PDF containing the text "Artikel 7:658".
+    """
+    content = b"%PDF-1.4\n"
+    offsets = []
+    for number, pdf_object in enumerate(MINIMAL_PDF_OBJECTS, start=1):
+        offsets.append(len(content))
+        content += f"{number} 0 obj\n".encode() + pdf_object + b"\nendobj\n"
+    xref_offset = len(content)
+    content += f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode()
+    content += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    content += f"trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    file_path.write_bytes(content)
+
+
+@pytest.fixture(name="pdf_file")
+def pdf_file_fixture(tmp_path):
+    write_minimal_pdf(tmp_path / "a.pdf")
+    return tmp_path / "a.pdf"
+
+
+def test_files_are_split_in_a_real_worker_process(pdf_file):
+    try:
+        documents = get_process_pool(1).submit(load_and_split_file, "a.pdf", pdf_file).result(timeout=120)
+    finally:
+        shutdown_process_pool()
+
+    assert [document.page_content for document in documents] == ["Artikel 7:658"]
+
+
+def test_worker_processes_do_not_listen_on_the_debugger_port_again(pdf_file, tmp_path):
+    """
+    Spawned workers re-import the server's main module. A main module that
+    listens on a port at import time, guarded like `app.py`, should not make
+    the workers fail with "Address already in use".
+    """
+    main_module = tmp_path / "main.py"
+    main_module.write_text(
+        textwrap.dedent(
+            """
+            import os
+            import socket
+            import sys
+            from pathlib import Path
+
+            if not os.environ.get("DEBUGPY_LISTENING"):
+                listener = socket.create_server(("127.0.0.1", int(os.environ["LISTEN_PORT"])))
+                os.environ["DEBUGPY_LISTENING"] = "1"
+
+            from server_modules.ingestion import get_process_pool, load_and_split_file, shutdown_process_pool
+
+            if __name__ == "__main__":
+                documents = get_process_pool(1).submit(load_and_split_file, "a.pdf", Path(sys.argv[1])).result()
+                shutdown_process_pool()
+                print(documents[0].page_content)
+            """
+        )
+    )
+    with socket.socket() as free_port_socket:
+        free_port_socket.bind(("127.0.0.1", 0))
+        listen_port = free_port_socket.getsockname()[1]
+
+    result = subprocess.run(
+        [sys.executable, str(main_module), str(pdf_file)],
+        cwd=Path(__file__).parent.parent,
+        env={"PYTHONPATH": str(Path(__file__).parent.parent), "LISTEN_PORT": str(listen_port)},
+        capture_output=True,
+        text=True,
+        timeout=120,
+        check=False,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "Artikel 7:658"
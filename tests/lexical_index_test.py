@@ -0,0 +1,96 @@
+import pytest
+
+from chatdoc.lexical_index import LexicalIndex, is_identifier_query, reciprocal_rank_fusion, tokenize
+
+
+@pytest.fixture(name="lexical_index")
+def lexical_index_fixture(tmp_path):
+    """
+    An index of a few chunks that is persisted to a temporary directory.
+    """
+    index = LexicalIndex("test", tmp_path / "test.json")
+    index.add_documents(
+        ["art-658", "art-611", "intro"],
+        [
+            "Artikel 7:658 BW regelt de zorgplicht van de werkgever.",
+            "Artikel 7:611 BW regelt het goed werkgeverschap van de werkgever.",
+            "Dit document bespreekt het arbeidsrecht.",
+        ],
+    )
+    return index
+
+
+def test_tokenize_keeps_identifiers_and_their_parts():
+    assert tokenize("Zie art. 7:658 BW") == ["zie", "art", "7:658", "7", "658", "bw"]
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [("7:658", True), ("C-123/45?", True), ("7:658 7:611", True), ("Wat regelt artikel 7:658?", False), ("", False)],
+)
+def test_is_identifier_query(query, expected):
+    assert is_identifier_query(query) == expected
+
+
+def test_search_ranks_exact_identifier_matches_first(lexical_index):
+    results = lexical_index.search("7:658", k=3)
+
+    assert [document_id for document_id, _ in results] == ["art-658", "art-611"]
+    assert results[0][1] > 2 * results[1][1]
+    assert lexical_index.search("werkgever", k=3)[0][0] in {"art-658", "art-611"}
+    assert lexical_index.search("onbekend", k=3) == []
+
+
+def test_removed_documents_are_no_longer_found(lexical_index):
+    lexical_index.remove_documents(["art-658"])
+
+    assert [document_id for document_id, _ in lexical_index.search("7:658", k=3)] == ["art-611"]
+    assert len(lexical_index) == 2
+
+
+def test_index_is_persisted_and_loaded(lexical_index, tmp_path, monkeypatch):
+    lexical_index.save()
+    monkeypatch.setenv("LEXICAL_INDEX_DIRECTORY", str(tmp_path))
+
+    loaded_index = LexicalIndex.load("test")
+
+    assert len(loaded_index) == 3
+    assert loaded_index.search("7:611", k=3) == lexical_index.search("7:611", k=3)
+
+
+def test_missing_index_is_rebuilt_from_the_stored_documents(tmp_path, monkeypatch):
+    monkeypatch.setenv("LEXICAL_INDEX_DIRECTORY", str(tmp_path))
+    pages = [(["art-658", "art-611"], ["Artikel 7:658 BW", "Artikel 7:611 BW"]), (["intro"], ["Arbeidsrecht"])]
+
+    rebuilt_index = LexicalIndex.load("test", lambda: iter(pages))
+
+    assert len(rebuilt_index) == 3
+    assert rebuilt_index.search("7:658", k=3)[0][0] == "art-658"
+    assert len(LexicalIndex.load("test", lambda: iter([]))) == 3
+
+
+def test_truncated_index_is_rebuilt_from_the_stored_documents(lexical_index, tmp_path, monkeypatch):
+    monkeypatch.setenv("LEXICAL_INDEX_DIRECTORY", str(tmp_path))
+    lexical_index.save()
+    (tmp_path / "test.json").write_text((tmp_path / "test.json").read_text()[:40])
+    pages = [(["art-658"], ["Artikel 7:658 BW"])]
+
+    rebuilt_index = LexicalIndex.load("test", lambda: iter(pages))
+
+    assert len(rebuilt_index) == 1
+    assert len(LexicalIndex.load("test")) == 1
+
+
+def test_save_replaces_the_index_file_without_leaving_temporary_files(lexical_index, tmp_path):
+    lexical_index.save()
+    lexical_index.remove_documents(["intro"])
+    lexical_index.save()
+
+    assert [path.name for path in tmp_path.iterdir()] == ["test.json"]
+
+def test_reciprocal_rank_fusion_rewards_documents_found_by_both_rankings():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "d"]], rrf_k=60)
+
+    assert [document_id for document_id, _ in fused] == ["c", "a", "b", "d"]
+    assert fused[0][1] == pytest.approx(1 / 63 + 1 / 61)
+
@@ -0,0 +1,113 @@
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from chatdoc.reranker import CrossEncoderReranker
+from chatdoc.vector_db import CustomVectorStoreRetriever
+
+
+class FakeCrossEncoder:
+    """
+    Scores a question/chunk pair by the number of question words in the chunk,
+    optionally taking some time per batch.
+    """
+
+    def __init__(self, seconds_per_batch: float = 0.0) -> None:
+        self.seconds_per_batch = seconds_per_batch
+        self.batches: list[int] = []
+
+    def predict(self, pairs: list[tuple[str, str]]) -> list[float]:
+        self.batches.append(len(pairs))
+        time.sleep(self.seconds_per_batch)
+        return [float(len(set(query.split()) & set(text.split()))) for query, text in pairs]
+
+
+@pytest.fixture(name="fake_model")
+def fake_model_fixture(monkeypatch):
+    """
+    Registers a fake cross-encoder as the loaded model of `fake-model`.
+    """
+    model = FakeCrossEncoder()
+    monkeypatch.setattr(CrossEncoderReranker, "_models", {"fake-model": model})
+    return model
+
+
+def build_documents() -> list[Document]:
+    return [
+        Document(page_content="nothing relevant"),
+        Document(page_content="duty of care"),
+        Document(page_content="the duty of care of the employer"),
+        Document(page_content="care"),
+    ]
+
+
+def test_rerank_orders_by_score_and_truncates_to_k(fake_model):
+    reranker = CrossEncoderReranker("fake-model", batch_size=3)
+
+    docs = reranker.rerank("duty of care of the employer", build_documents(), k=2)
+
+    assert [doc.page_content for doc in docs] == ["the duty of care of the employer", "duty of care"]
+    assert [doc.metadata["score"] for doc in docs] == [5.0, 3.0]
+    assert fake_model.batches == [3, 1]
+
+
+def test_rerank_keeps_retrieval_order_when_the_time_budget_runs_out(fake_model):
+    fake_model.seconds_per_batch = 0.05
+    reranker = CrossEncoderReranker("fake-model", batch_size=1, time_budget_seconds=0.01)
+
+    docs = reranker.rerank("duty of care", build_documents(), k=2)
+
+    assert [doc.page_content for doc in docs] == ["nothing relevant", "duty of care"]
+    assert "score" not in docs[0].metadata
+    assert len(fake_model.batches) < 4
+
+
+def test_rerank_keeps_retrieval_order_when_the_model_cannot_be_loaded(monkeypatch):
+    monkeypatch.setattr(CrossEncoderReranker, "_models", {})
+    reranker = CrossEncoderReranker("missing-model")
+    reranker._load_model = MagicMock(side_effect=ImportError("No module named 'sentence_transformers'"))
+
+    docs = reranker.rerank("duty of care", build_documents(), k=2)
+
+    assert [doc.page_content for doc in docs] == ["nothing relevant", "duty of care"]
+
+
+def test_from_env_loads_the_model_from_the_embedding_model_folder(monkeypatch):
+    monkeypatch.delenv("RERANKER_MODEL_NAME", raising=False)
+    assert CrossEncoderReranker.from_env() is None
+
+    monkeypatch.setenv("RERANKER_MODEL_NAME", "ms-marco-MiniLM-L-6-v2")
+    monkeypatch.setenv("EMBEDDING_MODEL_FOLDER_PATH", "/models/embedding")
+    monkeypatch.setenv("RERANKER_TIME_BUDGET_SECONDS", "0.25")
+    reranker = CrossEncoderReranker.from_env()
+
+    assert reranker is not None
+    assert reranker.model_path == "/models/embedding/ms-marco-MiniLM-L-6-v2"
+    assert reranker.time_budget_seconds == 0.25
+
+
+def test_retriever_reranks_fetch_k_candidates(fake_model):
+    """
+    With a re-ranker, the retriever should fetch `fetch_k` candidates and
+    return the best `k` of them, ranked by the re-ranker.
+    """
+    vectorstore = MagicMock(spec=VectorStore)
+    vectorstore.embeddings = MagicMock()
+    vectorstore.embeddings.embed_query.return_value = [0.1, 0.2]
+    vectorstore.similarity_search_by_vector.return_value = build_documents()
+    retriever = CustomVectorStoreRetriever(
+        vectorstore=vectorstore,
+        reranker=CrossEncoderReranker("fake-model"),
+        search_type="similarity",
+        search_kwargs={"k": 2, "score_threshold": 0.8, "fetch_k": 4, "lambda_mult": 0.2},
+    )
+
+    docs = retriever.get_relevant_documents("duty of care of the employer")
+
+    vectorstore.similarity_search_by_vector.assert_called_once_with([0.1, 0.2], k=4, filter=None)
+    assert [doc.page_content for doc in docs] == ["the duty of care of the employer", "duty of care"]
+    assert [doc.metadata["ranking"] for doc in docs] == [1, 2]
+    assert fake_model.batches == [4]
@@ -0,0 +1,139 @@
+import asyncio
+import base64
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from server_modules.ingestion import IngestedFile
+from server_modules.methods import (
+    DocumentMethods,
+    ServerMethods,
+    create_tmp_dir,
+    decode_base64_to_file,
+    delete_tmp_dir,
+)
+
+
+@pytest.mark.parametrize("chunk_size", [4, 8, 1024])
+def test_decode_base64_to_file_in_chunks(tmp_path: Path, chunk_size: int) -> None:
+    """
+    Decoding in chunks should produce the original bytes, regardless of how
+    the chunks line up with whitespace (e.g. MIME line breaks) in the data.
+    """
+    data = bytes(range(256)) * 3
+    encoded_data = base64.encodebytes(data).decode("ascii")
+    file_path = tmp_path / "file.bin"
+
+    bytes_written = decode_base64_to_file(encoded_data, file_path, chunk_size=chunk_size)
+
+    assert bytes_written == len(data)
+    assert file_path.read_bytes() == data
+
+
+def test_decode_base64_to_file_rejects_truncated_data(tmp_path: Path) -> None:
+    with pytest.raises(ValueError):
+        decode_base64_to_file(base64.b64encode(b"hello world").decode("ascii")[:-1], tmp_path / "file.bin")
+
+
+def test_save_base64_file_to_tmp_writes_to_upload_dir() -> None:
+    session_id = "test-session-save-base64"
+
+    unique_file_name, file_path = ServerMethods().save_base64_file_to_tmp(
+        "report.pdf", base64.b64encode(b"%PDF-1.4").decode("ascii"), session_id=session_id, upload_id="upload-1"
+    )
+
+    assert file_path.parent.name == "upload-1"
+    assert file_path.parent.parent.name == session_id
+    assert file_path.name == unique_file_name
+    assert file_path.read_bytes() == b"%PDF-1.4"
+    delete_tmp_dir(session_id)
+
+
+def test_save_files_to_vector_db_reuses_document_ids_of_identical_files(monkeypatch, tmp_path: Path) -> None:
+    """
+    Files whose content was already ingested in the session, or earlier in
+    the same upload, should reuse the existing document IDs instead of being
+    parsed and embedded again.
+    """
+    monkeypatch.setenv("FINAL_ANSWER_CONNECTION_STRING", f"sqlite:///{tmp_path / 'final_answer.db'}")
+    session_id = "test-session-dedup"
+    dir_path = create_tmp_dir(session_id)
+    file_dict = {}
+    for filename, content in {"a.txt": b"A", "copy-of-a.txt": b"A", "b.txt": b"B"}.items():
+        file_dict[filename] = dir_path / filename
+        file_dict[filename].write_bytes(content)
+
+    ingested_file_dicts = []
+
+    async def fake_run(new_file_dict, _existing_chunks):
+        ingested_file_dicts.append(sorted(new_file_dict))
+        return {
+            filename: IngestedFile(document_ids=[f"id-{filename}"], chunk_hashes=[f"chunk-{filename}"])
+            for filename in new_file_dict
+        }
+
+    pipeline = MagicMock()
+    pipeline.run = AsyncMock(side_effect=fake_run)
+    with (
+        patch("server_modules.methods.EmbeddingFactory"),
+        patch("server_modules.methods.VectorDatabase"),
+        patch("server_modules.methods.IngestionPipeline", return_value=pipeline),
+    ):
+        first_mapping = asyncio.run(ServerMethods().save_files_to_vector_db(dict(file_dict), user_id=session_id))
+        dir_path = create_tmp_dir(session_id)
+        (dir_path / "b-again.txt").write_bytes(b"B")
+        second_mapping = asyncio.run(
+            ServerMethods().save_files_to_vector_db({"b-again.txt": dir_path / "b-again.txt"}, user_id=session_id)
+        )
+
+    assert ingested_file_dicts == [["a.txt", "b.txt"]]
+    assert first_mapping == {"a.txt": ["id-a.txt"], "copy-of-a.txt": ["id-a.txt"], "b.txt": ["id-b.txt"]}
+    assert second_mapping == {"b-again.txt": ["id-b.txt"]}
+    logger = MagicMock()
+    assert DocumentMethods.get_document_ids(session_id=session_id, filename="b-again.txt", logger=logger) == [
+        "id-b.txt"
+    ]
+    delete_tmp_dir(session_id)
+
+
+def test_save_files_to_vector_db_replaces_previous_revision(monkeypatch, tmp_path: Path) -> None:
+    """
+    A new revision of a file should be ingested with the chunks stored for
+    the previous one, and only the chunks that vanished should be deleted.
+    """
+    monkeypatch.setenv("FINAL_ANSWER_CONNECTION_STRING", f"sqlite:///{tmp_path / 'final_answer.db'}")
+    monkeypatch.setenv("INCREMENTAL_INGESTION", "true")
+    session_id = "test-session-revision"
+    revisions = iter(
+        [
+            IngestedFile(document_ids=["doc-1", "doc-2"], chunk_hashes=["chunk-1", "chunk-2"]),
+            IngestedFile(document_ids=["doc-1", "doc-3"], chunk_hashes=["chunk-1", "chunk-3"]),
+        ]
+    )
+    existing_chunks_seen = []
+
+    async def fake_run(new_file_dict, existing_chunks):
+        existing_chunks_seen.append(existing_chunks)
+        return {filename: next(revisions) for filename in new_file_dict}
+
+    pipeline = MagicMock()
+    pipeline.run = AsyncMock(side_effect=fake_run)
+    vector_db = MagicMock()
+    vector_db.delete_documents = AsyncMock(return_value=True)
+    with (
+        patch("server_modules.methods.EmbeddingFactory"),
+        patch("server_modules.methods.VectorDatabase", return_value=vector_db),
+        patch("server_modules.methods.IngestionPipeline", return_value=pipeline),
+    ):
+        for content in (b"revision 1", b"revision 2"):
+            file_path = create_tmp_dir(session_id) / "rules.pdf"
+            file_path.write_bytes(content)
+            file_id_mapping = asyncio.run(
+                ServerMethods().save_files_to_vector_db({"rules.pdf": file_path}, user_id=session_id)
+            )
+
+    assert existing_chunks_seen == [{"rules.pdf": {}}, {"rules.pdf": {"chunk-1": ["doc-1"], "chunk-2": ["doc-2"]}}]
+    assert file_id_mapping == {"rules.pdf": ["doc-1", "doc-3"]}
+    vector_db.delete_documents.assert_awaited_once_with(["doc-2"])
+    delete_tmp_dir(session_id)
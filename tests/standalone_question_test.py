@@ -0,0 +1,36 @@
+import pytest
+
+from chatdoc.standalone_question import is_self_contained
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "What does article 7:658 say about the duty of care of employers?",
+        "Which documents describe the notice period for permanent contracts?",
+        "Wat zegt artikel 7:658 over de zorgplicht van werkgevers?",
+        "Welke opzegtermijn geldt voor een vast contract?",
+    ],
+)
+def test_questions_without_references_are_self_contained(question):
+    assert is_self_contained(question)
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "Why?",
+        "And the notice period?",
+        "What about fixed-term contracts?",
+        "En voor tijdelijke contracten?",
+        "What does it say about employers?",
+        "Can you explain that in more detail?",
+        "What did the previous answer mean by this?",
+        "Wat betekent dit voor werkgevers?",
+        "Kun je daar meer over vertellen?",
+        "Wat staat daarover in de wet?",
+        "Geldt ook een opzegtermijn?",
+    ],
+)
+def test_follow_up_questions_are_not_self_contained(question):
+    assert not is_self_contained(question)
@@ -0,0 +1,91 @@
+from chatdoc.ttl_cache import TTLCache
+
+
+class FakeClock:
+    """
+    A manually advanced clock so expiry can be tested without sleeping.
+    """
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_get_returns_stored_value_and_counts_hits():
+    cache: TTLCache[str, int] = TTLCache(max_size=2)
+    cache.put("a", 1)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 1, "max_size": 2}
+
+
+def test_least_recently_used_entry_is_evicted():
+    evicted = []
+    cache: TTLCache[str, int] = TTLCache(max_size=2, on_evict=lambda key, _: evicted.append(key))
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert evicted == ["b"]
+    assert "a" in cache and "c" in cache
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache: TTLCache[str, int] = TTLCache(max_size=2, ttl_seconds=10, clock=clock)
+    cache.put("a", 1)
+
+    clock.now = 5
+    assert cache.get("a") == 1
+    clock.now = 14
+    assert cache.get("a") == 1
+    clock.now = 30
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_get_or_create_builds_only_on_miss():
+    cache: TTLCache[str, object] = TTLCache(max_size=2)
+    calls = []
+
+    def factory() -> object:
+        calls.append(1)
+        return object()
+
+    first = cache.get_or_create("a", factory)
+    second = cache.get_or_create("a", factory)
+
+    assert first is second
+    assert len(calls) == 1
+
+
+def test_remove_where_evicts_matching_keys():
+    cache: TTLCache[tuple[str, str], int] = TTLCache(max_size=4)
+    cache.put(("s1", "x"), 1)
+    cache.put(("s1", "y"), 2)
+    cache.put(("s2", "x"), 3)
+
+    assert cache.remove_where(lambda key: key[0] == "s1") == 2
+    assert len(cache) == 1
+
+
+def test_zero_max_size_disables_caching():
+    cache: TTLCache[str, int] = TTLCache(max_size=0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+
+
+def test_items_skips_expired_entries_without_touching_them():
+    clock = FakeClock()
+    cache: TTLCache[str, int] = TTLCache(max_size=3, ttl_seconds=10, clock=clock)
+    cache.put("a", 1)
+    clock.now = 6
+    cache.put("b", 2)
+    clock.now = 12
+
+    assert cache.items() == [("b", 2)]
+    assert cache.stats()["hits"] == 0
@@ -0,0 +1,86 @@
+import threading
+import time
+
+from server_modules.ingestion import IngestionProgress
+from server_modules.upload_jobs import UploadJobRegistry, UploadJobState
+
+
+def test_job_lifecycle_notifies_subscribers() -> None:
+    registry = UploadJobRegistry()
+    states = []
+    unsubscribe = registry.subscribe(lambda job: states.append(job.state))
+
+    job_id = registry.create("session", files_total=2).job_id
+    registry.mark_processing("session", job_id)
+    registry.mark_completed("session", job_id, {"message": "", "error": "", "fileIdMapping": []})
+    unsubscribe()
+    registry.mark_failed("session", job_id, "ignored")
+
+    assert states == [UploadJobState.PENDING, UploadJobState.PROCESSING, UploadJobState.COMPLETED]
+
+
+def test_updates_of_a_replaced_job_are_ignored() -> None:
+    registry = UploadJobRegistry()
+    states = []
+    replaced_job_id = registry.create("session", files_total=1).job_id
+    current_job = registry.create("session", files_total=2)
+    registry.subscribe(lambda job: states.append(job.state))
+
+    assert registry.mark_processing("session", replaced_job_id) is None
+    assert registry.update_progress("session", replaced_job_id, IngestionProgress(files_total=1)) is None
+    assert registry.mark_failed("session", replaced_job_id, "boom") is None
+    assert registry.mark_failed("unknown", replaced_job_id, "boom") is None
+
+    assert registry.get("session") is current_job
+    assert current_job.state == UploadJobState.PENDING
+    assert current_job.progress.files_total == 2
+    assert not states
+
+
+def test_wait_returns_when_job_is_done() -> None:
+    registry = UploadJobRegistry()
+    job_id = registry.create("session", files_total=1).job_id
+    failer = threading.Timer(0.05, registry.mark_failed, ("session", job_id, "boom"))
+    failer.start()
+
+    job = registry.wait("session", timeout=5)
+    failer.join()
+
+    assert job is not None and job.state == UploadJobState.FAILED
+    assert job.error == "boom"
+
+
+def test_wait_times_out_on_unfinished_job_and_ignores_unknown_sessions() -> None:
+    registry = UploadJobRegistry()
+    registry.create("session", files_total=1)
+
+    assert registry.wait("session", timeout=0.01).state == UploadJobState.PENDING
+    assert registry.wait("unknown", timeout=5) is None
+
+
+def test_finished_jobs_expire() -> None:
+    registry = UploadJobRegistry(ttl_seconds=0)
+    job_id = registry.create("old", files_total=1).job_id
+    registry.mark_completed("old", job_id, {"message": "", "error": "", "fileIdMapping": []})
+
+    registry.create("new", files_total=1)
+
+    assert registry.get("old") is None
+    assert registry.get("new") is not None
+
+
+def test_progress_updates_are_throttled_and_estimate_eta() -> None:
+    registry = UploadJobRegistry(progress_interval_seconds=60)
+    progress_updates = []
+    registry.subscribe(lambda job: progress_updates.append(job.progress.chunks_written))
+    job_id = registry.create("session", files_total=1).job_id
+    job = registry.mark_processing("session", job_id)
+    job.started_at = time.time() - 10
+
+    registry.update_progress(
+        "session", job_id, IngestionProgress(files_total=1, chunks_written=4, bytes_total=100, bytes_processed=25)
+    )
+
+    assert progress_updates == [0, 0]
+    assert registry.get("session").progress.chunks_written == 4
+    assert 29 <= job.get_progress()["etaSeconds"] <= 31
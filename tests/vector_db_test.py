@@ -1,9 +1,42 @@
-from unittest.mock import patch, MagicMock
+import asyncio
+import threading
+import time
+from unittest.mock import AsyncMock, patch, MagicMock
 
+import numpy as np
 import pytest
+from langchain_community.vectorstores.utils import maximal_marginal_relevance as langchain_maximal_marginal_relevance
+from langchain_core.documents import Document
 from langchain_core.vectorstores import VectorStore
 
-from chatdoc.vector_db import VectorDatabase
+from chatdoc.answer_cache import AnswerCache
+from chatdoc.embed.query_embedding_cache import QueryEmbeddingCache
+from chatdoc.lexical_index import LexicalIndex
+from chatdoc.prompt_mode import PromptMode
+from chatdoc.vector_db import (
+    ChromaClientRegistry,
+    ChromaWriteBuffer,
+    CustomVectorStoreRetriever,
+    VectorDatabase,
+    maximal_marginal_relevance,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_chroma_client_registry(tmp_path, monkeypatch):
+    """
+    Ensures every test starts (and ends) without cached ChromaDB clients, so
+    that patched client classes are actually called, and without cached
+    lexical indexes (which are persisted to a temporary directory) or answers.
+    """
+    monkeypatch.setenv("LEXICAL_INDEX_DIRECTORY", str(tmp_path))
+    ChromaClientRegistry.reset()
+    LexicalIndex.reset_shared_indexes()
+    AnswerCache.reset_shared_cache()
+    yield
+    ChromaClientRegistry.reset()
+    LexicalIndex.reset_shared_indexes()
+    AnswerCache.reset_shared_cache()
 
 
 @pytest.fixture(name="mock_embedding_fn")
@@ -85,3 +118,431 @@ def test_chroma_client_invalid_env_raises(mock_embedding_fn, monkeypatch):
     monkeypatch.setenv("CURRENT_ENV", "INVALID")
     with pytest.raises(ValueError):
         VectorDatabase(collection_name="test", embedding_fn=mock_embedding_fn)
+
+
+@patch("chatdoc.vector_db.Chroma")
+@patch("chatdoc.vector_db.PersistentClient")
+def test_chroma_client_is_shared_between_vector_databases(
+    mock_persistent_client, mock_chroma, mock_embedding_fn, monkeypatch
+):
+    """
+    Every `VectorDatabase` should reuse the same client instead of opening a
+    new one per request.
+    """
+    monkeypatch.setenv("CURRENT_ENV", "DEV")
+    mock_chroma.return_value = MagicMock(spec=VectorStore)
+
+    first = VectorDatabase(collection_name="first", embedding_fn=mock_embedding_fn)
+    second = VectorDatabase(collection_name="second", embedding_fn=mock_embedding_fn)
+
+    assert first.chroma_client is second.chroma_client
+    mock_persistent_client.assert_called_once()
+
+
+@patch("chatdoc.vector_db.PersistentClient")
+def test_collection_handles_are_cached(mock_persistent_client, monkeypatch):
+    """
+    A collection should only be looked up on the server the first time it is used.
+    """
+    monkeypatch.setenv("CURRENT_ENV", "DEV")
+    client = mock_persistent_client.return_value
+
+    first = ChromaClientRegistry.get_collection("test")
+    second = ChromaClientRegistry.get_collection("test")
+
+    assert first is second is client.get_or_create_collection.return_value
+    client.get_or_create_collection.assert_called_once_with(name="test", embedding_function=None, metadata=None)
+
+
+@patch("chatdoc.vector_db.HttpClient")
+def test_unhealthy_client_is_replaced(mock_http_client, monkeypatch):
+    """
+    A cached client that fails its heartbeat should be replaced by a new one,
+    together with its collection handles.
+    """
+    monkeypatch.setenv("CURRENT_ENV", "PROD")
+    monkeypatch.setenv("CHROMA_HEARTBEAT_INTERVAL_SECONDS", "0")
+    unhealthy_client, healthy_client = MagicMock(), MagicMock()
+    unhealthy_client.heartbeat.side_effect = ConnectionError("Chroma server is down")
+    mock_http_client.side_effect = [unhealthy_client, healthy_client]
+
+    assert ChromaClientRegistry.get_collection("test") is unhealthy_client.get_or_create_collection.return_value
+    assert ChromaClientRegistry.get_collection("test") is healthy_client.get_or_create_collection.return_value
+    assert ChromaClientRegistry.get_client() is healthy_client
+    assert mock_http_client.call_count == 2
+
+
+@pytest.fixture(name="mock_collection")
+def mock_collection_fixture(monkeypatch):
+    """
+    Patches the ChromaDB client so that every collection handle is the same mock collection.
+    """
+    monkeypatch.setenv("CURRENT_ENV", "DEV")
+    with patch("chatdoc.vector_db.PersistentClient") as mock_persistent_client:
+        yield mock_persistent_client.return_value.get_or_create_collection.return_value
+
+
+def test_write_buffer_writes_once_full(mock_collection):
+    """
+    Buffered documents should be upserted together once the buffer is full,
+    with documents without metadata written separately.
+    """
+    write_buffer = ChromaWriteBuffer("test", max_size=3, flush_interval=0)
+
+    write_buffer.add(
+        ["1", "2"], [Document(page_content="a", metadata={"page": 1}), Document(page_content="b")], [[1.0], [2.0]]
+    )
+    mock_collection.upsert.assert_not_called()
+    write_buffer.add(["3"], [Document(page_content="c", metadata={"page": 3})], [[3.0]])
+
+    assert len(write_buffer) == 0
+    assert mock_collection.upsert.call_count == 2
+    mock_collection.upsert.assert_any_call(
+        ids=["1", "3"], embeddings=[[1.0], [3.0]], documents=["a", "c"], metadatas=[{"page": 1}, {"page": 3}]
+    )
+    mock_collection.upsert.assert_any_call(ids=["2"], embeddings=[[2.0]], documents=["b"], metadatas=None)
+
+
+def test_write_buffer_flushes_after_interval(mock_collection):
+    """
+    Pending documents should be written in the background after the flush interval.
+    """
+    write_buffer = ChromaWriteBuffer("test", max_size=100, flush_interval=0.01)
+
+    write_buffer.add(["1"], [Document(page_content="a")], [[1.0]])
+    deadline = time.monotonic() + 5
+    while len(write_buffer) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    mock_collection.upsert.assert_called_once_with(ids=["1"], embeddings=[[1.0]], documents=["a"], metadatas=None)
+
+
+def test_failed_background_flush_keeps_the_documents_for_the_next_flush(mock_collection):
+    """
+    Documents a timed flush failed to write should stay buffered, so that the
+    next flush retries them, and raises if writing fails again.
+    """
+    mock_collection.upsert.side_effect = RuntimeError("disk full")
+    write_buffer = ChromaWriteBuffer("test", max_size=100, flush_interval=0.01)
+
+    write_buffer.add(["1"], [Document(page_content="a")], [[1.0]])
+    deadline = time.monotonic() + 5
+    while not mock_collection.upsert.called and time.monotonic() < deadline:
+        time.sleep(0.01)
+    write_buffer.flush_interval = 0
+    write_buffer.add(["2"], [Document(page_content="b")], [[2.0]])
+
+    with pytest.raises(RuntimeError):
+        write_buffer.flush()
+    assert len(write_buffer) == 2
+
+    mock_collection.upsert.side_effect = None
+    write_buffer.flush()
+
+    assert len(write_buffer) == 0
+    mock_collection.upsert.assert_called_with(
+        ids=["1", "2"], embeddings=[[1.0], [2.0]], documents=["a", "b"], metadatas=None
+    )
+
+
+@patch("chatdoc.vector_db.Chroma")
+def test_pending_writes_are_flushed_before_deleting(mock_chroma, mock_collection, mock_embedding_fn, monkeypatch):
+    """
+    Deleting documents should first write the documents that are still
+    buffered, so that they cannot reappear after the deletion.
+    """
+    monkeypatch.setenv("CHROMA_WRITE_BUFFER_FLUSH_INTERVAL_SECONDS", "0")
+    mock_chroma.return_value = MagicMock(spec=VectorStore)
+    mock_chroma.return_value.delete.side_effect = lambda _ids: mock_collection.upsert.assert_called_once()
+    vector_db = VectorDatabase(collection_name="test", embedding_fn=mock_embedding_fn)
+
+    document_ids = asyncio.run(vector_db.add_embedded_documents([Document(page_content="a")], [[1.0]]))
+    mock_collection.upsert.assert_not_called()
+    asyncio.run(vector_db.delete_documents(document_ids))
+
+    mock_chroma.return_value.delete.assert_called_once_with(document_ids)
+
+
+@patch("chatdoc.vector_db.Chroma")
+def test_missing_lexical_index_is_rebuilt_from_the_collection(mock_chroma, mock_collection, mock_embedding_fn):
+    """
+    A collection without a persisted lexical index (e.g. after a redeploy)
+    should get its index rebuilt from the documents stored in Chroma.
+    """
+    mock_chroma.return_value = MagicMock(spec=VectorStore)
+    mock_collection.get.return_value = {"ids": ["1", "2"], "documents": ["Artikel 7:658 BW", None]}
+
+    vector_db = VectorDatabase(collection_name="test", embedding_fn=mock_embedding_fn)
+
+    mock_collection.get.assert_called_once_with(include=["documents"], limit=1000, offset=0)
+    assert len(vector_db.lexical_index) == 2
+    assert vector_db.lexical_index.search("7:658", k=2)[0][0] == "1"
+    assert vector_db.lexical_index.file_path.exists()
+
+
+def test_flush_all_writes_every_buffer(mock_collection):
+    """
+    `flush_all` (which runs on exit) should write the pending documents of every collection.
+    """
+    for collection_name in ("first", "second"):
+        ChromaClientRegistry.get_write_buffer(collection_name).add(
+            [collection_name], [Document(page_content=collection_name)], [[1.0]]
+        )
+
+    ChromaClientRegistry.flush_all()
+
+    assert mock_collection.upsert.call_count == 2
+
+
+@pytest.fixture(name="mock_vectorstore")
+def mock_vectorstore_fixture():
+    """
+    Returns a mock vector store whose embedding function embeds every query to
+    the same vector, and whose MMR search returns two documents.
+    """
+    vectorstore = MagicMock(spec=VectorStore)
+    vectorstore.embeddings = MagicMock()
+    vectorstore.embeddings.model = "test-model"
+    vectorstore.embeddings.embed_query.return_value = [0.1, 0.2]
+    vectorstore.max_marginal_relevance_search_by_vector.side_effect = lambda *_, **__: [
+        Document(page_content="first"),
+        Document(page_content="second"),
+    ]
+    return vectorstore
+
+
+def build_retriever(vectorstore, query_embedding_cache=None) -> CustomVectorStoreRetriever:
+    return CustomVectorStoreRetriever(
+        vectorstore=vectorstore,
+        query_embedding_cache=query_embedding_cache,
+        search_type="mmr",
+        search_kwargs={"k": 2, "score_threshold": 0.8, "fetch_k": 10, "lambda_mult": 0.2},
+    )
+
+
+def test_retriever_searches_by_vector_and_ranks_documents(mock_vectorstore):
+    retriever = build_retriever(mock_vectorstore)
+
+    docs = retriever.get_relevant_documents("What is DoRA?")
+
+    mock_vectorstore.max_marginal_relevance_search_by_vector.assert_called_once_with(
+        [0.1, 0.2], k=2, fetch_k=10, lambda_mult=0.2, filter=None
+    )
+    assert [doc.metadata["ranking"] for doc in docs] == [1, 2]
+
+
+def test_retriever_reuses_cached_query_embeddings(mock_vectorstore):
+    """
+    Repeating a question (up to case and whitespace) should not embed it again.
+    """
+    query_embedding_cache = QueryEmbeddingCache(max_size=8, ttl_seconds=60)
+    retriever = build_retriever(mock_vectorstore, query_embedding_cache)
+
+    retriever.get_relevant_documents("What is DoRA?")
+    retriever.get_relevant_documents("  what is   DoRA? ")
+    asyncio.run(retriever.aget_relevant_documents("WHAT IS DORA?"))
+
+    mock_vectorstore.embeddings.embed_query.assert_called_once_with("What is DoRA?")
+    assert query_embedding_cache.hits == 2
+    assert query_embedding_cache.misses == 1
+
+
+def test_async_retrieval_embeds_asynchronously_and_searches_off_the_event_loop(mock_vectorstore):
+    """
+    Async retrieval should use the async embedding client and run the
+    blocking Chroma query in a worker thread.
+    """
+    mock_vectorstore.embeddings.aembed_query = AsyncMock(return_value=[0.3, 0.4])
+    search_threads = []
+    mock_vectorstore.max_marginal_relevance_search_by_vector.side_effect = lambda *_, **__: (
+        search_threads.append(threading.get_ident()) or [Document(page_content="first")]
+    )
+    retriever = build_retriever(mock_vectorstore)
+
+    docs = asyncio.run(retriever.aget_relevant_documents("What is DoRA?"))
+
+    mock_vectorstore.embeddings.aembed_query.assert_awaited_once_with("What is DoRA?")
+    mock_vectorstore.embeddings.embed_query.assert_not_called()
+    mock_vectorstore.max_marginal_relevance_search_by_vector.assert_called_once_with(
+        [0.3, 0.4], k=2, fetch_k=10, lambda_mult=0.2, filter=None
+    )
+    assert search_threads != [threading.get_ident()]
+    assert [doc.metadata["ranking"] for doc in docs] == [1]
+
+
+@pytest.mark.parametrize("lambda_mult", [0.0, 0.2, 0.5, 1.0])
+def test_maximal_marginal_relevance_matches_langchain(lambda_mult):
+    """
+    The vectorized MMR should select the same candidates, in the same order,
+    as LangChain's reference implementation.
+    """
+    rng = np.random.default_rng(42)
+    query_embedding = rng.normal(size=16)
+    candidate_embeddings = rng.normal(size=(50, 16))
+
+    selected, scores = maximal_marginal_relevance(
+        query_embedding.tolist(), candidate_embeddings.tolist(), 8, lambda_mult
+    )
+
+    assert selected == langchain_maximal_marginal_relevance(
+        query_embedding, list(candidate_embeddings), lambda_mult=lambda_mult, k=8
+    )
+    normalized = candidate_embeddings / np.linalg.norm(candidate_embeddings, axis=1, keepdims=True)
+    expected_scores = normalized[selected] @ (query_embedding / np.linalg.norm(query_embedding))
+    assert scores == pytest.approx(expected_scores.tolist())
+
+
+def test_maximal_marginal_relevance_handles_fewer_candidates_than_k():
+    assert maximal_marginal_relevance([1.0, 0.0], [], k=3, lambda_mult=0.5) == ([], [])
+    assert maximal_marginal_relevance([1.0, 0.0], [[0.0, 1.0], [1.0, 0.0]], k=3, lambda_mult=0.5)[0] == [1, 0]
+
+
+def test_mmr_retrieval_reranks_chroma_candidates_and_records_scores():
+    """
+    With a Chroma collection, MMR candidates should be fetched with their
+    embeddings in one query, re-ranked, and returned with their scores.
+    """
+    vectorstore = MagicMock(spec=VectorStore)
+    vectorstore.embeddings = MagicMock()
+    vectorstore.embeddings.embed_query.return_value = [1.0, 0.0]
+    vectorstore._collection = MagicMock()  # pylint: disable=protected-access
+    vectorstore._collection.query.return_value = {  # pylint: disable=protected-access
+        "documents": [["close", "duplicate", "diverse"]],
+        "metadatas": [[{"page": 1}, {"page": 2}, None]],
+        "embeddings": [[[1.0, 0.0], [1.0, 0.01], [0.6, 0.8]]],
+    }
+    retriever = build_retriever(vectorstore)
+
+    docs = retriever.get_relevant_documents("What is DoRA?")
+
+    vectorstore._collection.query.assert_called_once_with(  # pylint: disable=protected-access
+        query_embeddings=[[1.0, 0.0]], n_results=10, where=None, include=["documents", "metadatas", "embeddings"]
+    )
+    assert [doc.page_content for doc in docs] == ["close", "diverse"]
+    assert [doc.metadata["ranking"] for doc in docs] == [1, 2]
+    assert [doc.metadata["score"] for doc in docs] == pytest.approx([1.0, 0.6])
+
+
+@pytest.fixture(name="hybrid_retriever")
+def hybrid_retriever_fixture(tmp_path):
+    """
+    A hybrid retriever over a mock Chroma collection whose vector search
+    returns `vector-hit` and `both`, and a lexical index that matches `both`
+    and `identifier`.
+    """
+    vectorstore = MagicMock(spec=VectorStore)
+    vectorstore.embeddings = MagicMock()
+    vectorstore.embeddings.embed_query.return_value = [1.0, 0.0]
+    collection = vectorstore._collection = MagicMock()  # pylint: disable=protected-access
+    collection.query.return_value = {
+        "ids": [["vector-hit", "both"]],
+        "documents": [["about the duty of care", "article 7:658 and the duty of care"]],
+        "metadatas": [[{"page": 1}, {"page": 2}]],
+    }
+    collection.get.return_value = {"ids": ["identifier"], "documents": ["see 7:658"], "metadatas": [None]}
+    lexical_index = LexicalIndex("test", tmp_path / "test.json")
+    lexical_index.add_documents(["both", "identifier"], ["article 7:658 and the duty of care", "see 7:658"])
+    retriever = CustomVectorStoreRetriever(
+        vectorstore=vectorstore,
+        lexical_index=lexical_index,
+        search_type="hybrid",
+        search_kwargs={"k": 3, "score_threshold": 0.8, "fetch_k": 10, "lambda_mult": 0.2},
+    )
+    return retriever, vectorstore
+
+
+def test_hybrid_retrieval_fuses_vector_and_lexical_results(hybrid_retriever):
+    retriever, vectorstore = hybrid_retriever
+
+    docs = retriever.get_relevant_documents("What does article 7:658 say about the duty of care?")
+
+    vectorstore.embeddings.embed_query.assert_called_once()
+    vectorstore._collection.get.assert_called_once_with(  # pylint: disable=protected-access
+        ids=["identifier"], where=None, include=["documents", "metadatas"]
+    )
+    assert [doc.page_content for doc in docs][0] == "article 7:658 and the duty of care"
+    assert {doc.page_content for doc in docs} == {
+        "article 7:658 and the duty of care",
+        "about the duty of care",
+        "see 7:658",
+    }
+    assert [doc.metadata["ranking"] for doc in docs] == [1, 2, 3]
+    assert docs[0].metadata["score"] > docs[1].metadata["score"]
+
+
+def test_identifier_lookups_skip_the_embedding_call(hybrid_retriever):
+    retriever, vectorstore = hybrid_retriever
+    vectorstore._collection.get.return_value = {  # pylint: disable=protected-access
+        "ids": ["both", "identifier"],
+        "documents": ["article 7:658 and the duty of care", "see 7:658"],
+        "metadatas": [{"page": 2}, None],
+    }
+
+    docs = asyncio.run(retriever.aget_relevant_documents("7:658"))
+
+    vectorstore.embeddings.embed_query.assert_not_called()
+    vectorstore._collection.query.assert_not_called()  # pylint: disable=protected-access
+    assert [doc.page_content for doc in docs] == ["see 7:658", "article 7:658 and the duty of care"]
+
+
+@patch("chatdoc.vector_db.Chroma")
+def test_vector_database_keeps_the_lexical_index_in_sync(mock_chroma, mock_collection, mock_embedding_fn, tmp_path):
+    """
+    Added documents should be indexed and persisted when flushed, and deleted
+    documents removed from the index again.
+    """
+    mock_chroma.return_value = MagicMock(spec=VectorStore)
+    vector_db = VectorDatabase(collection_name="test", embedding_fn=mock_embedding_fn)
+
+    document_ids = asyncio.run(vector_db.add_embedded_documents([Document(page_content="see 7:658")], [[1.0]]))
+    asyncio.run(vector_db.flush())
+
+    mock_collection.upsert.assert_called_once()
+    assert LexicalIndex.load("test").search("7:658", k=1)[0][0] == document_ids[0]
+
+    asyncio.run(vector_db.delete_documents(document_ids))
+
+    assert LexicalIndex.load("test").search("7:658", k=1) == []
+    assert (tmp_path / "test.json").exists()
+
+
+def test_query_embedding_cache_is_keyed_by_model():
+    query_embedding_cache = QueryEmbeddingCache(max_size=8, ttl_seconds=60)
+    first_embedding_fn, second_embedding_fn = MagicMock(), MagicMock()
+    first_embedding_fn.model = "model-a"
+    second_embedding_fn.model = "model-b"
+
+    query_embedding_cache.embed_query(first_embedding_fn, "question")
+    query_embedding_cache.embed_query(second_embedding_fn, "question")
+
+    first_embedding_fn.embed_query.assert_called_once()
+    second_embedding_fn.embed_query.assert_called_once()
+
+
+@patch("chatdoc.vector_db.Chroma")
+def test_changing_documents_invalidates_cached_answers(mock_chroma, mock_collection, mock_embedding_fn):
+    """
+    Adding or deleting documents should drop the cached answers that only
+    the collection used, but keep those other collections still use.
+    """
+    mock_chroma.return_value = MagicMock(spec=VectorStore)
+    vector_db = VectorDatabase(collection_name="test", embedding_fn=mock_embedding_fn)
+    answer_cache = AnswerCache.get_shared_cache()
+
+    def cache_answers() -> None:
+        answer_cache.put("test", "fp", PromptMode.DEFAULT, "What is DoRA?", [1.0], "A chatbot.", {})
+        answer_cache.put("test", "fp", PromptMode.DEFAULT, "Who made DoRA?", [1.0], "A team.", {})
+        answer_cache.get("other", "fp", PromptMode.DEFAULT, "Who made DoRA?", [1.0])
+
+    def cached_questions() -> list[str]:
+        return [key[2] for key, _ in answer_cache.answers.items()]
+
+    cache_answers()
+    document_ids = asyncio.run(vector_db.add_embedded_documents([Document(page_content="DoRA")], [[1.0]]))
+
+    assert cached_questions() == ["who made dora?"]
+
+    cache_answers()
+    asyncio.run(vector_db.delete_documents(document_ids))
+
+    assert cached_questions() == ["who made dora?"]